@@ -0,0 +1,166 @@
+import datetime
+from dataclasses import dataclass
+
+
+@dataclass
+class Aggregate:
+    """
+    Агрегатная таблица по корзинам (ключ, неделя). query - SELECT колонок
+    columns для корзин из CTE buckets (ключ..., week) по исходной таблице
+    {source} - дневной таблице source или ее представлению в текущем
+    режиме хранения
+    """
+
+    table: str
+    columns: tuple
+    key_fields: tuple
+    key_types: tuple
+    source: str
+    query: str
+
+
+AGGREGATES = {
+    "warehouse_tariffs": Aggregate(
+        table="wb_warehouses_tariffs_weekly",
+        columns=(
+            "warehouse_name",
+            "week",
+            "days",
+            "avg_box_delivery_and_storage_expr",
+            "min_box_delivery_and_storage_expr",
+            "max_box_delivery_and_storage_expr",
+            "avg_box_delivery_base",
+            "avg_pallet_delivery_expr",
+            "changes",
+        ),
+        key_fields=("warehouse_name",),
+        key_types=("varchar",),
+        source="wb_warehouses_tariffs",
+        query="""
+            SELECT buckets.warehouse_name, buckets.week, count(*),
+                avg(days.box_delivery_and_storage_expr),
+                min(days.box_delivery_and_storage_expr),
+                max(days.box_delivery_and_storage_expr),
+                avg(days.box_delivery_base),
+                avg(days.pallet_delivery_expr),
+                count(*) FILTER (
+                    WHERE days.previous_date IS NOT NULL
+                    AND days.previous IS DISTINCT FROM days.box_delivery_and_storage_expr
+                )
+            FROM buckets
+            JOIN LATERAL (
+                SELECT date, box_delivery_and_storage_expr, box_delivery_base,
+                    pallet_delivery_expr,
+                    lag(date) OVER w AS previous_date,
+                    lag(box_delivery_and_storage_expr) OVER w AS previous
+                FROM {source} source
+                WHERE source.warehouse_name = buckets.warehouse_name
+                    AND source.date >= buckets.week - 1 AND source.date < buckets.week + 7
+                WINDOW w AS (ORDER BY date)
+            ) days ON days.date >= buckets.week
+            GROUP BY buckets.warehouse_name, buckets.week
+        """,
+    ),
+    "acceptance_coefficients": Aggregate(
+        table="wb_acceptance_coefficients_weekly",
+        columns=(
+            "warehouse_name",
+            "acceptance_type",
+            "week",
+            "days",
+            "available_days",
+            "free_days",
+            "avg_coefficient",
+            "min_coefficient",
+            "max_coefficient",
+            "changes",
+        ),
+        key_fields=("warehouse_name", "acceptance_type"),
+        key_types=("varchar", "int"),
+        source="wb_acceptance_coefficients",
+        query="""
+            SELECT buckets.warehouse_name, buckets.acceptance_type, buckets.week, count(*),
+                count(*) FILTER (WHERE days.coefficient >= 0),
+                count(*) FILTER (WHERE days.coefficient = 0),
+                avg(days.coefficient) FILTER (WHERE days.coefficient >= 0),
+                min(days.coefficient) FILTER (WHERE days.coefficient >= 0),
+                max(days.coefficient),
+                count(*) FILTER (
+                    WHERE days.previous_date IS NOT NULL
+                    AND days.previous IS DISTINCT FROM days.coefficient
+                )
+            FROM buckets
+            JOIN LATERAL (
+                SELECT date, coefficient,
+                    lag(date) OVER w AS previous_date,
+                    lag(coefficient) OVER w AS previous
+                FROM {source} source
+                WHERE source.warehouse_name = buckets.warehouse_name
+                    AND source.acceptance_type = buckets.acceptance_type
+                    AND source.date >= buckets.week - 1 AND source.date < buckets.week + 7
+                WINDOW w AS (ORDER BY date)
+            ) days ON days.date >= buckets.week
+            GROUP BY buckets.warehouse_name, buckets.acceptance_type, buckets.week
+        """,
+    ),
+    # В wb_commission_rates пишутся только изменившиеся ставки: каждая строка
+    # с предыдущей ставкой предмета - изменение, без нее - новый предмет
+    "commission_rates": Aggregate(
+        table="wb_commission_rates_weekly",
+        columns=(
+            "category_name",
+            "week",
+            "changes",
+            "new_items",
+            "items",
+            "avg_fbo_rate",
+            "min_fbo_rate",
+            "max_fbo_rate",
+            "avg_fbo_rate_delta",
+            "avg_fbs_rate_delta",
+        ),
+        key_fields=("category_name",),
+        key_types=("varchar",),
+        source="wb_commission_rates",
+        query="""
+            SELECT buckets.category_name, buckets.week,
+                count(*) FILTER (WHERE changes.previous_date IS NOT NULL),
+                count(*) FILTER (WHERE changes.previous_date IS NULL),
+                count(DISTINCT changes.item_name),
+                avg(changes.fbo_rate),
+                min(changes.fbo_rate),
+                max(changes.fbo_rate),
+                avg(changes.fbo_rate - changes.previous_fbo_rate),
+                avg(changes.fbs_rate - changes.previous_fbs_rate)
+            FROM buckets
+            JOIN LATERAL (
+                SELECT item_name, date, fbo_rate, fbs_rate,
+                    lag(date) OVER w AS previous_date,
+                    lag(fbo_rate) OVER w AS previous_fbo_rate,
+                    lag(fbs_rate) OVER w AS previous_fbs_rate
+                FROM {source} source
+                WHERE source.category_name = buckets.category_name
+                    AND source.date < buckets.week + 7
+                WINDOW w AS (PARTITION BY item_name ORDER BY date)
+            ) changes ON changes.date >= buckets.week
+            GROUP BY buckets.category_name, buckets.week
+        """,
+    ),
+}
+
+
+def week_start(date: datetime.date) -> datetime.date:
+    return date - datetime.timedelta(days=date.weekday())
+
+
+def affected_buckets(aggregate: Aggregate, data: list[dict]) -> list[tuple]:
+    """
+    Корзины (ключ..., неделя), которые затрагивают строки пакета. Строка
+    последнего дня недели влияет и на число изменений следующей недели
+    """
+    buckets = set()
+    for row in data:
+        key = tuple(row[field] for field in aggregate.key_fields)
+        buckets.add(key + (week_start(row["date"]),))
+        buckets.add(key + (week_start(row["date"] + datetime.timedelta(days=1)),))
+    return list(buckets)
@@ -0,0 +1,90 @@
+"""
+Бенчмарк пакетного расчета стоимости логистики на синтетических данных.
+Запуск из корня проекта: python -m benchmarks.cost_calculator_bench [число SKU]
+"""
+import datetime
+import sys
+import time
+
+import numpy as np
+
+from cost_calculator import LogisticsCostCalculator, TariffArrays, category_key
+
+WAREHOUSES = 250
+CATEGORIES = 7000
+
+
+def build_tariffs(rng: np.random.Generator) -> TariffArrays:
+    warehouse_names = np.array(sorted(f"Склад {i}" for i in range(WAREHOUSES)), dtype=str)
+    category_keys = np.array(
+        sorted(category_key(f"Категория {i % 100}", f"Предмет {i}") for i in range(CATEGORIES)),
+        dtype=str,
+    )
+
+    def tariff(low, high):
+        return rng.uniform(low, high, WAREHOUSES)
+
+    return TariffArrays(
+        date=datetime.date.today(),
+        warehouse_names=warehouse_names,
+        box_delivery_base=tariff(30, 80),
+        box_delivery_liter=tariff(5, 15),
+        box_storage_base=tariff(0.05, 0.2),
+        box_storage_liter=tariff(0.01, 0.1),
+        pallet_delivery_base=tariff(30, 80),
+        pallet_delivery_liter=tariff(5, 15),
+        pallet_storage=tariff(20, 40),
+        box_acceptance_coefficient=rng.integers(-1, 20, WAREHOUSES).astype(float),
+        pallet_acceptance_coefficient=rng.integers(-1, 20, WAREHOUSES).astype(float),
+        category_keys=category_keys,
+        fbo_rate=rng.uniform(5, 25, CATEGORIES),
+        fbs_rate=rng.uniform(5, 25, CATEGORIES),
+        logistics_coefficient=1.1,
+        localization_index=1.05,
+    )
+
+
+def measure(title: str, func, repeats: int = 3):
+    timings = []
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    print(f"{title:<32} {min(timings) * 1000:10.1f} ms")
+    return result
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    rng = np.random.default_rng(42)
+    tariffs = build_tariffs(rng)
+    calculator = LogisticsCostCalculator(tariffs)
+
+    warehouse_names = tariffs.warehouse_names[rng.integers(0, WAREHOUSES, size)]
+    category_numbers = rng.integers(0, CATEGORIES, size)
+    category_names = np.char.add("Категория ", (category_numbers % 100).astype(str))
+    item_names = np.char.add("Предмет ", category_numbers.astype(str))
+    volumes = rng.uniform(0.1, 200, size)
+    prices = rng.uniform(100, 20000, size)
+    is_pallet = rng.random(size) < 0.1
+
+    print(f"SKU: {size}")
+    warehouse_indices = measure(
+        "warehouse_indices", lambda: calculator.warehouse_indices(warehouse_names)
+    )
+    category_indices = measure(
+        "category_indices", lambda: calculator.category_indices(category_names, item_names)
+    )
+    result = measure(
+        "calculate",
+        lambda: calculator.calculate(
+            volumes, prices, category_indices, warehouse_indices,
+            is_pallet=is_pallet, storage_days=30,
+        ),
+    )
+    print(f"{'total mean':<32} {np.nanmean(result['total']):10.2f}")
+
+
+if __name__ == "__main__":
+    main()
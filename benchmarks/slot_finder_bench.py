@@ -0,0 +1,100 @@
+"""
+Бенчмарк поиска слотов поставки на синтетических данных.
+Запуск из корня проекта: python -m benchmarks.slot_finder_bench [число складов]
+"""
+import datetime
+import sys
+import time
+
+import numpy as np
+
+from slot_finder import TARIFF_COLUMNS, SlotFinder, build_snapshot
+
+DAYS = 14
+ACCEPTANCE_TYPES = (2, 5, 6)
+TARIFF_DAYS = 4
+
+
+def build_rows(rng: np.random.Generator, warehouses: int):
+    today = datetime.date.today()
+    acceptance = [
+        {
+            "date": today + datetime.timedelta(days=day),
+            "warehouse_name": f"Склад {warehouse}",
+            "acceptance_type": acceptance_type,
+            "coefficient": int(rng.integers(0, 21)),
+        }
+        for warehouse in range(warehouses)
+        for day in range(DAYS)
+        for acceptance_type in ACCEPTANCE_TYPES
+    ]
+    # Тарифы известны на несколько дней вперед, дальше действует последний
+    tariffs = [
+        {
+            "date": today + datetime.timedelta(days=day),
+            "warehouse_name": f"Склад {warehouse}",
+            **dict(zip(TARIFF_COLUMNS, rng.uniform(0.05, 80, len(TARIFF_COLUMNS)))),
+        }
+        for warehouse in range(warehouses)
+        for day in range(TARIFF_DAYS)
+    ]
+    return acceptance, tariffs
+
+
+def brute_force(acceptance, tariffs, volume, max_coefficient, storage_days, top):
+    today = datetime.date.today()
+    latest = {}
+    for row in sorted(tariffs, key=lambda row: row["date"]):
+        latest.setdefault(row["warehouse_name"], []).append(row)
+    options = []
+    for row in acceptance:
+        if row["acceptance_type"] != 2 or row["coefficient"] > max_coefficient:
+            continue
+        if not today <= row["date"] < today + datetime.timedelta(days=7):
+            continue
+        tariff = [item for item in latest[row["warehouse_name"]] if item["date"] <= row["date"]][-1]
+        extra_liters = max(volume - 1.0, 0.0)
+        delivery = tariff["box_delivery_base"] + extra_liters * tariff["box_delivery_liter"]
+        storage = tariff["box_storage_base"] + extra_liters * tariff["box_storage_liter"]
+        options.append((delivery + storage * storage_days, row["warehouse_name"], row["date"]))
+    return sorted(options, key=lambda option: (option[0], option[2], option[1]))[:top]
+
+
+def measure(title: str, func, repeats: int = 5):
+    timings = []
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    print(f"{title:<32} {min(timings) * 1000:10.3f} ms")
+    return result
+
+
+def main():
+    warehouses = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    rng = np.random.default_rng(42)
+    acceptance, tariffs = build_rows(rng, warehouses)
+    print(f"Слотов: {len(acceptance)}, строк тарифов: {len(tariffs)}")
+
+    finder = SlotFinder(db_client=None)
+    finder._snapshot = measure("build_snapshot", lambda: build_snapshot(acceptance, tariffs), 1)
+    result = measure(
+        "find",
+        lambda: finder.find(2, volume=50, days=7, max_coefficient=5, storage_days=30),
+        100,
+    )
+    expected = measure(
+        "brute force",
+        lambda: brute_force(acceptance, tariffs, 50, 5, 30, 10),
+        1,
+    )
+    found = [(item["total"], item["warehouse_name"], item["date"]) for item in result]
+    matches = all(
+        abs(a[0] - b[0]) < 1e-6 and a[1:] == b[1:] for a, b in zip(found, expected)
+    )
+    print(f"{'matches brute force':<32} {matches and len(found) == len(expected)}")
+
+
+if __name__ == "__main__":
+    main()
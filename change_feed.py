@@ -0,0 +1,104 @@
+import asyncio
+import datetime
+import json
+import logging
+from typing import Awaitable, Callable
+
+import asyncpg
+
+from db_client import CHANGE_FEED_CHANNEL, DBClient
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_DELAY = 5
+
+
+class ChangeFeedSubscriber:
+    """
+    Подписка на изменения тарифов через LISTEN/NOTIFY.
+    Обработчик получает словарь {"dataset", "dates", "keys"}; даты приводятся
+    к datetime.date, ключи - к кортежам. Уведомления, вынесенные в
+    wb_change_feed, дочитываются из таблицы. При обрыве соединения
+    подписка восстанавливается, а обработчики получают {"dataset": None},
+    так как уведомления за время обрыва потеряны
+    """
+
+    def __init__(self, db_client: DBClient):
+        self._db_client = db_client
+        self._handlers = []
+        self._connection = None
+        self._closed = False
+        self._reconnect_task = None
+        # Ссылки на задачи обработки, иначе их может собрать сборщик мусора
+        self._tasks = set()
+
+    def subscribe(self, handler: Callable[[dict], Awaitable[None]]) -> None:
+        self._handlers.append(handler)
+
+    async def start(self) -> None:
+        self._connection = await asyncpg.connect(
+            user=self._db_client.db_user,
+            password=self._db_client.db_password,
+            database=self._db_client.db_name,
+            host=self._db_client.db_host,
+            port=self._db_client.db_port,
+        )
+        self._connection.add_termination_listener(self._on_termination)
+        await self._connection.add_listener(CHANGE_FEED_CHANNEL, self._on_notify)
+        logger.info(f"Подписка на канал {CHANGE_FEED_CHANNEL}")
+
+    async def close(self) -> None:
+        self._closed = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+        if self._connection is not None and not self._connection.is_closed():
+            await self._connection.close()
+
+    def _on_notify(self, connection, pid, channel, payload) -> None:
+        task = asyncio.create_task(self._dispatch(json.loads(payload)))
+        self._tasks.add(task)
+        task.add_done_callback(self._on_task_done)
+
+    def _on_task_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Ошибка получения изменения: {task.exception()!r}")
+
+    def _on_termination(self, connection) -> None:
+        if not self._closed and self._reconnect_task is None:
+            self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        while not self._closed:
+            await asyncio.sleep(RECONNECT_DELAY)
+            try:
+                await self.start()
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.warning(f"Не удалось переподключиться к каналу изменений: {e}")
+                continue
+            self._reconnect_task = None
+            await self._dispatch({"dataset": None})
+            return
+
+    async def _dispatch(self, change: dict) -> None:
+        if "change_id" in change:
+            payload = await self._db_client.pool.fetchval(
+                "SELECT payload FROM wb_change_feed WHERE id = $1", change["change_id"]
+            )
+            if payload is None:
+                logger.warning(
+                    f"Запись wb_change_feed {change['change_id']} удалена по сроку хранения"
+                )
+                return
+            change = json.loads(payload)
+        change["dates"] = [
+            datetime.date.fromisoformat(date) for date in change.get("dates", [])
+        ]
+        change["keys"] = [tuple(key) for key in change.get("keys", [])]
+        for handler in self._handlers:
+            try:
+                await handler(change)
+            except Exception as e:
+                logger.error(f"Ошибка обработки изменения {change['dataset']}: {e}")
@@ -0,0 +1,122 @@
+import logging
+import os
+import time
+
+from dotenv import load_dotenv
+from yarl import URL
+
+from exceptions import CircuitOpenException
+from metrics import metrics
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Число ошибок подряд, после которого запросы к эндпоинту прекращаются
+FAILURE_THRESHOLD = int(os.getenv("WB_BREAKER_FAILURE_THRESHOLD", "5"))
+# Через сколько секунд после размыкания пропускаются пробные запросы
+RECOVERY_TIMEOUT = float(os.getenv("WB_BREAKER_RECOVERY_SECONDS", "30"))
+# Сколько пробных запросов пропускается одновременно в полуоткрытом состоянии
+HALF_OPEN_REQUESTS = int(os.getenv("WB_BREAKER_HALF_OPEN_REQUESTS", "1"))
+
+
+class CircuitBreaker:
+    """
+    Автомат для одного эндпоинта WB.
+    closed - запросы идут, ошибки считаются;
+    open - запросы сразу отклоняются до истечения recovery_timeout;
+    half_open - пропускается ограниченное число пробных запросов,
+    успех замыкает автомат, ошибка снова размыкает
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = FAILURE_THRESHOLD,
+        recovery_timeout: float = RECOVERY_TIMEOUT,
+        half_open_requests: int = HALF_OPEN_REQUESTS,
+    ):
+        self.name = name
+        self._failure_threshold = failure_threshold
+        self._recovery_timeout = recovery_timeout
+        self._half_open_requests = half_open_requests
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trials = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self._recovery_timeout:
+            self._state = self.HALF_OPEN
+            self._trials = 0
+        return self._state
+
+    def before_request(self) -> None:
+        """
+        Проверка перед запросом: в разомкнутом состоянии и при исчерпанных
+        пробных запросах выбрасывается CircuitOpenException
+        """
+        state = self.state
+        if state == self.CLOSED:
+            return
+        if state == self.HALF_OPEN and self._trials < self._half_open_requests:
+            self._trials += 1
+            return
+        metrics.increment("circuit_breaker.rejected")
+        retry_in = max(self._opened_at + self._recovery_timeout - time.monotonic(), 0)
+        raise CircuitOpenException(
+            f"Эндпоинт {self.name} недоступен, повтор через {retry_in:.0f} с"
+        )
+
+    def release(self) -> None:
+        """
+        Возврат пробного запроса, который был отменен без ответа
+        """
+        if self._state == self.HALF_OPEN and self._trials:
+            self._trials -= 1
+
+    def record_success(self) -> None:
+        if self._state != self.CLOSED:
+            logger.info(f"Эндпоинт {self.name} снова доступен")
+        self._state = self.CLOSED
+        self._failures = 0
+        self._trials = 0
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._state == self.HALF_OPEN or self._failures >= self._failure_threshold:
+            if self._state != self.OPEN:
+                logger.warning(
+                    f"Эндпоинт {self.name} отключен на {self._recovery_timeout:.0f} с "
+                    f"после {self._failures} ошибок подряд"
+                )
+                metrics.increment("circuit_breaker.opened")
+            self._state = self.OPEN
+            self._opened_at = time.monotonic()
+
+
+# Автоматы общие для всех экземпляров WbParser в процессе
+_breakers = {}
+
+
+def get_breaker(url: str) -> CircuitBreaker:
+    """
+    Автомат для хоста и пути запроса, параметры запроса не учитываются
+    """
+    parsed = URL(url)
+    key = (parsed.host, parsed.path)
+    breaker = _breakers.get(key)
+    if breaker is None:
+        breaker = CircuitBreaker(f"{parsed.host}{parsed.path}")
+        _breakers[key] = breaker
+        metrics.gauge(
+            f"circuit_breaker.{breaker.name}.state",
+            lambda: CircuitBreaker.STATE_CODES[breaker.state],
+        )
+    return breaker
@@ -0,0 +1,229 @@
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+
+from db_client import DBClient, DAILY_TABLES_KEYS
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 5000
+
+
+class HistoryCompactor:
+    """
+    Удаление подряд идущих дубликатов из дневной таблицы тарифов.
+    Строки читаются серверным курсором в порядке (ключ, дата), в целевую
+    таблицу через COPY пишутся только строки, значения которых отличаются
+    от предыдущей строки того же ключа. После каждой пачки в той же
+    транзакции сохраняется позиция, поэтому прерванный запуск продолжается
+    с места остановки. Строки с NULL в ключе при продолжении не учитываются
+    """
+
+    def __init__(
+        self,
+        db_client: DBClient,
+        source_table: str,
+        target_table: str = None,
+        batch_size: int = BATCH_SIZE,
+    ):
+        self._db_client = db_client
+        self._source_table = source_table
+        self._target_table = target_table or f"{source_table}_compacted"
+        self._key_fields = list(DAILY_TABLES_KEYS[source_table])
+        self._order_fields = [*self._key_fields, "date"]
+        self._batch_size = batch_size
+        self._columns = []
+        self._value_fields = []
+
+    async def _prepare(self) -> None:
+        sequence = f"{self._target_table}_id_seq"
+        async with self._db_client.pool.acquire() as connection:
+            async with connection.transaction():
+                await connection.execute(
+                    f"CREATE TABLE IF NOT EXISTS {self._target_table} "
+                    f"(LIKE {self._source_table} INCLUDING ALL)"
+                )
+                # LIKE копирует умолчание id вместе со ссылкой на
+                # последовательность исходной таблицы: у целевой - своя
+                if not await connection.fetchval("SELECT to_regclass($1) IS NOT NULL", sequence):
+                    await connection.execute(
+                        f"CREATE SEQUENCE {sequence} OWNED BY {self._target_table}.id"
+                    )
+                    await connection.execute(
+                        f"SELECT setval('{sequence}', max(id)) FROM {self._target_table} "
+                        f"HAVING max(id) IS NOT NULL"
+                    )
+                await connection.execute(
+                    f"ALTER TABLE {self._target_table} "
+                    f"ALTER COLUMN id SET DEFAULT nextval('{sequence}')"
+                )
+        await self._db_client.pool.execute(
+            """
+            CREATE TABLE IF NOT EXISTS wb_compaction_progress (
+                source_table VARCHAR,
+                target_table VARCHAR,
+                position JSONB,
+                rows_read BIGINT DEFAULT 0,
+                rows_written BIGINT DEFAULT 0,
+                finished BOOLEAN DEFAULT FALSE,
+                updated_at TIMESTAMP DEFAULT now(),
+                PRIMARY KEY (source_table, target_table)
+            );
+            """
+        )
+        rows = await self._db_client.pool.fetch(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = $1 "
+            "AND column_name <> 'id' ORDER BY ordinal_position",
+            self._source_table,
+        )
+        self._columns = [row["column_name"] for row in rows]
+        self._value_fields = [
+            column for column in self._columns if column not in self._order_fields
+        ]
+
+    async def _load_progress(self, restart: bool):
+        if restart:
+            await self._db_client.pool.execute(
+                "DELETE FROM wb_compaction_progress "
+                "WHERE source_table = $1 AND target_table = $2",
+                self._source_table,
+                self._target_table,
+            )
+            await self._db_client.pool.execute(f"TRUNCATE {self._target_table}")
+            return None
+        return await self._db_client.pool.fetchrow(
+            "SELECT position, rows_read, rows_written, finished "
+            "FROM wb_compaction_progress WHERE source_table = $1 AND target_table = $2",
+            self._source_table,
+            self._target_table,
+        )
+
+    def _decode_position(self, position: str) -> list:
+        values = json.loads(position)
+        values[-1] = datetime.date.fromisoformat(values[-1])
+        return values
+
+    async def _flush(self, batch, position, rows_read, rows_written, finished=False):
+        async with self._db_client.pool.acquire() as connection:
+            async with connection.transaction():
+                if batch:
+                    await connection.copy_records_to_table(
+                        self._target_table, records=batch, columns=self._columns
+                    )
+                await connection.execute(
+                    """
+                    INSERT INTO wb_compaction_progress (source_table, target_table,
+                        position, rows_read, rows_written, finished, updated_at)
+                    VALUES ($1, $2, $3::jsonb, $4, $5, $6, now())
+                    ON CONFLICT (source_table, target_table) DO UPDATE SET
+                        position = EXCLUDED.position, rows_read = EXCLUDED.rows_read,
+                        rows_written = EXCLUDED.rows_written,
+                        finished = EXCLUDED.finished, updated_at = now();
+                    """,
+                    self._source_table,
+                    self._target_table,
+                    json.dumps(position, default=str),
+                    rows_read,
+                    rows_written,
+                    finished,
+                )
+
+    async def run(self, restart: bool = False) -> None:
+        await self._prepare()
+        progress = await self._load_progress(restart)
+        if progress and progress["finished"]:
+            logger.info(f"{self._source_table} уже сжата в {self._target_table}")
+            return
+
+        order = ", ".join(self._order_fields)
+        # В интервальном и кодированном режимах дневные строки читаются из
+        # представления, исходная таблица не пополняется
+        source = self._db_client.source_table(self._source_table)
+        query = f"SELECT {', '.join(self._columns)} FROM {source}"
+        args = []
+        resume = progress is not None and progress["position"] is not None
+        if resume:
+            args = self._decode_position(progress["position"])
+            placeholders = ", ".join(f"${i + 1}" for i in range(len(args)))
+            # Первая строка - последняя обработанная, она служит "предыдущей"
+            query += f" WHERE ({order}) >= ({placeholders})"
+        query += f" ORDER BY {order}"
+
+        total = await self._db_client.pool.fetchval(
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass($1)",
+            source,
+        )
+        rows_read = progress["rows_read"] if resume else 0
+        rows_written = progress["rows_written"] if resume else 0
+        previous = None
+        position = args or None
+        batch = []
+        read_since_flush = 0
+
+        async with self._db_client.pool.acquire() as reader:
+            async with reader.transaction(isolation="repeatable_read", readonly=True):
+                async for record in reader.cursor(query, *args, prefetch=self._batch_size):
+                    key = tuple(record[field] for field in self._key_fields)
+                    values = tuple(record[field] for field in self._value_fields)
+                    if resume and previous is None:
+                        previous = (key, values)
+                        continue
+                    if previous != (key, values):
+                        batch.append(tuple(record[column] for column in self._columns))
+                    previous = (key, values)
+                    position = [record[field] for field in self._order_fields]
+                    rows_read += 1
+                    read_since_flush += 1
+                    if read_since_flush >= self._batch_size:
+                        rows_written += len(batch)
+                        await self._flush(batch, position, rows_read, rows_written)
+                        self._log_progress(rows_read, rows_written, total)
+                        batch = []
+                        read_since_flush = 0
+
+        rows_written += len(batch)
+        await self._flush(batch, position, rows_read, rows_written, finished=True)
+        self._log_progress(rows_read, rows_written, total)
+        logger.info(f"Сжатие {self._source_table} в {self._target_table} завершено")
+
+    def _log_progress(self, rows_read: int, rows_written: int, total: int) -> None:
+        percent = f"{rows_read / total:.1%}" if total and total > 0 else "?"
+        logger.info(
+            f"{self._source_table}: прочитано {rows_read} ({percent}), "
+            f"записано {rows_written}, удалено дубликатов {rows_read - rows_written}"
+        )
+
+
+async def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(filename)s:%(lineno)d #%(levelname)-8s "
+               "[%(asctime)s] - %(name)s - %(message)s",
+    )
+    parser = argparse.ArgumentParser(
+        description="Сжатие истории дневной таблицы тарифов без подряд идущих дубликатов"
+    )
+    parser.add_argument("table", choices=list(DAILY_TABLES_KEYS))
+    parser.add_argument("--target", help="целевая таблица, по умолчанию <table>_compacted")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument(
+        "--restart", action="store_true", help="начать заново, очистив целевую таблицу"
+    )
+    args = parser.parse_args()
+
+    db_client = DBClient()
+    await db_client.create_pool()
+    logger.info("Database connected")
+    compactor = HistoryCompactor(
+        db_client, args.table, target_table=args.target, batch_size=args.batch_size
+    )
+    await compactor.run(restart=args.restart)
+    await db_client.close_pool()
+    logger.info("Database disconnected")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
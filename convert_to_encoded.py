@@ -0,0 +1,106 @@
+import argparse
+import asyncio
+import logging
+
+from db_client import DBClient
+from encoding import ENCODED_TABLES, encoded_column
+
+logger = logging.getLogger(__name__)
+
+
+async def convert_table(
+    db_client: DBClient, source_table: str, replace: bool = False
+) -> None:
+    """
+    Перенос истории дневной таблицы в кодированную: значения строковых
+    колонок добавляются в словари и заменяются их id
+    """
+    encoded = ENCODED_TABLES[source_table]
+    columns = await db_client.pool.fetch(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = $1 "
+        "AND column_name <> 'id' ORDER BY ordinal_position",
+        source_table,
+    )
+    columns = [row["column_name"] for row in columns]
+    target_columns = [
+        encoded_column(column) if column in encoded.columns else column for column in columns
+    ]
+    select = [
+        f"{column}.id" if column in encoded.columns else f"source.{column}"
+        for column in columns
+    ]
+    joins = [
+        f"LEFT JOIN {dictionary} {column} ON {column}.value = source.{column}"
+        for column, dictionary in encoded.columns.items()
+    ]
+
+    async with db_client.pool.acquire() as connection:
+        async with connection.transaction():
+            existing = await connection.fetchval(f"SELECT count(*) FROM {encoded.table}")
+            if existing and not replace:
+                logger.warning(
+                    f"Таблица {encoded.table} не пуста ({existing} строк), "
+                    f"пропускаем. Для перезаписи используйте --replace"
+                )
+                return
+            await connection.execute(f"DELETE FROM {encoded.table}")
+            for column, dictionary in encoded.columns.items():
+                # Только новые значения: конфликт вставки расходует номер id
+                await connection.execute(
+                    f"INSERT INTO {dictionary} (value) "
+                    f"SELECT {column} FROM {source_table} WHERE {column} IS NOT NULL "
+                    f"EXCEPT SELECT value FROM {dictionary}"
+                )
+            await connection.execute(
+                f"""
+                INSERT INTO {encoded.table} ({', '.join(target_columns)})
+                SELECT {', '.join(select)}
+                FROM {source_table} source {' '.join(joins)}
+                ON CONFLICT DO NOTHING;
+                """
+            )
+            source_count = await connection.fetchval(f"SELECT count(*) FROM {source_table}")
+            encoded_count = await connection.fetchval(f"SELECT count(*) FROM {encoded.table}")
+            sizes = await connection.fetchrow(
+                "SELECT pg_total_relation_size($1::regclass) AS source, "
+                "pg_total_relation_size($2::regclass) AS encoded",
+                source_table,
+                encoded.table,
+            )
+    logger.info(
+        f"{source_table}: {source_count} строк -> {encoded_count} строк в {encoded.table}, "
+        f"размер {sizes['source']} -> {sizes['encoded']} байт"
+    )
+
+
+async def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(filename)s:%(lineno)d #%(levelname)-8s "
+               "[%(asctime)s] - %(name)s - %(message)s",
+    )
+    parser = argparse.ArgumentParser(
+        description="Перенос дневной истории тарифов в кодированные таблицы со словарями"
+    )
+    parser.add_argument(
+        "--table", dest="tables", action="append", choices=list(ENCODED_TABLES),
+        help="таблица для обработки, по умолчанию все",
+    )
+    parser.add_argument(
+        "--replace", action="store_true", help="перезаписать непустые кодированные таблицы"
+    )
+    args = parser.parse_args()
+
+    db_client = DBClient()
+    await db_client.create_pool()
+    await db_client.create_tables()
+    logger.info("Database connected")
+    for table in args.tables or list(ENCODED_TABLES):
+        await convert_table(db_client, table, replace=args.replace)
+    await db_client.close_pool()
+    logger.info("Database disconnected")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
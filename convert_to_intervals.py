@@ -0,0 +1,92 @@
+import argparse
+import asyncio
+import logging
+
+from db_client import DBClient, INTERVAL_TABLES
+
+logger = logging.getLogger(__name__)
+
+
+async def convert_table(
+    db_client: DBClient, source_table: str, replace: bool = False
+) -> None:
+    """
+    Перенос истории дневной таблицы в интервальную.
+    Подряд идущие даты с одинаковыми значениями склеиваются в один интервал
+    """
+    target_table, key_fields = INTERVAL_TABLES[source_table]
+    columns = await db_client.pool.fetch(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = $1 "
+        "AND column_name NOT IN ('id', 'date') "
+        "ORDER BY ordinal_position",
+        source_table,
+    )
+    value_fields = [
+        row["column_name"] for row in columns if row["column_name"] not in key_fields
+    ]
+    fields = ", ".join([*key_fields, *value_fields])
+
+    async with db_client.pool.acquire() as connection:
+        async with connection.transaction():
+            existing = await connection.fetchval(f"SELECT count(*) FROM {target_table}")
+            if existing and not replace:
+                logger.warning(
+                    f"Таблица {target_table} не пуста ({existing} строк), "
+                    f"пропускаем. Для перезаписи используйте --replace"
+                )
+                return
+            await connection.execute(f"DELETE FROM {target_table}")
+            await connection.execute(
+                f"""
+                INSERT INTO {target_table} ({fields}, valid_from, valid_to)
+                SELECT {fields}, MIN(date), MAX(date)
+                FROM (
+                    SELECT {fields}, date,
+                        date - (ROW_NUMBER() OVER (
+                            PARTITION BY {fields} ORDER BY date
+                        ))::int AS island
+                    FROM {source_table}
+                    WHERE date IS NOT NULL
+                ) days
+                GROUP BY {fields}, island;
+                """
+            )
+            daily_count = await connection.fetchval(f"SELECT count(*) FROM {source_table}")
+            interval_count = await connection.fetchval(f"SELECT count(*) FROM {target_table}")
+    logger.info(
+        f"{source_table}: {daily_count} дневных строк -> "
+        f"{interval_count} интервалов в {target_table}"
+    )
+
+
+async def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(filename)s:%(lineno)d #%(levelname)-8s "
+               "[%(asctime)s] - %(name)s - %(message)s",
+    )
+    parser = argparse.ArgumentParser(
+        description="Конвертация дневной истории тарифов в интервалы valid_from/valid_to"
+    )
+    parser.add_argument(
+        "--table", dest="tables", action="append", choices=list(INTERVAL_TABLES),
+        help="таблица для обработки, по умолчанию все",
+    )
+    parser.add_argument(
+        "--replace", action="store_true", help="перезаписать непустые интервальные таблицы"
+    )
+    args = parser.parse_args()
+
+    db_client = DBClient()
+    await db_client.create_pool()
+    await db_client.create_tables()
+    logger.info("Database connected")
+    for table in args.tables or list(INTERVAL_TABLES):
+        await convert_table(db_client, table, replace=args.replace)
+    await db_client.close_pool()
+    logger.info("Database disconnected")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
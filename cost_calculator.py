@@ -0,0 +1,238 @@
+import datetime
+from dataclasses import dataclass
+
+import numpy as np
+
+from db_client import DBClient
+
+# Типы приемки WB: короба и монопаллеты
+BOX_ACCEPTANCE_TYPE = 2
+PALLET_ACCEPTANCE_TYPE = 5
+
+
+@dataclass
+class TariffArrays:
+    """
+    Тарифы на одну дату в виде массивов. Массивы складов выровнены по
+    отсортированному warehouse_names, массивы комиссий - по category_keys
+    """
+
+    date: datetime.date
+    warehouse_names: np.ndarray
+    box_delivery_base: np.ndarray
+    box_delivery_liter: np.ndarray
+    box_storage_base: np.ndarray
+    box_storage_liter: np.ndarray
+    pallet_delivery_base: np.ndarray
+    pallet_delivery_liter: np.ndarray
+    pallet_storage: np.ndarray
+    box_acceptance_coefficient: np.ndarray
+    pallet_acceptance_coefficient: np.ndarray
+    category_keys: np.ndarray
+    fbo_rate: np.ndarray
+    fbs_rate: np.ndarray
+    logistics_coefficient: float = 1.0
+    localization_index: float = 1.0
+
+    @classmethod
+    async def from_db(
+        cls, db_client: DBClient, date: datetime.date, seller_id: int = None
+    ) -> "TariffArrays":
+        """
+        Загрузка тарифов складов и коэффициентов приемки на дату, последних
+        на эту дату комиссий и, если указан seller_id, коэффициентов селлера
+        """
+        tariffs_source = (
+            "wb_warehouses_tariffs_on($1)"
+            if db_client.storage_mode == "interval"
+            else f"{db_client.source_table('wb_warehouses_tariffs')} WHERE date = $1"
+        )
+        tariffs = await db_client.pool.fetch(
+            f"SELECT warehouse_name, box_delivery_base, box_delivery_liter, "
+            f"box_storage_base, box_storage_liter, pallet_delivery_value_base, "
+            f"pallet_delivery_value_liter, pallet_storage_value_expr "
+            f"FROM {tariffs_source}",
+            date,
+        )
+        acceptance = await db_client.pool.fetch(
+            "SELECT warehouse_name, acceptance_type, coefficient "
+            "FROM wb_acceptance_coefficients WHERE date = $1 AND acceptance_type = ANY($2)",
+            date,
+            [BOX_ACCEPTANCE_TYPE, PALLET_ACCEPTANCE_TYPE],
+        )
+        commissions = await db_client.pool.fetch(
+            "SELECT DISTINCT ON (category_name, item_name) category_name, item_name, "
+            f"fbo_rate, fbs_rate FROM {db_client.source_table('wb_commission_rates')} "
+            "WHERE date <= $1 ORDER BY category_name, item_name, date DESC",
+            date,
+        )
+        seller = None
+        if seller_id is not None:
+            seller = await db_client.pool.fetchrow(
+                "SELECT logistics_coefficient, localization_index "
+                "FROM wb_seller_logistics_coefficients "
+                "WHERE seller_id = $1 AND date <= $2 ORDER BY date DESC LIMIT 1",
+                seller_id,
+                date,
+            )
+
+        # Порядок для searchsorted - порядок numpy (по кодам символов),
+        # а не правила сортировки БД
+        warehouse_names = np.array([row["warehouse_name"] for row in tariffs], dtype=str)
+        order = np.argsort(warehouse_names, kind="stable")
+        warehouse_names = warehouse_names[order]
+        columns = np.array([tuple(row)[1:] for row in tariffs], dtype=float).reshape(-1, 7)[order]
+        coefficients = {
+            acceptance_type: np.full(len(warehouse_names), np.nan)
+            for acceptance_type in (BOX_ACCEPTANCE_TYPE, PALLET_ACCEPTANCE_TYPE)
+        }
+        for row in acceptance:
+            position = np.searchsorted(warehouse_names, row["warehouse_name"])
+            if position < len(warehouse_names) and warehouse_names[position] == row["warehouse_name"]:
+                coefficients[row["acceptance_type"]][position] = row["coefficient"]
+
+        category_keys = np.array(
+            [category_key(row["category_name"], row["item_name"]) for row in commissions],
+            dtype=str,
+        )
+        order = np.argsort(category_keys)
+        rates = np.array(
+            [(row["fbo_rate"], row["fbs_rate"]) for row in commissions], dtype=float
+        ).reshape(-1, 2)[order]
+        return cls(
+            date=date,
+            warehouse_names=warehouse_names,
+            box_delivery_base=columns[:, 0],
+            box_delivery_liter=columns[:, 1],
+            box_storage_base=columns[:, 2],
+            box_storage_liter=columns[:, 3],
+            pallet_delivery_base=columns[:, 4],
+            pallet_delivery_liter=columns[:, 5],
+            pallet_storage=columns[:, 6],
+            box_acceptance_coefficient=coefficients[BOX_ACCEPTANCE_TYPE],
+            pallet_acceptance_coefficient=coefficients[PALLET_ACCEPTANCE_TYPE],
+            category_keys=category_keys[order],
+            fbo_rate=rates[:, 0],
+            fbs_rate=rates[:, 1],
+            logistics_coefficient=seller["logistics_coefficient"] if seller else 1.0,
+            localization_index=seller["localization_index"] if seller else 1.0,
+        )
+
+
+def category_key(category_name: str, item_name: str) -> str:
+    return f"{category_name or ''}\x1f{item_name or ''}"
+
+
+def _strings(values) -> np.ndarray:
+    """
+    Массив строк, None - пустая строка, как в category_key
+    (np.asarray(..., dtype=str) превратил бы None в 'None')
+    """
+    values = np.asarray(values, dtype=object)
+    return np.where(np.equal(values, None), "", values).astype(str)
+
+
+def _lookup(sorted_keys: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    Индексы values в отсортированном sorted_keys, -1 для отсутствующих.
+    Поиск выполняется только для уникальных значений
+    """
+    uniques, inverse = np.unique(values, return_inverse=True)
+    if not len(sorted_keys):
+        return np.full(len(values), -1, dtype=np.int64)
+    positions = np.searchsorted(sorted_keys, uniques)
+    positions = np.minimum(positions, len(sorted_keys) - 1)
+    positions = np.where(sorted_keys[positions] == uniques, positions, -1)
+    return positions[inverse.reshape(-1)]
+
+
+def _take(values: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    """
+    values[indices] с NaN на месте индексов -1
+    """
+    if not len(values):
+        return np.full(len(indices), np.nan)
+    return np.where(indices >= 0, values[np.maximum(indices, 0)], np.nan)
+
+
+class LogisticsCostCalculator:
+    """
+    Пакетный расчет стоимости логистики, хранения и комиссии для массивов SKU.
+    Логистика: база за первый литр + ставка за каждый следующий литр,
+    умноженные на коэффициент логистики и индекс локализации селлера.
+    Для отсутствующих складов и категорий результат - NaN.
+    Индексы складов и категорий достаточно вычислить один раз для каталога
+    и переиспользовать для расчетов на разные даты
+    """
+
+    def __init__(self, tariffs: TariffArrays):
+        self._tariffs = tariffs
+
+    def warehouse_indices(self, warehouse_names) -> np.ndarray:
+        return _lookup(self._tariffs.warehouse_names, np.asarray(warehouse_names, dtype=str))
+
+    def category_indices(self, category_names, item_names) -> np.ndarray:
+        keys = np.char.add(
+            np.char.add(_strings(category_names), "\x1f"),
+            _strings(item_names),
+        )
+        return _lookup(self._tariffs.category_keys, keys)
+
+    def calculate(
+        self,
+        volumes: np.ndarray,
+        prices: np.ndarray,
+        category_indices: np.ndarray,
+        warehouse_indices: np.ndarray,
+        is_pallet: np.ndarray = None,
+        fbs: bool = False,
+        storage_days: int = 0,
+    ) -> dict[str, np.ndarray]:
+        """
+        volumes - объем в литрах, prices - цена продажи, индексы категорий и
+        складов - результаты category_indices/warehouse_indices.
+        Возвращает векторы delivery, storage_per_day, acceptance_coefficient,
+        commission и total = delivery + storage_per_day * storage_days + commission
+        """
+        tariffs = self._tariffs
+        volumes = np.asarray(volumes, dtype=float)
+        prices = np.asarray(prices, dtype=float)
+        extra_liters = np.maximum(volumes - 1.0, 0.0)
+
+        box_delivery = (
+            _take(tariffs.box_delivery_base, warehouse_indices)
+            + extra_liters * _take(tariffs.box_delivery_liter, warehouse_indices)
+        )
+        box_storage = (
+            _take(tariffs.box_storage_base, warehouse_indices)
+            + extra_liters * _take(tariffs.box_storage_liter, warehouse_indices)
+        )
+        acceptance = _take(tariffs.box_acceptance_coefficient, warehouse_indices)
+        if is_pallet is not None:
+            is_pallet = np.asarray(is_pallet, dtype=bool)
+            pallet_delivery = (
+                _take(tariffs.pallet_delivery_base, warehouse_indices)
+                + extra_liters * _take(tariffs.pallet_delivery_liter, warehouse_indices)
+            )
+            delivery = np.where(is_pallet, pallet_delivery, box_delivery)
+            storage = np.where(
+                is_pallet, _take(tariffs.pallet_storage, warehouse_indices), box_storage
+            )
+            acceptance = np.where(
+                is_pallet,
+                _take(tariffs.pallet_acceptance_coefficient, warehouse_indices),
+                acceptance,
+            )
+        else:
+            delivery, storage = box_delivery, box_storage
+
+        delivery *= tariffs.logistics_coefficient * tariffs.localization_index
+        rates = tariffs.fbs_rate if fbs else tariffs.fbo_rate
+        commission = prices * _take(rates, category_indices) / 100.0
+        return {
+            "delivery": delivery,
+            "storage_per_day": storage,
+            "acceptance_coefficient": acceptance,
+            "commission": commission,
+            "total": delivery + storage * storage_days + commission,
+        }
@@ -1,380 +1,304 @@
 import datetime
+import json
 import logging
 
-from db_client import DBClient
-from utils import str_to_float
+from aggregates import AGGREGATES
+from datasets import DATASETS, RESPONSE_DATES, SELLER, DatasetSpec
+from date_range import fetch_date_range
+from db_client import DBClient, INTERVAL_TABLES, UnitOfWork
+from encoding import ENCODED_TABLES, EncodedTable, encode_rows, encoded_column
+from deadline import Deadline
+from exceptions import DeadlineExceededException
+from fetch_planner import COMMON_SCOPE, key_date
+from payload_cache import PayloadCache
+from pipeline import Pipeline, PipelineJob
+from profiling import section
 from wb_parser import WbParser
 
 logger = logging.getLogger(__name__)
 
 
 class WbDataExtractor:
-    def __init__(self, db_client: DBClient, wb_parser: WbParser):
+    def __init__(
+        self,
+        db_client: DBClient,
+        wb_parser: WbParser,
+        pipeline: Pipeline = None,
+        deadline: Deadline = None,
+        unit_of_work: UnitOfWork = None,
+    ):
         self._db_client = db_client
         self._wb_parser = wb_parser
+        self._pipeline = pipeline
+        self._deadline = deadline or Deadline()
+        self._unit_of_work = unit_of_work
+        self._payload_cache = PayloadCache(db_client)
+        self._warehouses_dict = None
+        self._dictionaries = {}
 
-    async def get_weekly_rating(self, row_id: int) -> dict:
+    async def _run(self, name: str, fetch, transform, write) -> None:
         """
-        Извлечение данных о коэфициенте логистики и индексе локализации
-        Порядок записи данных важен, так как при вставке в бд поля будут в том же порядке
+        Получение, преобразование и запись набора данных: через конвейер,
+        если он задан, иначе последовательно.
+        Задача, не уложившаяся в общий лимит времени, помечается своим именем
         """
-        weekly_rating_data = await self._wb_parser.parse_weekly_rating()
-        weekly_rating = {
-            "seller_id": row_id,
-            "logistics_coefficient": weekly_rating_data["data"][
-                "logisticAndStorage"
-            ]["rating"],
-            "localization_index": weekly_rating_data["data"]["localization"][
-                "index"
-            ],
-            "date": datetime.date.today(),
-        }
-        return weekly_rating
+        try:
+            self._deadline.check()
+            if self._pipeline:
+                await self._pipeline.run(PipelineJob(name, fetch, transform, write))
+            else:
+                with section(f"{name}.fetch"):
+                    data = await fetch()
+                with section(f"{name}.transform"):
+                    data = await transform(data)
+                with section(f"{name}.write"):
+                    await write(data)
+        except DeadlineExceededException as e:
+            e.task = name
+            raise
 
-    async def insert_weekly_rating(self, seller_id) -> None:
+    def _begin(self) -> UnitOfWork:
         """
-        Вставка данных об индексе локализации и коэффициенте логистики
+        Единица работы для записи набора данных: общая, если ее передал
+        вызывающий (фиксирует он), иначе своя для набора
         """
-        weekly_rating = await self.get_weekly_rating(seller_id)
-        if weekly_rating:
-            await self._db_client.insert_data(
-                "wb_seller_logistics_coefficients", weekly_rating
-            )
-        else:
-            logger.info(f"Данные для селлера с id: {seller_id} не получены.")
+        return self._unit_of_work or self._db_client.unit_of_work()
+
+    async def _commit(self, unit_of_work: UnitOfWork) -> None:
+        if unit_of_work is not self._unit_of_work:
+            await unit_of_work.commit()
 
-    async def get_warehouse_tariffs(
+    async def _run_date_range(
         self,
-        date=datetime.date.today(),
-    ) -> list[dict]:
+        name: str,
+        fetch_one,
+        dates: list[datetime.date],
+        transform,
+        write,
+        params=datetime.date.isoformat,
+        scope: str = COMMON_SCOPE,
+        skip_unchanged: bool = True,
+    ) -> None:
         """
-        Извлечение данных о тарифах скаладов
-        Порядок записи данных важен, так как при вставке в бд поля будут в том же порядке
+        Загрузка набора данных за несколько дат. Ответы, совпавшие с уже
+        записанными (по хэшу тела), не разбираются и не пишутся в БД.
+        Строки, журнал загрузок и хэши новых ответов фиксируются одной
+        транзакцией в стадии записи, пока конвейер загружает другие наборы.
+        skip_unchanged=False - ответы пишутся всегда, хэши не ведутся
         """
-        warehouse_tariffs_data = await self._wb_parser.parse_warehouses_tariffs(date)
-        warehouse_tariffs = []
-        warehouses_dict = {}
-        rows = await self._db_client.pool.fetch(
-            "SELECT id, name FROM wb_warehouses"
-        )
-        for row in rows:
-            warehouses_dict[row["name"]] = row["id"]
+        changed = []
 
-        for warehouse in warehouse_tariffs_data["data"]["warehouseList"]:
-            warehouse_name = warehouse.get("warehouseName")
-            warehouse_id = warehouses_dict.get(warehouse_name)
-            if warehouse_id is None:
-                continue
-            warehouse_data = {
-                "warehouse_name": warehouse_name,
-                "date": date,
-                "box_delivery_and_storage_expr": str_to_float(
-                    warehouse.get("boxDeliveryAndStorageExpr")
-                ),
-                "box_delivery_base": str_to_float(
-                    warehouse.get("boxDeliveryBase")
-                ),
-                "box_delivery_liter": str_to_float(
-                    warehouse.get("boxDeliveryLiter")
-                ),
-                "box_storage_base": str_to_float(
-                    warehouse.get("boxStorageBase")
-                ),
-                "box_storage_liter": str_to_float(
-                    warehouse.get("boxStorageLiter")
-                ),
-                "pallet_delivery_expr": str_to_float(
-                    warehouse.get("palletDeliveryExpr")
-                ),
-                "pallet_delivery_value_base": str_to_float(
-                    warehouse.get("palletDeliveryValueBase")
-                ),
-                "pallet_delivery_value_liter": str_to_float(
-                    warehouse.get("palletDeliveryValueLiter")
-                ),
-                "pallet_storage_expr": str_to_float(
-                    warehouse.get("palletStorageExpr")
-                ),
-                "pallet_storage_value_expr": str_to_float(
-                    warehouse.get("palletStorageValueExpr")
-                ),
-                "warehouse_id": int(warehouse_id),
-                "box_delivery_and_storage_color_expr": warehouse.get(
-                    "boxDeliveryAndStorageColorExpr"
-                ),
-                "box_delivery_and_storage_color_expr_next": warehouse.get(
-                    "boxDeliveryAndStorageColorExprNext"
-                ),
-                "box_delivery_and_storage_diff_sign": warehouse.get(
-                    "boxDeliveryAndStorageDiffSign"
-                ),
-                "box_delivery_and_storage_diff_sign_next": warehouse.get(
-                    "boxDeliveryAndStorageDiffSignNext"
-                ),
-                "box_delivery_and_storage_expr_next": str_to_float(
-                    warehouse.get("boxDeliveryAndStorageExprNext")
-                ),
-                "box_delivery_and_storage_visible_expr": str_to_float(
-                    warehouse.get("boxDeliveryAndStorageVisibleExpr")
-                ),
-                "pallet_delivery_color_expr": warehouse.get(
-                    "palletDeliveryColorExpr"
-                ),
-                "pallet_delivery_color_expr_next": warehouse.get(
-                    "palletDeliveryColorExprNext"
-                ),
-                "pallet_delivery_diff_sign": warehouse.get(
-                    "palletDeliveryDiffSign"
-                ),
-                "pallet_delivery_diff_sign_next": warehouse.get(
-                    "palletDeliveryDiffSignNext"
-                ),
-                "pallet_delivery_expr_next": str_to_float(
-                    warehouse.get("palletDeliveryExprNext")
-                ),
-                "pallet_storage_color_expr": warehouse.get(
-                    "palletStorageColorExpr"
-                ),
-                "pallet_storage_color_expr_next": warehouse.get(
-                    "palletStorageColorExprNext"
-                ),
-                "pallet_storage_diff_sign": warehouse.get(
-                    "palletStorageDiffSign"
-                ),
-                "pallet_storage_diff_sign_next": warehouse.get(
-                    "palletStorageDiffSignNext"
-                ),
-                "pallet_storage_expr_next": str_to_float(
-                    warehouse.get("palletStorageExprNext")
-                ),
-                "pallet_visible_expr": str_to_float(
-                    warehouse.get("palletVisibleExpr")
-                ),
-            }
-            warehouse_tariffs.append(warehouse_data)
-        return warehouse_tariffs
+        async def fetch():
+            groups = await fetch_date_range(name, fetch_one, dates)
+            if skip_unchanged:
+                groups = await self._payload_cache.filter_changed(name, groups, params)
+            changed.extend(groups)
+            return changed
 
-    async def insert_warehouse_tariffs(
-        self, date=datetime.date.today()
-    ) -> None:
+        async def transform_changed(groups):
+            return await transform(groups) if groups else None
+
+        async def write_changed(rows):
+            unit_of_work = self._begin()
+            if changed:
+                await write(rows, unit_of_work)
+            for date in dates:
+                unit_of_work.add(
+                    self._db_client.mark_fetched, name, scope, key_date(name, date)
+                )
+            if skip_unchanged:
+                unit_of_work.add(
+                    self._db_client.store_payload_hashes,
+                    self._payload_cache.records(name, changed, params),
+                )
+            await self._commit(unit_of_work)
+
+        await self._run(name, fetch, transform_changed, write_changed)
+
+    async def _get_warehouses_dict(self) -> dict:
         """
-        Вставка данных о тарифах складов
+        Справочник складов название -> id, загружается один раз на экземпляр
         """
-        warehouse_tariffs = await self.get_warehouse_tariffs(date)
-        if warehouse_tariffs:
-            await self._db_client.insert_update_data(
-                "wb_warehouses_tariffs",
-                warehouse_tariffs,
-                conflict_target="wb_warehouses_tariffs_date_warehouse_name_key",
-                update_fields=[
-                    "box_delivery_and_storage_expr",
-                    "box_delivery_base",
-                    "box_delivery_liter",
-                    "box_storage_base",
-                    "box_storage_liter",
-                    "pallet_delivery_expr",
-                    "pallet_delivery_value_base",
-                    "pallet_delivery_value_liter",
-                    "pallet_storage_expr",
-                    "pallet_storage_value_expr",
-                    "box_delivery_and_storage_color_expr",
-                    "box_delivery_and_storage_color_expr_next",
-                    "box_delivery_and_storage_diff_sign",
-                    "box_delivery_and_storage_diff_sign_next",
-                    "box_delivery_and_storage_expr_next",
-                    "box_delivery_and_storage_visible_expr",
-                    "pallet_delivery_color_expr",
-                    "pallet_delivery_color_expr_next",
-                    "pallet_delivery_diff_sign",
-                    "pallet_delivery_diff_sign_next",
-                    "pallet_delivery_expr_next",
-                    "pallet_storage_color_expr",
-                    "pallet_storage_color_expr_next",
-                    "pallet_storage_diff_sign",
-                    "pallet_storage_diff_sign_next",
-                    "pallet_storage_expr_next",
-                    "pallet_visible_expr",
-                ],
+        if self._warehouses_dict is None:
+            rows = await self._db_client.pool.fetch(
+                "SELECT id, name FROM wb_warehouses"
             )
-        else:
-            logger.info("Тарифов складов на эту дату нет")
+            self._warehouses_dict = {row["name"]: row["id"] for row in rows}
+        return self._warehouses_dict
 
-    async def get_commission_rates(
-        self,
-    ) -> list[dict]:
+    async def _encode(self, encoded: EncodedTable, rows: list[dict]) -> list[dict]:
         """
-        Извлечение данных о ставках логистики по категориям товаров
-        Порядок записи данных важен, так как при вставке в бд поля будут в том же порядке
+        Кодирование строк через словари: словарь загружается один раз на
+        экземпляр, в БД добавляются только новые значения
         """
-        query = """ WITH ranked_data AS (SELECT *,
-            ROW_NUMBER() OVER (PARTITION BY category_name, item_name ORDER BY date DESC) as rn
-            FROM wb_commission_rates) SELECT category_name, item_name, date, fbo_rate, fbs_rate, china_rate
-            FROM ranked_data WHERE rn = 1;
-            """
-        last_commission_rates = await self._db_client.pool.fetch(query)
-        last_commission_dict = {
-            (row[0], row[1]): row for row in last_commission_rates
-        }
-
-        commission_rates_data = await self._wb_parser.parse_commission_rates()
-        commission_rates = []
-        for rate in commission_rates_data.get("data").get("categories"):
-            commission_rate = {
-                "category_name": rate.get("name")
-                if rate.get("name")
-                else "Цифровые товары",
-                "item_name": rate.get("subject"),
-                "fbo_rate": str_to_float(rate.get("percent")),
-                "fbs_rate": str_to_float(rate.get("percentFBS")),
-                "china_rate": str_to_float(rate.get("percentChina")),
-                "date": datetime.date.today(),
+        for dictionary in set(encoded.columns.values()):
+            if dictionary not in self._dictionaries:
+                self._dictionaries[dictionary] = await self._db_client.dictionary(dictionary)
+            ids = self._dictionaries[dictionary]
+            missing = {
+                row.get(column)
+                for row in rows
+                for column, column_dictionary in encoded.columns.items()
+                if column_dictionary == dictionary
+                and row.get(column) is not None
+                and row.get(column) not in ids
             }
-            key = (
-                commission_rate["category_name"],
-                commission_rate["item_name"],
-            )
-            if (
-                key not in last_commission_dict
-                or last_commission_dict[key][3] != commission_rate["fbo_rate"]
-                or last_commission_dict[key][4] != commission_rate["fbs_rate"]
-                or last_commission_dict[key][5]
-                != commission_rate["china_rate"]
-            ):
-                commission_rates.append(commission_rate)
-        return commission_rates
+            if missing:
+                ids.update(await self._db_client.dictionary_ids(dictionary, sorted(missing)))
+        return encode_rows(encoded, rows, self._dictionaries)
 
-    async def insert_commission_rates(self) -> None:
+    async def insert_dataset(
+        self, name: str, dates: list[datetime.date] = None, seller_id: int = None
+    ) -> None:
         """
-        Вставка данных о коммисиях по категориям товаров
+        Получение, преобразование и запись набора данных из реестра datasets
+        за даты dates (по умолчанию - сегодня). seller_id - для данных селлера
         """
-        commission_rates = await self.get_commission_rates()
-        if commission_rates:
-            await self._db_client.insert_data(
-                "wb_commission_rates", commission_rates
-            )
-        else:
-            logger.info("Коммисии по категориям не изменились")
+        spec = DATASETS[name]
+        dates = dates or [datetime.date.today()]
+        scope = str(seller_id) if spec.scope == SELLER else COMMON_SCOPE
+        context = {"seller_id": seller_id}
 
-    async def get_acceptance_coefficients(
-        self,
-        date=datetime.date.today(),
+        async def fetch_one(date):
+            return await self._wb_parser.fetch_dataset(spec, date, raw=True)
+
+        async def transform(groups):
+            return await self.transform_dataset(spec, groups, context)
+
+        async def write(rows, unit_of_work):
+            await self.write_dataset(spec, rows, unit_of_work)
+
+        await self._run_date_range(
+            name,
+            fetch_one,
+            dates,
+            transform,
+            write,
+            params=lambda date: spec.params(scope, date),
+            scope=scope,
+            skip_unchanged=spec.skip_unchanged,
+        )
+
+    async def transform_dataset(
+        self, spec: DatasetSpec, groups: list, context: dict = None
     ) -> list[dict]:
         """
-        Извлечение данных о коэфициенте приемки
-        Порядок записи данных важен, так как при вставке в бд поля будут в том же порядке
+        Строки набора данных из групп одинаковых ответов. Каждый различный
+        ответ разбирается один раз; если даты строк - даты запросов, строки
+        копируются на все даты группы
         """
-        acceptance_coefficients_data = (
-            await self._wb_parser.parse_acceptance_coefficients(date)
-        )
-        acceptance_coefficients = []
-        warehouses_dict = {}
-        rows = await self._db_client.pool.fetch(
-            "SELECT id, name FROM wb_warehouses"
-        )
-        for row in rows:
-            warehouses_dict[row["name"]] = row["id"]
-        for coefficient in acceptance_coefficients_data.get("result").get(
-            "report"
-        ):
-            warehouse_name = coefficient.get("warehouseName")
-            warehouse_id = warehouses_dict.get(warehouse_name)
+        warehouses_dict = await self._get_warehouses_dict() if spec.warehouse_path else {}
+        rows = []
+        for group in groups:
+            template = []
+            for item in spec.items(json.loads(group.body)):
+                item_context = {**(context or {}), "date": group.dates[0]}
+                if spec.warehouse_path:
+                    warehouse_id = warehouses_dict.get(item.get(spec.warehouse_path))
+                    if warehouse_id is None and spec.require_warehouse:
+                        continue
+                    item_context["warehouse_id"] = int(warehouse_id) if warehouse_id else None
+                template.append(spec.row(item, item_context))
+            if spec.dates == RESPONSE_DATES or "date" not in spec.columns:
+                rows.extend(template)
+                continue
+            for date in group.dates:
+                rows.extend({**row, "date": date} for row in template)
 
-            acceptance_coefficient = {
-                "date": datetime.datetime.fromisoformat(
-                    coefficient.get("date").rstrip("Z")
-                ).date(),
-                "acceptance_type": int(coefficient.get("acceptanceType")),
-                "coefficient": int(coefficient.get("coefficient")),
-                "warehouse_id_from_json": int(coefficient.get("warehouseID")),
-                "warehouse_name": coefficient.get("warehouseName"),
-                "warehouse_id": int(warehouse_id) if warehouse_id else None,
-            }
-            acceptance_coefficients.append(acceptance_coefficient)
-        return acceptance_coefficients
+        if spec.unique_fields:
+            unique_rows = {}
+            for row in rows:
+                unique_rows[tuple(row[field] for field in spec.unique_fields)] = row
+            rows = list(unique_rows.values())
+        if spec.changes_only:
+            rows = await self._changed_rows(spec, rows)
+        return rows
 
-    async def insert_acceptance_coefficients(
-        self, date=datetime.date.today()
-    ) -> None:
+    async def _changed_rows(self, spec: DatasetSpec, rows: list[dict]) -> list[dict]:
         """
-        Вставка данных о коэфициентах приемки
+        Строки, значения которых отличаются от последней записи по ключу
         """
-        acceptance_coefficients = await self.get_acceptance_coefficients(date)
-        if acceptance_coefficients:
-            await self._db_client.insert_update_data(
-                "wb_acceptance_coefficients",
-                acceptance_coefficients,
-                conflict_target="wb_acceptance_coefficients_date_warehouse_id_acceptance_typ_key",
-                update_fields=["coefficient"],
+        keys = ", ".join(spec.key_fields)
+        value_fields = [
+            column for column in spec.columns
+            if column not in spec.key_fields and column != "date"
+        ]
+        latest = await self._db_client.pool.fetch(
+            f"SELECT DISTINCT ON ({keys}) {keys}, {', '.join(value_fields)} "
+            f"FROM {self._db_client.source_table(spec.table)} ORDER BY {keys}, date DESC"
+        )
+        latest_values = {
+            tuple(row[field] for field in spec.key_fields): tuple(
+                row[field] for field in value_fields
             )
-        else:
-            logger.info("Коэффициентов приемки на эту дату нет")
+            for row in latest
+        }
+        return [
+            row for row in rows
+            if latest_values.get(tuple(row[field] for field in spec.key_fields))
+            != tuple(row[field] for field in value_fields)
+        ]
 
-    async def get_return_tariffs(
-        self, date=datetime.date.today()
-    ) -> list[dict]:
+    async def write_dataset(
+        self, spec: DatasetSpec, rows: list[dict], unit_of_work: UnitOfWork = None
+    ) -> None:
         """
-        Извлечение данных о ставках логистики по возвратам
-        Порядок записи данных важен, так как при вставке в бд поля будут в том же порядке
+        Запись строк набора данных: синхронизация справочника, в интервальную
+        таблицу, если она есть и включен интервальный режим хранения, с
+        обновлением по ограничению или только новых строк - в кодированном
+        режиме в кодированную таблицу. Затем пересчет агрегатов и
+        уведомление об изменениях. Операции добавляются в unit_of_work, без
+        нее фиксируются своей транзакцией
         """
-        return_tariffs_data = await self._wb_parser.return_tariffs(date)
-        return_tariffs = []
-        for warehouse in return_tariffs_data.get("data").get("warehouseList"):
-            tariff = {
-                "date": date,
-                "warehouse_sort": int(warehouse.get("warehouseSort")),
-                "warehouse_name": warehouse.get("warehouseName"),
-                "delivery_dump_sup_office_expr": warehouse.get(
-                    "deliveryDumpSupOfficeExpr"
-                ),
-                "delivery_dump_sup_office_base": str_to_float(
-                    warehouse.get("deliveryDumpSupOfficeBase")
-                ),
-                "delivery_dump_sup_office_liter": str_to_float(
-                    warehouse.get("deliveryDumpSupOfficeLiter")
-                ),
-                "delivery_dump_sup_courier_expr": warehouse.get(
-                    "deliveryDumpSupCourierExpr"
-                ),
-                "delivery_dump_sup_courier_base": str_to_float(
-                    warehouse.get("deliveryDumpSupCourierBase")
-                ),
-                "delivery_dump_sup_courier_liter": str_to_float(
-                    warehouse.get("deliveryDumpSupCourierLiter")
-                ),
-                "delivery_dump_sup_return_expr": warehouse.get(
-                    "deliveryDumpSupReturnExpr"
-                ),
-                "delivery_dump_kgt_office_expr": warehouse.get(
-                    "deliveryDumpKgtOfficeExpr"
-                ),
-                "delivery_dump_kgt_office_base": str_to_float(
-                    warehouse.get("deliveryDumpKgtOfficeBase")
-                ),
-                "delivery_dump_kgt_office_liter": str_to_float(
-                    warehouse.get("deliveryDumpKgtOfficeLiter")
-                ),
-                "delivery_dump_kgt_return_expr": warehouse.get(
-                    "deliveryDumpKgtReturnExpr"
-                ),
-                "delivery_dump_srg_office_expr": warehouse.get(
-                    "deliveryDumpSrgOfficeExpr"
-                ),
-                "delivery_dump_srg_return_expr": warehouse.get(
-                    "deliveryDumpSrgReturnExpr"
-                ),
-            }
-            return_tariffs.append(tariff)
-
-        return return_tariffs
+        own_unit_of_work = unit_of_work is None
+        if own_unit_of_work:
+            unit_of_work = self._begin()
+        table_name, conflict_target, data = spec.table, spec.conflict_target, rows
+        update_fields = list(spec.update_fields or [
+            column for column in spec.columns if column not in spec.key_fields
+        ])
+        if rows and self._db_client.storage_mode == "encoded" and spec.table in ENCODED_TABLES:
+            encoded = ENCODED_TABLES[spec.table]
+            table_name, data = encoded.table, await self._encode(encoded, rows)
+            # Обработка конфликтов как у дневной таблицы: без conflict_target
+            # в наборе данных повторные строки пропускаются
+            conflict_target = encoded.conflict_target if spec.conflict_target else None
+            update_fields = [
+                encoded_column(field) if field in encoded.columns else field
+                for field in update_fields
+                if field not in encoded.conflict_columns
+            ]
 
-    async def insert_return_tariffs(self, date=datetime.date.today()) -> None:
-        """
-        Вставка данных о ставках по возвратам
-        """
-        return_tariffs = await self.get_return_tariffs(date)
-        if return_tariffs:
-            await self._db_client.insert_data(
-                "wb_return_tariffs", return_tariffs
+        if rows and spec.reference:
+            unit_of_work.add(
+                self._db_client.sync_reference, spec.table, rows, list(spec.key_fields)
+            )
+        elif rows and self._db_client.storage_mode == "interval" and spec.table in INTERVAL_TABLES:
+            table_name, key_fields = INTERVAL_TABLES[spec.table]
+            unit_of_work.add(
+                self._db_client.insert_update_intervals,
+                table_name,
+                rows,
+                key_fields,
+                overwrite=spec.interval_overwrite,
             )
+        elif rows and conflict_target:
+            unit_of_work.add(
+                self._db_client.insert_update_data,
+                table_name,
+                data,
+                conflict_target=conflict_target,
+                update_fields=update_fields,
+            )
+        elif rows:
+            unit_of_work.add(self._db_client.insert_data, table_name, data)
         else:
-            logger.info("Тарифов возврата на эту дату нет")
+            logger.info(f"{spec.name}: новых данных нет")
+        if spec.name in AGGREGATES:
+            unit_of_work.add(self._db_client.refresh_aggregates, spec.name, rows)
+        if spec.change_keys:
+            unit_of_work.add(
+                self._db_client.notify_changes, spec.name, rows, spec.change_keys
+            )
+        if own_unit_of_work:
+            await self._commit(unit_of_work)
@@ -0,0 +1,348 @@
+import datetime
+import os
+from dataclasses import dataclass
+from typing import Callable
+
+from dotenv import load_dotenv
+
+from utils import str_to_float
+
+load_dotenv()
+
+# Семантика дат набора данных:
+# request - запрос за дату, строки ответа относятся к дате запроса;
+# response - запрос за период от даты, даты строк берутся из ответа;
+# none - у запроса нет даты, строки относятся к дню загрузки
+REQUEST_DATES = "request"
+RESPONSE_DATES = "response"
+NO_DATES = "none"
+
+# Область учетных данных: общие для всех селлеров данные или данные селлера
+COMMON = "common"
+SELLER = "seller"
+
+
+@dataclass(frozen=True)
+class Field:
+    """
+    Колонка таблицы: path - путь в элементе ответа через точку, без пути
+    значение берется из контекста загрузки (date, seller_id, warehouse_id);
+    default подставляется вместо пустого значения
+    """
+
+    column: str
+    path: str = None
+    convert: Callable = None
+    default: object = None
+
+
+@dataclass(frozen=True)
+class DatasetSpec:
+    """
+    Описание набора данных: запрос (method, url и payload с подстановкой
+    {date}), путь к элементам в ответе, схема строк и правила записи.
+    Поля схемы задают и порядок колонок при вставке.
+    - key_fields - естественный ключ строки без даты или вместе с ней;
+    - conflict_target/update_fields - обновление строк по ограничению,
+      без update_fields обновляются все колонки, кроме key_fields;
+    - interval_overwrite - как писать в интервальную таблицу, если у
+      таблицы есть интервальный режим хранения;
+    - unique_fields - строки пересекающихся периодов схлопываются по ключу;
+    - changes_only - пишутся только строки, у которых колонки вне ключа
+      изменились с последней записи по key_fields;
+    - change_keys - ключ строк в канале изменений, без него уведомлений нет;
+    - warehouse_path - путь к названию склада для колонки warehouse_id,
+      require_warehouse - строки складов не из справочника пропускаются;
+    - nested_path - элементы вложены списком в элементы ответа, у
+      вложенного элемента родитель доступен по пути parent;
+    - reference - таблица-справочник, ответ - полный список строк:
+      новые по key_fields вставляются, пропавшие помечаются removed_at;
+    - skip_unchanged - ответ, совпавший с последним записанным, не пишется;
+    - horizon_days/horizon_step - какие даты от сегодня загружать
+    """
+
+    name: str
+    method: str
+    url: str
+    response_path: tuple
+    fields: tuple
+    table: str
+    dates: str = REQUEST_DATES
+    scope: str = COMMON
+    payload: object = None
+    cookies: dict = None
+    conflict_target: str = None
+    key_fields: tuple = ()
+    update_fields: tuple = None
+    interval_overwrite: bool = True
+    unique_fields: tuple = None
+    changes_only: bool = False
+    change_keys: tuple = None
+    warehouse_path: str = None
+    require_warehouse: bool = False
+    nested_path: str = None
+    reference: bool = False
+    skip_unchanged: bool = True
+    horizon_days: int = 1
+    horizon_step: int = 1
+
+    @property
+    def columns(self) -> tuple:
+        return tuple(item.column for item in self.fields)
+
+    def request(self, date: datetime.date = None) -> tuple[str, dict]:
+        url = self.url.format(date=date)
+        payload = self.payload(date) if callable(self.payload) else self.payload
+        return url, payload
+
+    def items(self, data: dict) -> list[dict]:
+        for key in self.response_path:
+            data = data.get(key) if data else None
+        if data is None:
+            return []
+        items = data if isinstance(data, list) else [data]
+        if self.nested_path:
+            return [
+                {**child, "parent": item}
+                for item in items
+                for child in value_at(item, self.nested_path) or []
+            ]
+        return items
+
+    def row(self, item: dict, context: dict) -> dict:
+        row = {}
+        for field in self.fields:
+            if field.path is None:
+                row[field.column] = context.get(field.column)
+                continue
+            value = value_at(item, field.path)
+            if value in (None, "") and field.default is not None:
+                value = field.default
+            elif value is not None and field.convert is not None:
+                value = field.convert(value)
+            row[field.column] = value
+        return row
+
+    def params(self, scope: str, date: datetime.date) -> str:
+        """
+        Нормализованные параметры запроса для сравнения ответов
+        """
+        params = "" if self.dates == NO_DATES else date.isoformat()
+        return f"{scope}/{params}" if self.scope == SELLER else params
+
+
+def value_at(item: dict, path: str):
+    for key in path.split("."):
+        item = item.get(key) if item else None
+    return item
+
+
+def response_date(value: str) -> datetime.date:
+    return datetime.datetime.fromisoformat(value.rstrip("Z")).date()
+
+
+def acceptance_payload(date: datetime.date) -> dict:
+    return {
+        "params": {
+            "dateTo": f"{date + datetime.timedelta(7)}T23:59:00.000Z",
+            "dateFrom": f"{date}T00:00:00.000Z",
+        },
+        "jsonrpc": "2.0",
+        "id": "json-rpc_10",
+    }
+
+
+def _tariff_field(column: str, path: str) -> Field:
+    return Field(column, path, str_to_float)
+
+
+LOCALE_COOKIES = {"external-locale": "ru", "locale": "ru"}
+
+DATASETS = {
+    spec.name: spec
+    for spec in (
+        DatasetSpec(
+            name="weekly_rating",
+            method="GET",
+            url=(
+                "https://seller.wildberries.ru/ns/categories-info/suppliers"
+                "-portal-analytics/api/v1/weekly-rating"
+            ),
+            response_path=("data",),
+            fields=(
+                Field("seller_id"),
+                Field("logistics_coefficient", "logisticAndStorage.rating"),
+                Field("localization_index", "localization.index"),
+                Field("date"),
+            ),
+            table="wb_seller_logistics_coefficients",
+            dates=NO_DATES,
+            scope=SELLER,
+            # Ответ не меняется неделями, а строка пишется на каждую неделю
+            skip_unchanged=False,
+        ),
+        DatasetSpec(
+            name="warehouse_tariffs",
+            method="POST",
+            url=(
+                "https://seller-weekly-report.wildberries.ru/ns/categories-info/"
+                "suppliers-portal-analytics/api/v1/tariffs-period?date={date}&short=false"
+            ),
+            payload={"box": "asc"},
+            response_path=("data", "warehouseList"),
+            fields=(
+                Field("warehouse_name", "warehouseName"),
+                Field("date"),
+                _tariff_field("box_delivery_and_storage_expr", "boxDeliveryAndStorageExpr"),
+                _tariff_field("box_delivery_base", "boxDeliveryBase"),
+                _tariff_field("box_delivery_liter", "boxDeliveryLiter"),
+                _tariff_field("box_storage_base", "boxStorageBase"),
+                _tariff_field("box_storage_liter", "boxStorageLiter"),
+                _tariff_field("pallet_delivery_expr", "palletDeliveryExpr"),
+                _tariff_field("pallet_delivery_value_base", "palletDeliveryValueBase"),
+                _tariff_field("pallet_delivery_value_liter", "palletDeliveryValueLiter"),
+                _tariff_field("pallet_storage_expr", "palletStorageExpr"),
+                _tariff_field("pallet_storage_value_expr", "palletStorageValueExpr"),
+                Field("warehouse_id"),
+                Field("box_delivery_and_storage_color_expr", "boxDeliveryAndStorageColorExpr"),
+                Field(
+                    "box_delivery_and_storage_color_expr_next",
+                    "boxDeliveryAndStorageColorExprNext",
+                ),
+                Field("box_delivery_and_storage_diff_sign", "boxDeliveryAndStorageDiffSign"),
+                Field(
+                    "box_delivery_and_storage_diff_sign_next",
+                    "boxDeliveryAndStorageDiffSignNext",
+                ),
+                _tariff_field(
+                    "box_delivery_and_storage_expr_next", "boxDeliveryAndStorageExprNext"
+                ),
+                _tariff_field(
+                    "box_delivery_and_storage_visible_expr", "boxDeliveryAndStorageVisibleExpr"
+                ),
+                Field("pallet_delivery_color_expr", "palletDeliveryColorExpr"),
+                Field("pallet_delivery_color_expr_next", "palletDeliveryColorExprNext"),
+                Field("pallet_delivery_diff_sign", "palletDeliveryDiffSign"),
+                Field("pallet_delivery_diff_sign_next", "palletDeliveryDiffSignNext"),
+                _tariff_field("pallet_delivery_expr_next", "palletDeliveryExprNext"),
+                Field("pallet_storage_color_expr", "palletStorageColorExpr"),
+                Field("pallet_storage_color_expr_next", "palletStorageColorExprNext"),
+                Field("pallet_storage_diff_sign", "palletStorageDiffSign"),
+                Field("pallet_storage_diff_sign_next", "palletStorageDiffSignNext"),
+                _tariff_field("pallet_storage_expr_next", "palletStorageExprNext"),
+                _tariff_field("pallet_visible_expr", "palletVisibleExpr"),
+            ),
+            table="wb_warehouses_tariffs",
+            conflict_target="wb_warehouses_tariffs_date_warehouse_name_key",
+            key_fields=("date", "warehouse_name", "warehouse_id"),
+            change_keys=("warehouse_name",),
+            warehouse_path="warehouseName",
+            require_warehouse=True,
+            horizon_days=int(os.getenv("WB_TARIFFS_HORIZON_DAYS", "3")),
+        ),
+        DatasetSpec(
+            name="commission_rates",
+            method="POST",
+            url=(
+                "https://seller.wildberries.ru/ns/categories-info/"
+                "suppliers-portal-analytics/api/v1/categories"
+            ),
+            payload={"sort": "name", "order": "asc"},
+            cookies=LOCALE_COOKIES,
+            response_path=("data", "categories"),
+            fields=(
+                Field("category_name", "name", default="Цифровые товары"),
+                Field("item_name", "subject"),
+                Field("fbo_rate", "percent", str_to_float),
+                Field("fbs_rate", "percentFBS", str_to_float),
+                Field("china_rate", "percentChina", str_to_float),
+                Field("date"),
+            ),
+            table="wb_commission_rates",
+            dates=NO_DATES,
+            key_fields=("category_name", "item_name"),
+            changes_only=True,
+            change_keys=("category_name", "item_name"),
+        ),
+        DatasetSpec(
+            name="acceptance_coefficients",
+            method="POST",
+            url=(
+                "https://seller-supply.wildberries.ru/ns/sm-supply/supply-manager/"
+                "api/v1/supply/acceptanceCoefficientsReport"
+            ),
+            payload=acceptance_payload,
+            response_path=("result", "report"),
+            fields=(
+                Field("date", "date", response_date),
+                Field("acceptance_type", "acceptanceType", int),
+                Field("coefficient", "coefficient", int),
+                Field("warehouse_id_from_json", "warehouseID", int),
+                Field("warehouse_name", "warehouseName"),
+                Field("warehouse_id"),
+            ),
+            table="wb_acceptance_coefficients",
+            dates=RESPONSE_DATES,
+            conflict_target="wb_acceptance_coefficients_date_warehouse_id_acceptance_typ_key",
+            update_fields=("coefficient",),
+            unique_fields=("date", "warehouse_id_from_json", "acceptance_type"),
+            change_keys=("warehouse_name", "acceptance_type"),
+            warehouse_path="warehouseName",
+            horizon_days=int(os.getenv("WB_ACCEPTANCE_HORIZON_DAYS", "8")),
+            # Один запрос возвращает 8 дней начиная с даты запроса
+            horizon_step=8,
+        ),
+        DatasetSpec(
+            name="return_tariffs",
+            method="GET",
+            url=(
+                "https://seller-weekly-report.wildberries.ru/ns/categories-info/"
+                "suppliers-portal-analytics/api/v1/return-tariffs?date={date}"
+            ),
+            response_path=("data", "warehouseList"),
+            fields=(
+                Field("date"),
+                Field("warehouse_sort", "warehouseSort", int),
+                Field("warehouse_name", "warehouseName"),
+                Field("delivery_dump_sup_office_expr", "deliveryDumpSupOfficeExpr"),
+                _tariff_field("delivery_dump_sup_office_base", "deliveryDumpSupOfficeBase"),
+                _tariff_field("delivery_dump_sup_office_liter", "deliveryDumpSupOfficeLiter"),
+                Field("delivery_dump_sup_courier_expr", "deliveryDumpSupCourierExpr"),
+                _tariff_field("delivery_dump_sup_courier_base", "deliveryDumpSupCourierBase"),
+                _tariff_field("delivery_dump_sup_courier_liter", "deliveryDumpSupCourierLiter"),
+                Field("delivery_dump_sup_return_expr", "deliveryDumpSupReturnExpr"),
+                Field("delivery_dump_kgt_office_expr", "deliveryDumpKgtOfficeExpr"),
+                _tariff_field("delivery_dump_kgt_office_base", "deliveryDumpKgtOfficeBase"),
+                _tariff_field("delivery_dump_kgt_office_liter", "deliveryDumpKgtOfficeLiter"),
+                Field("delivery_dump_kgt_return_expr", "deliveryDumpKgtReturnExpr"),
+                Field("delivery_dump_srg_office_expr", "deliveryDumpSrgOfficeExpr"),
+                Field("delivery_dump_srg_return_expr", "deliveryDumpSrgReturnExpr"),
+            ),
+            table="wb_return_tariffs",
+            # Тарифы на будущие даты WB может исправить до их наступления
+            conflict_target="wb_return_tariffs_warehouse_name_date_key",
+            key_fields=("date", "warehouse_name"),
+            change_keys=("warehouse_name",),
+            horizon_days=int(os.getenv("WB_RETURN_TARIFFS_HORIZON_DAYS", "7")),
+        ),
+        DatasetSpec(
+            name="categories",
+            method="GET",
+            url=(
+                "https://seller.wildberries.ru/ns/categories-info/"
+                "suppliers-portal-analytics/api/v1/subjects"
+            ),
+            cookies=LOCALE_COOKIES,
+            response_path=("data",),
+            nested_path="subjects",
+            fields=(
+                Field("category_name", "parent.name"),
+                Field("item_name", "name"),
+            ),
+            table="wb_categories",
+            dates=NO_DATES,
+            key_fields=("category_name", "item_name"),
+            reference=True,
+        ),
+    )
+}
@@ -0,0 +1,56 @@
+import asyncio
+import datetime
+import hashlib
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+from dotenv import load_dotenv
+
+from metrics import metrics
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Одновременных запросов при загрузке диапазона дат одного эндпоинта
+DATE_RANGE_CONCURRENCY = int(os.getenv("WB_DATE_RANGE_CONCURRENCY", "3"))
+
+
+@dataclass
+class PayloadGroup:
+    """
+    Одинаковые ответы эндпоинта на разные даты
+    """
+
+    digest: str
+    body: bytes
+    dates: list = field(default_factory=list)
+
+
+async def fetch_date_range(
+    name: str,
+    fetch: Callable[[datetime.date], Awaitable[bytes]],
+    dates: list[datetime.date],
+    concurrency: int = DATE_RANGE_CONCURRENCY,
+) -> list[PayloadGroup]:
+    """
+    Загрузка тел ответов за несколько дат с ограничением одновременных
+    запросов. Ответы группируются по хэшу тела, чтобы разбирать каждый
+    различный ответ один раз
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch_one(date):
+        async with semaphore:
+            return date, await fetch(date)
+
+    responses = await asyncio.gather(*(fetch_one(date) for date in dates))
+    groups = {}
+    for date, body in sorted(responses):
+        digest = hashlib.sha256(body).hexdigest()
+        groups.setdefault(digest, PayloadGroup(digest, body)).dates.append(date)
+    metrics.increment(f"date_range.{name}.responses", len(responses))
+    metrics.increment(f"date_range.{name}.distinct_payloads", len(groups))
+    return list(groups.values())
@@ -1,10 +1,118 @@
-import asyncpg
+import asyncio
+import datetime
+import json
+import logging
 import os
 
+import asyncpg
 from dotenv import load_dotenv
 
+from aggregates import AGGREGATES, affected_buckets
+from encoding import DICTIONARIES, ENCODED_TABLES, decoded_view_query
+from spool import CONNECTION_ERRORS, WriteSpool
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Ключи дневных таблиц без даты: по ним отслеживается история значений
+DAILY_TABLES_KEYS = {
+    "wb_seller_logistics_coefficients": ("seller_id",),
+    "wb_logistics_rates": ("category_id",),
+    "wb_warehouses_tariffs": ("warehouse_name",),
+    "wb_acceptance_coefficients": ("warehouse_id_from_json", "acceptance_type"),
+    "wb_return_tariffs": ("warehouse_name",),
+    "wb_commission_rates": ("category_name", "item_name"),
+}
+
+# Таблицы с интервальным режимом хранения: дневная таблица -> (интервальная таблица, ключ)
+INTERVAL_TABLES = {
+    "wb_warehouses_tariffs": ("wb_warehouses_tariffs_intervals", ("warehouse_name",)),
+    "wb_return_tariffs": ("wb_return_tariffs_intervals", ("warehouse_name",)),
+}
+
+# Канал NOTIFY с изменениями тарифов и коэффициентов
+CHANGE_FEED_CHANNEL = "wb_tariff_changes"
+# Уведомления больше этого размера (предел Postgres - 8000 байт) пишутся
+# в wb_change_feed, а в канал уходит только ссылка на запись
+NOTIFY_PAYLOAD_LIMIT = 7500
+# Срок хранения записей wb_change_feed: подписчики дочитывают их сразу
+# после уведомления, старые записи удаляются при create_tables
+CHANGE_FEED_RETENTION_DAYS = int(os.getenv("CHANGE_FEED_RETENTION_DAYS", "7"))
+
+# Ожидание соединения из пула при записи пакета, секунд
+WRITE_ACQUIRE_TIMEOUT = float(os.getenv("WRITE_ACQUIRE_TIMEOUT_SECONDS", "30"))
+
+# Попытки записать журнал перед новым пакетом: пауза между ними удваивается
+SPOOL_REPLAY_ATTEMPTS = int(os.getenv("SPOOL_REPLAY_ATTEMPTS", "3"))
+SPOOL_REPLAY_BACKOFF = float(os.getenv("SPOOL_REPLAY_BACKOFF_SECONDS", "1"))
+
+# Индексы под основные запросы к большим таблицам: (имя, таблица, определение).
+# Имя начинается с имени таблицы - по нему называются индексы секций
+ACCESS_INDEXES = (
+    ("wb_warehouses_tariffs_date_brin", "wb_warehouses_tariffs", "USING BRIN (date)"),
+    (
+        "wb_warehouses_tariffs_warehouse_date_idx",
+        "wb_warehouses_tariffs",
+        "(warehouse_id, date) INCLUDE (box_delivery_base, box_delivery_liter, "
+        "box_storage_base, box_storage_liter, pallet_delivery_value_base, "
+        "pallet_delivery_value_liter, pallet_storage_value_expr)",
+    ),
+    ("wb_warehouses_tariffs_latest_idx", "wb_warehouses_tariffs", "(warehouse_name, date DESC)"),
+    ("wb_acceptance_coefficients_date_brin", "wb_acceptance_coefficients", "USING BRIN (date)"),
+    (
+        "wb_acceptance_coefficients_warehouse_date_idx",
+        "wb_acceptance_coefficients",
+        "(warehouse_id, acceptance_type, date) INCLUDE (coefficient)",
+    ),
+    ("wb_return_tariffs_date_brin", "wb_return_tariffs", "USING BRIN (date)"),
+    (
+        "wb_return_tariffs_latest_idx",
+        "wb_return_tariffs",
+        "(warehouse_name, date DESC) INCLUDE (delivery_dump_sup_office_base, "
+        "delivery_dump_sup_office_liter, delivery_dump_sup_courier_base, "
+        "delivery_dump_sup_courier_liter)",
+    ),
+    ("wb_commission_rates_date_brin", "wb_commission_rates", "USING BRIN (date)"),
+    (
+        "wb_commission_rates_latest_idx",
+        "wb_commission_rates",
+        "(category_name, item_name, date DESC) INCLUDE (fbo_rate, fbs_rate, china_rate)",
+    ),
+    (
+        "wb_warehouses_tariffs_encoded_date_brin",
+        "wb_warehouses_tariffs_encoded",
+        "USING BRIN (date)",
+    ),
+    (
+        "wb_warehouses_tariffs_encoded_latest_idx",
+        "wb_warehouses_tariffs_encoded",
+        "(warehouse_name_id, date DESC)",
+    ),
+    ("wb_return_tariffs_encoded_date_brin", "wb_return_tariffs_encoded", "USING BRIN (date)"),
+    (
+        "wb_commission_rates_encoded_date_brin",
+        "wb_commission_rates_encoded",
+        "USING BRIN (date)",
+    ),
+)
+
+# Таблицы, которые при TARIFFS_PARTITIONING=monthly секционируются по месяцам
+PARTITIONED_TABLES = (
+    "wb_warehouses_tariffs",
+    "wb_acceptance_coefficients",
+    "wb_return_tariffs",
+    "wb_commission_rates",
+    "wb_warehouses_tariffs_encoded",
+    "wb_return_tariffs_encoded",
+    "wb_commission_rates_encoded",
+)
+
+
+def add_months(date: datetime.date, months: int) -> datetime.date:
+    month_index = date.year * 12 + date.month - 1 + months
+    return datetime.date(month_index // 12, month_index % 12 + 1, 1)
+
 
 class DBClient:
     def __init__(self):
@@ -13,6 +121,17 @@ class DBClient:
         self.db_user = os.getenv("POSTGRES_USER")
         self.db_password = os.getenv("POSTGRES_PASSWORD")
         self.db_name = os.getenv("POSTGRES_DB")
+        self.storage_mode = os.getenv("TARIFFS_STORAGE_MODE", "daily")
+        self.partitioning = os.getenv("TARIFFS_PARTITIONING", "")
+        self.partition_months_ahead = int(
+            os.getenv("TARIFFS_PARTITION_MONTHS_AHEAD", "2")
+        )
+        retention = os.getenv("TARIFFS_PARTITION_RETENTION_MONTHS")
+        self.partition_retention_months = int(retention) if retention else None
+        # Журнал включается явно: относительный путь зависел бы от каталога
+        # запуска (cron), и сегменты из разных каталогов не повторялись бы
+        spool_dir = os.getenv("WRITE_SPOOL_DIR", "")
+        self.spool = WriteSpool(spool_dir) if spool_dir else None
         self.pool = None
 
     async def create_pool(self):
@@ -28,6 +147,12 @@ class DBClient:
         await self.pool.close()
 
     async def create_tables(self):
+        if self.partitioning == "monthly":
+            id_column = "id SERIAL, PRIMARY KEY (id, date)"
+            partition_clause = " PARTITION BY RANGE (date)"
+        else:
+            id_column = "id SERIAL PRIMARY KEY"
+            partition_clause = ""
         queries = [
             """
             CREATE TABLE IF NOT EXISTS wb_sellers_tariffs (
@@ -42,9 +167,14 @@ class DBClient:
                 id SERIAL PRIMARY KEY,
                 category_name VARCHAR,
                 item_name VARCHAR,
+                removed_at DATE,
                 UNIQUE (category_name, item_name)
             );
             """,
+            # Дата, с которой предмета нет в справочнике WB, NULL - действующий
+            """
+            ALTER TABLE wb_categories ADD COLUMN IF NOT EXISTS removed_at DATE;
+            """,
             """ 
             CREATE TABLE IF NOT EXISTS wb_warehouses (
                 id SERIAL PRIMARY KEY,
@@ -75,8 +205,48 @@ class DBClient:
             );
             """,
             """
+            CREATE TABLE IF NOT EXISTS wb_seller_health (
+                seller_id INT PRIMARY KEY
+                    REFERENCES wb_sellers_tariffs (id) ON DELETE CASCADE,
+                consecutive_failures INT NOT NULL DEFAULT 0,
+                last_success_at TIMESTAMPTZ,
+                last_failure_at TIMESTAMPTZ,
+                last_error VARCHAR(255),
+                quarantined_until TIMESTAMPTZ,
+                credentials_digest CHAR(64)
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS wb_fetch_log (
+                dataset VARCHAR(50),
+                scope VARCHAR(50),
+                date DATE,
+                fetched_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                PRIMARY KEY (dataset, scope, date)
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS wb_change_feed (
+                id BIGSERIAL PRIMARY KEY,
+                dataset VARCHAR(50),
+                payload JSONB,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+            CREATE INDEX IF NOT EXISTS wb_change_feed_created_at_brin
+                ON wb_change_feed USING BRIN (created_at);
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS wb_payload_hashes (
+                endpoint VARCHAR(50),
+                params VARCHAR(255),
+                digest CHAR(64) NOT NULL,
+                confirmed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                PRIMARY KEY (endpoint, params)
+            );
+            """,
+            f"""
             CREATE TABLE IF NOT EXISTS wb_warehouses_tariffs (
-                id SERIAL PRIMARY KEY,
+                {id_column},
                 date DATE,
                 warehouse_name VARCHAR,
                 box_delivery_and_storage_expr FLOAT,
@@ -109,11 +279,11 @@ class DBClient:
                 pallet_visible_expr FLOAT,     
                 UNIQUE (date, warehouse_name),
                 FOREIGN KEY (warehouse_id) REFERENCES wb_warehouses (id)
-            );
+            ){partition_clause};
             """,
-            """
+            f"""
             CREATE TABLE IF NOT EXISTS wb_acceptance_coefficients (
-                id SERIAL PRIMARY KEY,
+                {id_column},
                 date DATE,
                 acceptance_type INT,
                 coefficient INT,
@@ -122,11 +292,11 @@ class DBClient:
                 warehouse_id INT,
                 FOREIGN KEY (warehouse_id) REFERENCES wb_warehouses (id),
                 UNIQUE(date,warehouse_id,acceptance_type)
-                );
+                ){partition_clause};
             """,
-            """
+            f"""
             CREATE TABLE IF NOT EXISTS wb_return_tariffs (
-                id SERIAL PRIMARY KEY,
+                {id_column},
                 date DATE,
                 warehouse_sort INT,
                 warehouse_name VARCHAR(255) NOT NULL,
@@ -144,11 +314,11 @@ class DBClient:
                 delivery_dump_srg_office_expr VARCHAR(255),
                 delivery_dump_srg_return_expr VARCHAR(255),
                 UNIQUE (warehouse_name, date)
-                );
+                ){partition_clause};
             """,
-            """
+            f"""
                 CREATE TABLE IF NOT EXISTS wb_commission_rates (
-                    id SERIAL PRIMARY KEY,
+                    {id_column},
                     category_name VARCHAR,
                     item_name VARCHAR,
                     date DATE,
@@ -156,13 +326,578 @@ class DBClient:
                     fbs_rate FLOAT,
                     china_rate FLOAT,
                     UNIQUE (category_name, item_name, date)
+                ){partition_clause};
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS wb_fulfillments (
+                id SERIAL PRIMARY KEY,
+                fulfillment_name VARCHAR(50),
+                warehouse_id INT,
+                acceptance_rate FLOAT,
+                storage_rate FLOAT,
+                box_delivery_rate FLOAT,
+                pallet_delivery_rate FLOAT,
+                date DATE DEFAULT CURRENT_DATE,
+                UNIQUE (fulfillment_name, warehouse_id, date),
+                FOREIGN KEY (warehouse_id) REFERENCES wb_warehouses (id)
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS wb_redemption_rates (
+                id SERIAL PRIMARY KEY,
+                category_id INT,
+                redemption_rate FLOAT,
+                date DATE DEFAULT CURRENT_DATE,
+                UNIQUE (category_id, date),
+                FOREIGN KEY (category_id) REFERENCES wb_categories (id)
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS wb_warehouses_tariffs_intervals (
+                id SERIAL PRIMARY KEY,
+                warehouse_name VARCHAR NOT NULL,
+                box_delivery_and_storage_expr FLOAT,
+                box_delivery_base FLOAT,
+                box_delivery_liter FLOAT,
+                box_storage_base FLOAT,
+                box_storage_liter FLOAT,
+                pallet_delivery_expr FLOAT,
+                pallet_delivery_value_base FLOAT,
+                pallet_delivery_value_liter FLOAT,
+                pallet_storage_expr FLOAT,
+                pallet_storage_value_expr FLOAT,
+                warehouse_id INT,
+                box_delivery_and_storage_color_expr VARCHAR,
+                box_delivery_and_storage_color_expr_next VARCHAR,
+                box_delivery_and_storage_diff_sign INTEGER,
+                box_delivery_and_storage_diff_sign_next INTEGER,
+                box_delivery_and_storage_expr_next FLOAT,
+                box_delivery_and_storage_visible_expr FLOAT,
+                pallet_delivery_color_expr VARCHAR,
+                pallet_delivery_color_expr_next VARCHAR,
+                pallet_delivery_diff_sign INTEGER,
+                pallet_delivery_diff_sign_next INTEGER,
+                pallet_delivery_expr_next FLOAT,
+                pallet_storage_color_expr VARCHAR,
+                pallet_storage_color_expr_next VARCHAR,
+                pallet_storage_diff_sign INTEGER,
+                pallet_storage_diff_sign_next INTEGER,
+                pallet_storage_expr_next FLOAT,
+                pallet_visible_expr FLOAT,
+                valid_from DATE NOT NULL,
+                valid_to DATE NOT NULL,
+                CHECK (valid_from <= valid_to),
+                UNIQUE (warehouse_name, valid_from),
+                FOREIGN KEY (warehouse_id) REFERENCES wb_warehouses (id)
+            );
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS wb_warehouses_tariffs_intervals_period_idx
+                ON wb_warehouses_tariffs_intervals (valid_from, valid_to);
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS wb_return_tariffs_intervals (
+                id SERIAL PRIMARY KEY,
+                warehouse_sort INT,
+                warehouse_name VARCHAR(255) NOT NULL,
+                delivery_dump_sup_office_expr VARCHAR(255),
+                delivery_dump_sup_office_base FLOAT,
+                delivery_dump_sup_office_liter FLOAT,
+                delivery_dump_sup_courier_expr VARCHAR(255),
+                delivery_dump_sup_courier_base FLOAT,
+                delivery_dump_sup_courier_liter FLOAT,
+                delivery_dump_sup_return_expr VARCHAR(255),
+                delivery_dump_kgt_office_expr VARCHAR(255),
+                delivery_dump_kgt_office_base FLOAT,
+                delivery_dump_kgt_office_liter FLOAT,
+                delivery_dump_kgt_return_expr VARCHAR(255),
+                delivery_dump_srg_office_expr VARCHAR(255),
+                delivery_dump_srg_return_expr VARCHAR(255),
+                valid_from DATE NOT NULL,
+                valid_to DATE NOT NULL,
+                CHECK (valid_from <= valid_to),
+                UNIQUE (warehouse_name, valid_from)
+            );
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS wb_return_tariffs_intervals_period_idx
+                ON wb_return_tariffs_intervals (valid_from, valid_to);
+            """,
+            """
+            CREATE OR REPLACE VIEW wb_warehouses_tariffs_daily AS
+                SELECT day::date AS date, t.*
+                FROM wb_warehouses_tariffs_intervals t,
+                     generate_series(t.valid_from, t.valid_to, interval '1 day') AS day;
+            """,
+            """
+            CREATE OR REPLACE VIEW wb_return_tariffs_daily AS
+                SELECT day::date AS date, t.*
+                FROM wb_return_tariffs_intervals t,
+                     generate_series(t.valid_from, t.valid_to, interval '1 day') AS day;
+            """,
+            """
+            CREATE OR REPLACE FUNCTION wb_warehouses_tariffs_on(target_date DATE)
+            RETURNS SETOF wb_warehouses_tariffs_daily AS $$
+                SELECT target_date, t.*
+                FROM wb_warehouses_tariffs_intervals t
+                WHERE t.valid_from <= target_date AND t.valid_to >= target_date;
+            $$ LANGUAGE sql STABLE;
+            """,
+            """
+            CREATE OR REPLACE FUNCTION wb_return_tariffs_on(target_date DATE)
+            RETURNS SETOF wb_return_tariffs_daily AS $$
+                SELECT target_date, t.*
+                FROM wb_return_tariffs_intervals t
+                WHERE t.valid_from <= target_date AND t.valid_to >= target_date;
+            $$ LANGUAGE sql STABLE;
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS wb_warehouses_tariffs_weekly (
+                warehouse_name VARCHAR NOT NULL,
+                week DATE NOT NULL,
+                days INT,
+                avg_box_delivery_and_storage_expr FLOAT,
+                min_box_delivery_and_storage_expr FLOAT,
+                max_box_delivery_and_storage_expr FLOAT,
+                avg_box_delivery_base FLOAT,
+                avg_pallet_delivery_expr FLOAT,
+                changes INT,
+                PRIMARY KEY (warehouse_name, week)
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS wb_acceptance_coefficients_weekly (
+                warehouse_name VARCHAR NOT NULL,
+                acceptance_type INT NOT NULL,
+                week DATE NOT NULL,
+                days INT,
+                available_days INT,
+                free_days INT,
+                avg_coefficient FLOAT,
+                min_coefficient INT,
+                max_coefficient INT,
+                changes INT,
+                PRIMARY KEY (warehouse_name, acceptance_type, week)
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS wb_commission_rates_weekly (
+                category_name VARCHAR NOT NULL,
+                week DATE NOT NULL,
+                changes INT,
+                new_items INT,
+                items INT,
+                avg_fbo_rate FLOAT,
+                min_fbo_rate FLOAT,
+                max_fbo_rate FLOAT,
+                avg_fbo_rate_delta FLOAT,
+                avg_fbs_rate_delta FLOAT,
+                PRIMARY KEY (category_name, week)
+            );
+            """,
+            *(
+                f"""
+                CREATE TABLE IF NOT EXISTS {dictionary} (
+                    id {id_type} PRIMARY KEY,
+                    value VARCHAR NOT NULL UNIQUE
                 );
+                """
+                for dictionary, id_type in DICTIONARIES.items()
+            ),
+            f"""
+            CREATE TABLE IF NOT EXISTS wb_warehouses_tariffs_encoded (
+                {id_column},
+                date DATE,
+                warehouse_name_id SMALLINT REFERENCES wb_dict_warehouse_names (id),
+                box_delivery_and_storage_expr FLOAT,
+                box_delivery_base FLOAT,
+                box_delivery_liter FLOAT,
+                box_storage_base FLOAT,
+                box_storage_liter FLOAT,
+                pallet_delivery_expr FLOAT,
+                pallet_delivery_value_base FLOAT,
+                pallet_delivery_value_liter FLOAT,
+                pallet_storage_expr FLOAT,
+                pallet_storage_value_expr FLOAT,
+                warehouse_id INT REFERENCES wb_warehouses (id),
+                box_delivery_and_storage_color_expr_id SMALLINT
+                    REFERENCES wb_dict_color_exprs (id),
+                box_delivery_and_storage_color_expr_next_id SMALLINT
+                    REFERENCES wb_dict_color_exprs (id),
+                box_delivery_and_storage_diff_sign SMALLINT,
+                box_delivery_and_storage_diff_sign_next SMALLINT,
+                box_delivery_and_storage_expr_next FLOAT,
+                box_delivery_and_storage_visible_expr FLOAT,
+                pallet_delivery_color_expr_id SMALLINT REFERENCES wb_dict_color_exprs (id),
+                pallet_delivery_color_expr_next_id SMALLINT REFERENCES wb_dict_color_exprs (id),
+                pallet_delivery_diff_sign SMALLINT,
+                pallet_delivery_diff_sign_next SMALLINT,
+                pallet_delivery_expr_next FLOAT,
+                pallet_storage_color_expr_id SMALLINT REFERENCES wb_dict_color_exprs (id),
+                pallet_storage_color_expr_next_id SMALLINT REFERENCES wb_dict_color_exprs (id),
+                pallet_storage_diff_sign SMALLINT,
+                pallet_storage_diff_sign_next SMALLINT,
+                pallet_storage_expr_next FLOAT,
+                pallet_visible_expr FLOAT,
+                CONSTRAINT wb_warehouses_tariffs_encoded_date_warehouse_key
+                    UNIQUE (date, warehouse_name_id)
+            ){partition_clause};
+            """,
+            f"""
+            CREATE TABLE IF NOT EXISTS wb_return_tariffs_encoded (
+                {id_column},
+                date DATE,
+                warehouse_sort INT,
+                warehouse_name_id SMALLINT NOT NULL REFERENCES wb_dict_warehouse_names (id),
+                delivery_dump_sup_office_expr VARCHAR(255),
+                delivery_dump_sup_office_base FLOAT,
+                delivery_dump_sup_office_liter FLOAT,
+                delivery_dump_sup_courier_expr VARCHAR(255),
+                delivery_dump_sup_courier_base FLOAT,
+                delivery_dump_sup_courier_liter FLOAT,
+                delivery_dump_sup_return_expr VARCHAR(255),
+                delivery_dump_kgt_office_expr VARCHAR(255),
+                delivery_dump_kgt_office_base FLOAT,
+                delivery_dump_kgt_office_liter FLOAT,
+                delivery_dump_kgt_return_expr VARCHAR(255),
+                delivery_dump_srg_office_expr VARCHAR(255),
+                delivery_dump_srg_return_expr VARCHAR(255),
+                CONSTRAINT wb_return_tariffs_encoded_warehouse_date_key
+                    UNIQUE (warehouse_name_id, date)
+            ){partition_clause};
+            """,
+            f"""
+            CREATE TABLE IF NOT EXISTS wb_commission_rates_encoded (
+                {id_column},
+                category_name_id SMALLINT REFERENCES wb_dict_category_names (id),
+                item_name_id INT REFERENCES wb_dict_item_names (id),
+                date DATE,
+                fbo_rate FLOAT,
+                fbs_rate FLOAT,
+                china_rate FLOAT,
+                CONSTRAINT wb_commission_rates_encoded_item_date_key
+                    UNIQUE (category_name_id, item_name_id, date)
+            ){partition_clause};
             """,
         ]
         for query in queries:
             await self.pool.execute(query)
+        await self.create_indexes()
+        await self.create_decoded_views()
+        await self.maintain_partitions()
+        await self.prune_change_feed()
+
+    async def prune_change_feed(self):
+        """
+        Удаление записей wb_change_feed старше срока хранения
+        """
+        deleted = await self.pool.execute(
+            "DELETE FROM wb_change_feed WHERE created_at < now() - make_interval(days => $1)",
+            CHANGE_FEED_RETENTION_DAYS,
+        )
+        rows = int(deleted.split()[-1])
+        if rows:
+            logger.info(f"Удалено устаревших записей wb_change_feed: {rows}")
+
+    async def create_indexes(self):
+        """
+        Индексы ACCESS_INDEXES без блокировки записи в существующие таблицы:
+        CREATE INDEX CONCURRENTLY, каждая команда вне транзакции. У
+        секционированной таблицы индекс создается только на родителе
+        (ON ONLY), на секциях - CONCURRENTLY с присоединением к нему;
+        новые секции получают его автоматически. Готовые индексы
+        пропускаются, невалидные после прерванного построения пересоздаются
+        """
+        for name, table_name, definition in ACCESS_INDEXES:
+            if await self._index_valid(name):
+                continue
+            relkind = await self.pool.fetchval(
+                "SELECT relkind::text FROM pg_class WHERE oid = to_regclass($1)", table_name
+            )
+            if relkind != "p":
+                await self._create_index_concurrently(name, table_name, definition)
+                continue
+            await self.pool.execute(
+                f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table_name} {definition}"
+            )
+            partitions = await self.pool.fetch(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "WHERE pg_inherits.inhparent = to_regclass($1)",
+                table_name,
+            )
+            suffix = name[len(table_name):]
+            for partition in partitions:
+                partition_index = f"{partition['relname']}{suffix}"
+                await self._create_index_concurrently(
+                    partition_index, partition["relname"], definition
+                )
+                await self.pool.execute(
+                    f"ALTER INDEX {name} ATTACH PARTITION {partition_index}"
+                )
+
+    async def _index_valid(self, name: str):
+        """
+        True - индекс готов, False - невалиден, None - индекса нет
+        """
+        return await self.pool.fetchval(
+            "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1)", name
+        )
+
+    async def _create_index_concurrently(self, name: str, table_name: str, definition: str):
+        if await self._index_valid(name) is False:
+            await self.pool.execute(f"DROP INDEX CONCURRENTLY {name}")
+        started = datetime.datetime.now()
+        await self.pool.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table_name} {definition}"
+        )
+        logger.info(f"Индекс {name} построен за {datetime.datetime.now() - started}")
+
+    async def create_decoded_views(self):
+        """
+        Представления кодированных таблиц с колонками и порядком колонок
+        исходных дневных таблиц: читатели работают с ними как с дневными
+        """
+        for table_name, encoded in ENCODED_TABLES.items():
+            columns = await self.pool.fetch(
+                "SELECT column_name FROM information_schema.columns "
+                "WHERE table_schema = current_schema() AND table_name = $1 "
+                "ORDER BY ordinal_position",
+                table_name,
+            )
+            await self.pool.execute(
+                decoded_view_query(encoded, [row["column_name"] for row in columns])
+            )
+
+    def source_table(self, table_name: str) -> str:
+        """
+        Таблица или представление с дневными строками table_name
+        в текущем режиме хранения
+        """
+        if self.storage_mode == "interval" and table_name in INTERVAL_TABLES:
+            return f"{table_name}_daily"
+        if self.storage_mode == "encoded" and table_name in ENCODED_TABLES:
+            return ENCODED_TABLES[table_name].view
+        return table_name
+
+    async def dictionary(self, dictionary: str) -> dict:
+        """
+        Словарь значение -> id целиком
+        """
+        rows = await self.pool.fetch(f"SELECT id, value FROM {dictionary}")
+        return {row["value"]: row["id"] for row in rows}
+
+    async def dictionary_ids(self, dictionary: str, values: list[str]) -> dict:
+        """
+        id новых значений словаря. Вызывается только для значений, которых
+        не было в словаре: каждая вставка с конфликтом расходует номер
+        последовательности, а id словарей - SMALLINT
+        """
+        await self.pool.execute(
+            f"INSERT INTO {dictionary} (value) SELECT unnest($1::varchar[]) "
+            f"ON CONFLICT (value) DO NOTHING",
+            values,
+        )
+        rows = await self.pool.fetch(
+            f"SELECT id, value FROM {dictionary} WHERE value = ANY($1::varchar[])", values
+        )
+        return {row["value"]: row["id"] for row in rows}
+
+    async def create_partition(self, table_name, month: datetime.date):
+        """
+        Создание месячной секции таблицы, month - любой день месяца.
+        Строки месяца, уже попавшие в секцию по умолчанию, переносятся в
+        новую секцию в той же транзакции
+        """
+        start = month.replace(day=1)
+        end = add_months(start, 1)
+        partition = f"{table_name}_p{start:%Y%m}"
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                if await connection.fetchval("SELECT to_regclass($1) IS NOT NULL", partition):
+                    return
+                await connection.execute(
+                    f"CREATE TABLE {partition} "
+                    f"(LIKE {table_name} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+                )
+                moved = await connection.execute(
+                    f"WITH moved AS (DELETE FROM {table_name}_default "
+                    f"WHERE date >= $1 AND date < $2 RETURNING *) "
+                    f"INSERT INTO {partition} SELECT * FROM moved",
+                    start,
+                    end,
+                )
+                await connection.execute(
+                    f"ALTER TABLE {table_name} ATTACH PARTITION {partition} "
+                    f"FOR VALUES FROM ('{start}') TO ('{end}');"
+                )
+        rows = int(moved.split()[-1])
+        if rows:
+            logger.info(f"Секция {partition}: перенесено строк из секции по умолчанию: {rows}")
+
+    async def maintain_partitions(self):
+        """
+        Создание секции по умолчанию, секций на текущий и следующие месяцы и
+        отсоединение секций старше срока хранения. Секция по умолчанию
+        принимает строки за месяцы без своей секции (например, даты за
+        горизонтом), чтобы запись не падала. Отсоединенные секции остаются
+        обычными таблицами
+        """
+        if self.partitioning != "monthly":
+            return
+        current_month = datetime.date.today().replace(day=1)
+        for table_name in PARTITIONED_TABLES:
+            relkind = await self.pool.fetchval(
+                "SELECT relkind::text FROM pg_class WHERE oid = to_regclass($1)", table_name
+            )
+            if relkind != "p":
+                logger.warning(f"Таблица {table_name} не секционирована, пропускаем")
+                continue
+            await self.pool.execute(
+                f"CREATE TABLE IF NOT EXISTS {table_name}_default "
+                f"PARTITION OF {table_name} DEFAULT;"
+            )
+            for offset in range(self.partition_months_ahead + 1):
+                await self.create_partition(table_name, add_months(current_month, offset))
+            if self.partition_retention_months is None:
+                continue
+            oldest = add_months(current_month, -self.partition_retention_months)
+            partitions = await self.pool.fetch(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "WHERE pg_inherits.inhparent = to_regclass($1)",
+                table_name,
+            )
+            for partition in partitions:
+                suffix = partition["relname"].rsplit("_p", 1)[-1]
+                if not suffix.isdigit() or len(suffix) != 6:
+                    continue
+                month = datetime.date(int(suffix[:4]), int(suffix[4:]), 1)
+                if month < oldest:
+                    await self.pool.execute(
+                        f"ALTER TABLE {table_name} DETACH PARTITION {partition['relname']};"
+                    )
+                    logger.info(f"Секция {partition['relname']} отсоединена")
+
+    def unit_of_work(self) -> "UnitOfWork":
+        return UnitOfWork(self)
+
+    async def mark_fetched(
+        self, dataset: str, scope: str, date: datetime.date, connection=None
+    ):
+        """
+        Запись в журнал загрузок: данные набора для области и даты получены
+        """
+        await (connection or self.pool).execute(
+            "INSERT INTO wb_fetch_log (dataset, scope, date) VALUES ($1, $2, $3) "
+            "ON CONFLICT (dataset, scope, date) DO UPDATE SET fetched_at = now()",
+            dataset,
+            scope,
+            date,
+        )
 
-    async def insert_data(self, table_name, data):
+    async def store_payload_hashes(self, records: list[tuple], connection=None):
+        """
+        Запись хэшей ответов: записи (эндпоинт, параметры, хэш)
+        """
+        if not records:
+            return
+        await (connection or self.pool).executemany(
+            "INSERT INTO wb_payload_hashes (endpoint, params, digest) VALUES ($1, $2, $3) "
+            "ON CONFLICT (endpoint, params) DO UPDATE "
+            "SET digest = EXCLUDED.digest, confirmed_at = now()",
+            records,
+        )
+
+    async def refresh_aggregates(self, dataset, data, connection=None):
+        """
+        Пересчет агрегатных таблиц набора данных только для корзин
+        (ключ, неделя), затронутых записанными строками
+        """
+        if not data:
+            return
+        aggregate = AGGREGATES[dataset]
+        buckets = affected_buckets(aggregate, data)
+        arrays = ", ".join(
+            f"${i + 1}::{key_type}[]" for i, key_type in enumerate(aggregate.key_types)
+        )
+        columns = ", ".join(aggregate.key_fields + ("week",))
+        await self._recompute_aggregate(
+            aggregate,
+            f"SELECT DISTINCT * FROM unnest({arrays}, ${len(aggregate.key_types) + 1}::date[]) "
+            f"AS buckets ({columns})",
+            [list(values) for values in zip(*buckets)],
+            connection,
+        )
+
+    async def rebuild_aggregates(self, dataset, connection=None):
+        """
+        Полный пересчет агрегатной таблицы по всей истории
+        """
+        aggregate = AGGREGATES[dataset]
+        key_columns = ", ".join(aggregate.key_fields)
+        await self._recompute_aggregate(
+            aggregate,
+            f"SELECT DISTINCT {key_columns}, date_trunc('week', date)::date AS week "
+            f"FROM {self.source_table(aggregate.source)}",
+            [],
+            connection,
+            rebuild=True,
+        )
+
+    async def _recompute_aggregate(
+        self, aggregate, buckets_query, args, connection=None, rebuild=False
+    ):
+        if connection is None:
+            async with self.pool.acquire() as connection:
+                async with connection.transaction():
+                    return await self._recompute_aggregate(
+                        aggregate, buckets_query, args, connection, rebuild
+                    )
+        key_match = " AND ".join(
+            f"{aggregate.table}.{field} = buckets.{field}"
+            for field in aggregate.key_fields + ("week",)
+        )
+        if rebuild:
+            await connection.execute(f"TRUNCATE {aggregate.table}")
+        else:
+            await connection.execute(
+                f"DELETE FROM {aggregate.table} USING ({buckets_query}) buckets "
+                f"WHERE {key_match}",
+                *args,
+            )
+        query = aggregate.query.format(source=self.source_table(aggregate.source))
+        await connection.execute(
+            f"WITH buckets AS ({buckets_query}) "
+            f"INSERT INTO {aggregate.table} ({', '.join(aggregate.columns)}) {query}",
+            *args,
+        )
+
+    async def notify_changes(
+        self, dataset: str, data: list[dict], key_fields: tuple, connection=None
+    ):
+        """
+        Уведомление подписчиков об изменении строк набора данных: даты и ключи
+        записанных строк. Уведомление доставляется при фиксации транзакции
+        """
+        if not data:
+            return
+        connection = connection or self.pool
+        dates = sorted({item["date"].isoformat() for item in data})
+        keys = dict.fromkeys(tuple(item[field] for field in key_fields) for item in data)
+        change = {"dataset": dataset, "dates": dates, "keys": [list(key) for key in keys]}
+        payload = json.dumps(change, ensure_ascii=False)
+        if len(payload.encode()) > NOTIFY_PAYLOAD_LIMIT:
+            change_id = await connection.fetchval(
+                "INSERT INTO wb_change_feed (dataset, payload) VALUES ($1, $2::jsonb) "
+                "RETURNING id",
+                dataset,
+                payload,
+            )
+            payload = json.dumps({"dataset": dataset, "dates": dates, "change_id": change_id})
+        await connection.execute("SELECT pg_notify($1, $2)", CHANGE_FEED_CHANNEL, payload)
+
+    async def insert_data(self, table_name, data, connection=None):
         if isinstance(data, dict):
             data = [data]
         keys = data[0].keys()
@@ -172,9 +907,8 @@ class DBClient:
             f"INSERT INTO {table_name} ({columns}) VALUES ("
             f"{values_placeholders}) ON CONFLICT DO NOTHING;"
         )
-        print("DEBUG QUERY:", query)
         values = [tuple(item[key] for key in keys) for item in data]
-        await self.pool.executemany(query, values)
+        await (connection or self.pool).executemany(query, values)
 
     async def insert_update_data(
         self,
@@ -182,6 +916,7 @@ class DBClient:
         data,
         conflict_target=None,
         update_fields=None,
+        connection=None,
     ):
         if isinstance(data, dict):
             data = [data]
@@ -206,5 +941,245 @@ class DBClient:
                     f"INSERT INTO {table_name} ({columns}) VALUES ("
                     f"{values_placeholders}) ON CONFLICT DO NOTHING;"
                 )
-            print("DEBUG QUERY:", query)
-            await self.pool.executemany(query, values)
+            await (connection or self.pool).executemany(query, values)
+
+    async def sync_reference(self, table_name, data, key_fields, connection=None):
+        """
+        Синхронизация справочника с полным списком строк data: ключи
+        key_fields сравниваются с текущими в памяти, новые строки
+        вставляются одним COPY, отсутствующие в data помечаются removed_at,
+        вернувшиеся - снова действующие. Колонки ключа - строковые
+        """
+        if isinstance(data, dict):
+            data = [data]
+        if not data:
+            return
+        if connection is None:
+            async with self.pool.acquire() as connection:
+                await self.sync_reference(table_name, data, key_fields, connection)
+            return
+        keys = ", ".join(key_fields)
+        existing = {
+            tuple(record[field] for field in key_fields): record["removed_at"]
+            for record in await connection.fetch(
+                f"SELECT {keys}, removed_at FROM {table_name}"
+            )
+        }
+        rows = {tuple(item[field] for field in key_fields): item for item in data}
+        new_rows = [item for key, item in rows.items() if key not in existing]
+        restored = [
+            key for key, removed_at in existing.items()
+            if key in rows and removed_at is not None
+        ]
+        removed = [
+            key for key, removed_at in existing.items()
+            if key not in rows and removed_at is None
+        ]
+
+        async with connection.transaction():
+            if new_rows:
+                columns = list(new_rows[0].keys())
+                await connection.copy_records_to_table(
+                    table_name,
+                    records=[tuple(item[column] for column in columns) for item in new_rows],
+                    columns=columns,
+                )
+            for keys_list, removed_at in ((removed, datetime.date.today()), (restored, None)):
+                if not keys_list:
+                    continue
+                arrays = ", ".join(
+                    f"${i + 2}::varchar[]" for i in range(len(key_fields))
+                )
+                matches = " AND ".join(
+                    f"{table_name}.{field} IS NOT DISTINCT FROM changed.{field}"
+                    for field in key_fields
+                )
+                await connection.execute(
+                    f"UPDATE {table_name} SET removed_at = $1 "
+                    f"FROM unnest({arrays}) AS changed ({keys}) WHERE {matches}",
+                    removed_at,
+                    *[list(column) for column in zip(*keys_list)],
+                )
+        logger.info(
+            f"{table_name}: новых {len(new_rows)}, удаленных {len(removed)}, "
+            f"вернувшихся {len(restored)}"
+        )
+
+    async def insert_update_intervals(
+        self,
+        table_name,
+        data,
+        key_fields,
+        overwrite=True,
+        connection=None,
+    ):
+        """
+        Вставка данных в интервальную таблицу (valid_from/valid_to).
+        Если на соседнюю дату значения совпадают, интервал продлевается,
+        если на дату значения изменились - интервал разбивается.
+        overwrite=False повторяет поведение ON CONFLICT DO NOTHING
+        """
+        if isinstance(data, dict):
+            data = [data]
+        if not data:
+            return
+        value_fields = [
+            key for key in data[0].keys() if key not in key_fields and key != "date"
+        ]
+        fields = [*key_fields, *value_fields]
+        rows_by_date = {}
+        for item in data:
+            rows_by_date.setdefault(item["date"], []).append(item)
+
+        if connection is None:
+            async with self.pool.acquire() as connection:
+                await self.insert_update_intervals(
+                    table_name, data, key_fields, overwrite, connection
+                )
+            return
+        async with connection.transaction():
+            for date, rows in sorted(rows_by_date.items()):
+                await self._apply_intervals(
+                    connection, table_name, rows, date, key_fields, fields, overwrite
+                )
+
+    @staticmethod
+    async def _apply_intervals(
+        connection, table_name, rows, date, key_fields, fields, overwrite
+    ):
+        day = datetime.timedelta(days=1)
+        existing = await connection.fetch(
+            f"SELECT id, {', '.join(fields)}, valid_from, valid_to FROM {table_name} "
+            f"WHERE valid_from <= $1 AND valid_to >= $2 FOR UPDATE",
+            date + day,
+            date - day,
+        )
+        covering, previous, following = {}, {}, {}
+        for record in existing:
+            key = tuple(record[field] for field in key_fields)
+            if record["valid_from"] <= date <= record["valid_to"]:
+                covering[key] = record
+            elif record["valid_to"] == date - day:
+                previous[key] = record
+            elif record["valid_from"] == date + day:
+                following[key] = record
+
+        deletes, updates, inserts = [], [], []
+        for row in rows:
+            key = tuple(row[field] for field in key_fields)
+            values = tuple(row[field] for field in fields)
+            prev, next_ = previous.get(key), following.get(key)
+            cover = covering.get(key)
+            if cover:
+                cover_values = tuple(cover[field] for field in fields)
+                if cover_values == values or not overwrite:
+                    continue
+                deletes.append(cover["id"])
+                # Части старого интервала до и после даты сохраняют старые значения
+                if cover["valid_from"] < date:
+                    inserts.append((*cover_values, cover["valid_from"], date - day))
+                    prev = None
+                if cover["valid_to"] > date:
+                    inserts.append((*cover_values, date + day, cover["valid_to"]))
+                    next_ = None
+            merge_prev = prev and tuple(prev[field] for field in fields) == values
+            merge_next = next_ and tuple(next_[field] for field in fields) == values
+            if merge_prev and merge_next:
+                deletes.append(next_["id"])
+                updates.append((prev["id"], prev["valid_from"], next_["valid_to"]))
+            elif merge_prev:
+                updates.append((prev["id"], prev["valid_from"], date))
+            elif merge_next:
+                updates.append((next_["id"], date, next_["valid_to"]))
+            else:
+                inserts.append((*values, date, date))
+
+        if deletes:
+            await connection.execute(
+                f"DELETE FROM {table_name} WHERE id = ANY($1::int[])", deletes
+            )
+        if updates:
+            await connection.executemany(
+                f"UPDATE {table_name} SET valid_from = $2, valid_to = $3 WHERE id = $1",
+                updates,
+            )
+        if inserts:
+            placeholders = ", ".join(f"${i + 1}" for i in range(len(fields) + 2))
+            await connection.executemany(
+                f"INSERT INTO {table_name} ({', '.join(fields)}, valid_from, valid_to) "
+                f"VALUES ({placeholders});",
+                inserts,
+            )
+
+
+class UnitOfWork:
+    """
+    Операции записи, собранные за логический пакет и выполняемые на одном
+    соединении в одной транзакции. Операция - метод записи DBClient с
+    параметром connection, например DBClient.insert_data. Перед записью
+    пакета записывается накопленный журнал (DBClient.spool); если БД
+    недоступна, в журнал сохраняется и сам пакет
+    """
+
+    def __init__(self, db_client: DBClient):
+        self._db_client = db_client
+        self._operations = []
+
+    def add(self, operation, *args, **kwargs) -> None:
+        self._operations.append((operation, args, kwargs))
+
+    async def commit(self) -> None:
+        if not self._operations:
+            return
+        operations, self._operations = self._operations, []
+        spool = self._db_client.spool
+        try:
+            if spool is not None and spool.segments():
+                # Сначала пишутся пакеты из журнала, иначе их повтор
+                # перезапишет свежие значения старыми
+                if not await self._replay(spool):
+                    path = spool.append(self._spooled(operations))
+                    logger.warning(f"Журнал не записан, пакет сохранен в {path}")
+                    return
+            async with self._db_client.pool.acquire(
+                timeout=WRITE_ACQUIRE_TIMEOUT
+            ) as connection:
+                async with connection.transaction():
+                    for operation, args, kwargs in operations:
+                        await operation(*args, connection=connection, **kwargs)
+        except CONNECTION_ERRORS as e:
+            if spool is None:
+                raise
+            path = spool.append(self._spooled(operations))
+            logger.warning(
+                f"БД недоступна ({e!r}), операций сохранено в журнал: "
+                f"{len(operations)}, {path}"
+            )
+            return
+        logger.info(f"Записано операций в одной транзакции: {len(operations)}")
+
+    async def _replay(self, spool: WriteSpool) -> bool:
+        """
+        Запись журнала с повтором при недоступности БД. Сегменты с ошибкой
+        в данных WriteSpool переносит в карантин; False - журнал не записан
+        из-за непредвиденной ошибки, новый пакет встает за ним
+        """
+        for attempt in range(SPOOL_REPLAY_ATTEMPTS):
+            try:
+                replayed = await spool.replay(self._db_client)
+            except CONNECTION_ERRORS:
+                if attempt == SPOOL_REPLAY_ATTEMPTS - 1:
+                    raise
+                await asyncio.sleep(SPOOL_REPLAY_BACKOFF * 2 ** attempt)
+            except Exception as e:
+                logger.error(f"Не удалось записать пакеты из журнала: {e}")
+                return False
+            else:
+                if replayed:
+                    logger.info(f"Записано сегментов журнала: {replayed}")
+                return True
+        return False
+
+    @staticmethod
+    def _spooled(operations: list[tuple]) -> list[tuple]:
+        return [(operation.__name__, args, kwargs) for operation, args, kwargs in operations]
@@ -0,0 +1,60 @@
+import logging
+import math
+import os
+import time
+
+from aiohttp import ClientTimeout
+from dotenv import load_dotenv
+
+from exceptions import DeadlineExceededException
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Общий лимит времени запуска, пусто - без ограничения
+RUN_TIMEOUT = float(os.getenv("RUN_TIMEOUT_SECONDS") or "inf")
+# Лимиты одной попытки запроса к WB, сокращаются до остатка общего лимита
+CONNECT_TIMEOUT = float(os.getenv("WB_CONNECT_TIMEOUT_SECONDS", "10"))
+READ_TIMEOUT = float(os.getenv("WB_READ_TIMEOUT_SECONDS", "60"))
+REQUEST_TIMEOUT = float(os.getenv("WB_REQUEST_TIMEOUT_SECONDS", "120"))
+
+
+class Deadline:
+    """
+    Бюджет времени запуска. Передается из main() в execute_tasks,
+    WbDataExtractor и WbParser; запросы получают таймауты не больше
+    остатка бюджета, а задачи, не успевшие выполниться, собираются для отчета
+    """
+
+    def __init__(self, seconds: float = math.inf):
+        self._expires_at = time.monotonic() + seconds
+        self.cut_off = []
+
+    def remaining(self) -> float:
+        return max(self._expires_at - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self) -> None:
+        if self.expired():
+            raise DeadlineExceededException("Превышен общий лимит времени запуска")
+
+    def client_timeout(self) -> ClientTimeout:
+        remaining = self.remaining()
+        return ClientTimeout(
+            total=min(REQUEST_TIMEOUT, remaining),
+            connect=min(CONNECT_TIMEOUT, remaining),
+            sock_read=min(READ_TIMEOUT, remaining),
+        )
+
+    def report_cut_off(self, task: str) -> None:
+        self.cut_off.append(task)
+
+    def log(self) -> None:
+        if self.cut_off:
+            logger.warning(
+                f"Не выполнены из-за лимита времени ({len(self.cut_off)}): "
+                f"{', '.join(self.cut_off)}"
+            )
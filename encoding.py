@@ -0,0 +1,111 @@
+from dataclasses import dataclass
+
+# Словари повторяющихся строк: таблица (id, value) -> тип id. Складов,
+# категорий и цветов - десятки значений, предметов - тысячи
+DICTIONARIES = {
+    "wb_dict_warehouse_names": "SMALLSERIAL",
+    "wb_dict_color_exprs": "SMALLSERIAL",
+    "wb_dict_category_names": "SMALLSERIAL",
+    "wb_dict_item_names": "SERIAL",
+}
+
+COLOR_COLUMNS = (
+    "box_delivery_and_storage_color_expr",
+    "box_delivery_and_storage_color_expr_next",
+    "pallet_delivery_color_expr",
+    "pallet_delivery_color_expr_next",
+    "pallet_storage_color_expr",
+    "pallet_storage_color_expr_next",
+)
+
+
+@dataclass
+class EncodedTable:
+    """
+    Дневная таблица в кодированном режиме хранения: строковые колонки
+    columns хранятся в table как id словарей (колонка <name>_id),
+    представление view раскодирует их в колонки исходной таблицы.
+    conflict_target - ограничение table по тем же ключам, что у исходной,
+    conflict_columns - его колонки в именах исходной таблицы
+    """
+
+    table: str
+    view: str
+    conflict_target: str
+    conflict_columns: tuple
+    columns: dict
+
+
+ENCODED_TABLES = {
+    "wb_warehouses_tariffs": EncodedTable(
+        table="wb_warehouses_tariffs_encoded",
+        view="wb_warehouses_tariffs_decoded",
+        conflict_target="wb_warehouses_tariffs_encoded_date_warehouse_key",
+        conflict_columns=("date", "warehouse_name"),
+        columns={
+            "warehouse_name": "wb_dict_warehouse_names",
+            **{column: "wb_dict_color_exprs" for column in COLOR_COLUMNS},
+        },
+    ),
+    "wb_return_tariffs": EncodedTable(
+        table="wb_return_tariffs_encoded",
+        view="wb_return_tariffs_decoded",
+        conflict_target="wb_return_tariffs_encoded_warehouse_date_key",
+        conflict_columns=("warehouse_name", "date"),
+        columns={"warehouse_name": "wb_dict_warehouse_names"},
+    ),
+    "wb_commission_rates": EncodedTable(
+        table="wb_commission_rates_encoded",
+        view="wb_commission_rates_decoded",
+        conflict_target="wb_commission_rates_encoded_item_date_key",
+        conflict_columns=("category_name", "item_name", "date"),
+        columns={
+            "category_name": "wb_dict_category_names",
+            "item_name": "wb_dict_item_names",
+        },
+    ),
+}
+
+
+def encoded_column(column: str) -> str:
+    return f"{column}_id"
+
+
+def decoded_view_query(encoded: EncodedTable, columns: list[str]) -> str:
+    """
+    Представление с колонками исходной таблицы columns в том же порядке
+    """
+    select, joins = [], []
+    for column in columns:
+        dictionary = encoded.columns.get(column)
+        if dictionary is None:
+            select.append(f"t.{column}")
+            continue
+        select.append(f"{column}.value AS {column}")
+        joins.append(
+            f"LEFT JOIN {dictionary} {column} ON {column}.id = t.{encoded_column(column)}"
+        )
+    return (
+        f"CREATE OR REPLACE VIEW {encoded.view} AS "
+        f"SELECT {', '.join(select)} FROM {encoded.table} t {' '.join(joins)}"
+    )
+
+
+def encode_rows(encoded: EncodedTable, rows: list[dict], ids: dict) -> list[dict]:
+    """
+    Строки для table: значения колонок словарей заменяются на id,
+    ids - словарь -> {значение: id}, пустые значения остаются NULL
+    """
+    encoded_rows = []
+    for row in rows:
+        encoded_row = {}
+        for column, value in row.items():
+            dictionary = encoded.columns.get(column)
+            if dictionary is None:
+                encoded_row[column] = value
+            else:
+                encoded_row[encoded_column(column)] = (
+                    None if value is None else ids[dictionary][value]
+                )
+        encoded_rows.append(encoded_row)
+    return encoded_rows
@@ -3,3 +3,9 @@ class FailedGetDataException(Exception):
 
 class AuthException(Exception):
     pass
+
+class CircuitOpenException(FailedGetDataException):
+    pass
+
+class DeadlineExceededException(FailedGetDataException):
+    pass
@@ -0,0 +1,108 @@
+import datetime
+import logging
+import os
+from dataclasses import dataclass
+
+from dotenv import load_dotenv
+
+from db_client import DBClient
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Область общих для всех селлеров данных в журнале загрузок
+COMMON_SCOPE = ""
+
+
+@dataclass
+class FreshnessPolicy:
+    """
+    ttl - сколько загруженные данные считаются свежими, None - бессрочно;
+    final_from_date - данные, загруженные в свою дату или позже, больше
+    не меняются; weekly - данные за неделю, ключ - понедельник недели
+    """
+
+    ttl: datetime.timedelta = None
+    final_from_date: bool = False
+    weekly: bool = False
+
+
+def hours(name: str, default: str) -> datetime.timedelta:
+    return datetime.timedelta(hours=float(os.getenv(name, default)))
+
+
+FRESHNESS_POLICIES = {
+    "weekly_rating": FreshnessPolicy(weekly=True),
+    "warehouse_tariffs": FreshnessPolicy(
+        ttl=hours("FRESHNESS_TARIFFS_TTL_HOURS", "6"), final_from_date=True
+    ),
+    "return_tariffs": FreshnessPolicy(
+        ttl=hours("FRESHNESS_TARIFFS_TTL_HOURS", "6"), final_from_date=True
+    ),
+    "commission_rates": FreshnessPolicy(ttl=hours("FRESHNESS_COMMISSION_TTL_HOURS", "24")),
+    # Справочник категорий обновляется вместе с комиссиями
+    "categories": FreshnessPolicy(ttl=hours("FRESHNESS_COMMISSION_TTL_HOURS", "24")),
+    "acceptance_coefficients": FreshnessPolicy(
+        ttl=hours("FRESHNESS_ACCEPTANCE_TTL_HOURS", "1")
+    ),
+}
+
+
+def key_date(dataset: str, date: datetime.date) -> datetime.date:
+    """
+    Дата, под которой загрузка записывается в журнал
+    """
+    if FRESHNESS_POLICIES[dataset].weekly:
+        return date - datetime.timedelta(days=date.weekday())
+    return date
+
+
+class FetchPlanner:
+    """
+    Планирование загрузок по журналу wb_fetch_log: перед запуском одним
+    запросом на набор данных выбираются ключи (область, дата), которые уже
+    загружены и еще свежие, в работу идут только остальные
+    """
+
+    def __init__(self, db_client: DBClient, policies: dict = None):
+        self._db_client = db_client
+        self._policies = policies or FRESHNESS_POLICIES
+
+    async def plan(
+        self, dataset: str, keys: list[tuple[str, datetime.date]]
+    ) -> list[tuple[str, datetime.date]]:
+        """
+        Ключи (область, дата), которые нужно загрузить
+        """
+        if not keys:
+            return []
+        policy = self._policies[dataset]
+        log_keys = [(scope, key_date(dataset, date)) for scope, date in keys]
+        rows = await self._db_client.pool.fetch(
+            """
+            SELECT log.scope, log.date
+            FROM wb_fetch_log log
+            JOIN unnest($2::varchar[], $3::date[]) AS planned (scope, date)
+                USING (scope, date)
+            WHERE log.dataset = $1
+                AND ($4::interval IS NULL
+                     OR log.fetched_at >= now() - $4::interval
+                     OR ($5 AND log.fetched_at::date >= log.date))
+            """,
+            dataset,
+            [scope for scope, _ in log_keys],
+            [date for _, date in log_keys],
+            policy.ttl,
+            policy.final_from_date,
+        )
+        fresh = {(row["scope"], row["date"]) for row in rows}
+        stale = [
+            key for key, log_key in zip(keys, log_keys) if log_key not in fresh
+        ]
+        if len(stale) < len(keys):
+            logger.info(
+                f"{dataset}: свежих данных {len(keys) - len(stale)}, "
+                f"к загрузке {len(stale)}"
+            )
+        return stale
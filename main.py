@@ -1,21 +1,56 @@
+import argparse
 import asyncio
 import datetime
 import logging
+import os
 import sentry_sdk
 from asyncpg import Record
+from dotenv import load_dotenv
 
 from data_extractor import WbDataExtractor
+from datasets import COMMON, DATASETS, SELLER
 
-from db_client import DBClient
-from exceptions import FailedGetDataException, AuthException
+from db_client import DBClient, UnitOfWork
+from deadline import Deadline, RUN_TIMEOUT
+from exceptions import FailedGetDataException, AuthException, DeadlineExceededException
+from fetch_planner import COMMON_SCOPE, FetchPlanner
+from metrics import metrics
+from pipeline import Pipeline
+from profiling import RunProfiler, phase
+from seller_health import SellerHealth
+from tariff_snapshot import SNAPSHOT_PATH, TariffSnapshotExporter
 from wb_parser import WbParser
 
+load_dotenv()
+
 logger = logging.getLogger(__name__)
 
+COMMON_DATASETS = [name for name, spec in DATASETS.items() if spec.scope == COMMON]
+SELLER_DATASETS = [name for name, spec in DATASETS.items() if spec.scope == SELLER]
+
+
+def horizon(start: datetime.date, days: int, step: int = 1) -> list[tuple[str, datetime.date]]:
+    return [
+        (COMMON_SCOPE, start + datetime.timedelta(days=delta_days))
+        for delta_days in range(0, days, step)
+    ]
+
 
-async def execute_tasks(db_client: DBClient, seller: Record, task_creator):
+async def execute_tasks(
+    db_client: DBClient,
+    seller: Record,
+    task_creator,
+    pipeline: Pipeline = None,
+    deadline: Deadline = None,
+    unit_of_work: UnitOfWork = None,
+    health: SellerHealth = None,
+):
     """
     Общая функция для инициализации и выполнения задач.
+    Каждый набор данных фиксируется своей транзакцией в стадии записи
+    конвейера; если вызывающий передал единицу работы, записи всех наборов
+    копятся в ней, и фиксирует ее он.
+    Результат авторизации селлера записывается в health
     """
     refresh_token = seller.get("refresh_token")
     device_id = seller.get("device_id")
@@ -26,66 +61,230 @@ async def execute_tasks(db_client: DBClient, seller: Record, task_creator):
         logging.error(f"Токен для селлера: {name} не найден.")
         return
 
-    wb_parser = WbParser(refresh_token, supplier_id, device_id)
-    wb_data_extractor = WbDataExtractor(db_client, wb_parser)
+    deadline = deadline or Deadline()
+    wb_parser = WbParser(refresh_token, supplier_id, device_id, deadline)
+    wb_parser.start()
+    wb_data_extractor = WbDataExtractor(
+        db_client, wb_parser, pipeline, deadline, unit_of_work
+    )
     try:
         tasks = await task_creator(wb_data_extractor)
-        return await asyncio.gather(*tasks)
-    except AuthException:
-        logging.warning(f"Некорректная авторизация поставщика: {name}")
-    except FailedGetDataException as e:
-        logging.warning(e)
+        # Ошибка одного набора данных не прерывает загрузку остальных
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                handle_task_exception(result, name, deadline)
+        auth_error = next((r for r in results if isinstance(r, AuthException)), None)
+        if auth_error:
+            await record_health(health, seller, auth_error)
+        elif any(not isinstance(result, Exception) for result in results):
+            await record_health(health, seller)
+        return results
     except Exception as e:
-        sentry_sdk.capture_exception(e)
+        handle_task_exception(e, name, deadline)
+        if isinstance(e, AuthException):
+            await record_health(health, seller, e)
     finally:
         await wb_parser.close()
 
 
+async def record_health(health: SellerHealth, seller: Record, error: Exception = None) -> None:
+    if health is None:
+        return
+    try:
+        if error is None:
+            await health.record_success(seller)
+        else:
+            await health.record_failure(seller, error)
+    except Exception as e:
+        sentry_sdk.capture_exception(e)
+
+
+def handle_task_exception(e: Exception, name: str, deadline: Deadline) -> None:
+    if isinstance(e, DeadlineExceededException):
+        deadline.report_cut_off(f"{name}: {getattr(e, 'task', 'авторизация')}")
+    elif isinstance(e, AuthException):
+        logging.warning(f"Некорректная авторизация поставщика: {name}")
+    elif isinstance(e, FailedGetDataException):
+        logging.warning(e)
+    else:
+        sentry_sdk.capture_exception(e)
+
+
 
-async def get_individual_data(db_client: DBClient, seller: Record) -> None:
+async def get_individual_data(
+    db_client: DBClient,
+    seller: Record,
+    pipeline: Pipeline = None,
+    deadline: Deadline = None,
+    unit_of_work: UnitOfWork = None,
+    datasets: list[str] = None,
+    health: SellerHealth = None,
+) -> None:
     async def task_creator(wb_data_extractor):
         return [
-            wb_data_extractor.insert_weekly_rating(seller.get("id")),
+            wb_data_extractor.insert_dataset(name, seller_id=seller.get("id"))
+            for name in datasets or SELLER_DATASETS
         ]
-    await execute_tasks(db_client, seller, task_creator)
+    await execute_tasks(
+        db_client, seller, task_creator, pipeline, deadline, unit_of_work, health
+    )
 
 
-async def get_common_data(db_client: DBClient, seller: Record) -> None:
+async def get_common_data(
+    db_client: DBClient,
+    seller: Record,
+    pipeline: Pipeline = None,
+    deadline: Deadline = None,
+    unit_of_work: UnitOfWork = None,
+    health: SellerHealth = None,
+) -> None:
+    today = datetime.date.today()
+    planner = FetchPlanner(db_client)
+    planned = {}
+    for name in COMMON_DATASETS:
+        spec = DATASETS[name]
+        keys = await planner.plan(name, horizon(today, spec.horizon_days, spec.horizon_step))
+        if keys:
+            planned[name] = [date for _, date in keys]
+    if not planned:
+        logger.info("Общие данные актуальны, загрузка не требуется")
+        return
+
     async def task_creator(wb_data_extractor):
-        today = datetime.date.today()
         return [
-            *[wb_data_extractor.insert_warehouse_tariffs(today + datetime.timedelta(days=delta_days)) for delta_days in
-              range(3)],
-            wb_data_extractor.insert_commission_rates(),
-            wb_data_extractor.insert_acceptance_coefficients(today),
-            wb_data_extractor.insert_return_tariffs(today),
+            wb_data_extractor.insert_dataset(name, dates)
+            for name, dates in planned.items()
         ]
-    await execute_tasks(db_client, seller, task_creator)
+    await execute_tasks(
+        db_client, seller, task_creator, pipeline, deadline, unit_of_work, health
+    )
 
 
-async def main():
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(filename)s:%(lineno)d #%(levelname)-8s "
-               "[%(asctime)s] - %(name)s - %(message)s",
-    )
-    logger.info("Start of the program")
+async def export_snapshot(db_client: DBClient) -> None:
+    """
+    Новая версия снимка тарифов для процессов, читающих его через mmap
+    """
+    try:
+        await TariffSnapshotExporter(db_client).export(SNAPSHOT_PATH)
+    except Exception as e:
+        logger.error(f"Не удалось выгрузить снимок тарифов: {e}")
+        sentry_sdk.capture_exception(e)
+
+
+async def replay_spool(db_client: DBClient) -> None:
+    """
+    Пакеты, сохраненные в журнал при прошлой недоступности БД, записываются
+    до новых данных, чтобы не перезаписать их более старыми значениями
+    """
+    if db_client.spool is None or not db_client.spool.segments():
+        return
+    try:
+        replayed = await db_client.spool.replay(db_client)
+    except Exception as e:
+        logger.error(f"Не удалось записать пакеты из журнала: {e}")
+        sentry_sdk.capture_exception(e)
+        return
+    logger.info(f"Записано сегментов журнала: {replayed}")
 
+
+async def run(deadline: Deadline) -> None:
+    """
+    Загрузка данных всех селлеров и общих данных
+    """
     db_client = DBClient()
     await db_client.create_pool()
     logger.info("Database connected")
+    await db_client.create_tables()
+    await replay_spool(db_client)
 
     query = "SELECT * FROM wb_sellers_tariffs"
-    sellers = await db_client.pool.fetch(query)
-
-    tasks = [get_individual_data(db_client, seller) for seller in sellers]
-    await asyncio.gather(*tasks, get_common_data(db_client, sellers[0]))
-
+    all_sellers = await db_client.pool.fetch(query)
+    # Селлеры с недействительными учетными данными пропускаются до конца карантина
+    health = SellerHealth(db_client)
+    quarantined = await health.quarantined(all_sellers)
+    health.report(all_sellers, quarantined)
+    sellers = [seller for seller in all_sellers if seller.get("id") not in quarantined]
+    # Данные селлеров (коэффициент логистики меняется раз в неделю)
+    # загружаем только устаревшие
+    planner = FetchPlanner(db_client)
+    stale_datasets = {}
+    for name in SELLER_DATASETS:
+        stale_keys = await planner.plan(
+            name,
+            [(str(seller.get("id")), datetime.date.today()) for seller in sellers],
+        )
+        for scope, _ in stale_keys:
+            stale_datasets.setdefault(scope, []).append(name)
 
+    pipeline = Pipeline()
+    await pipeline.start()
+    # Каждый набор данных записывается своей транзакцией сразу после
+    # загрузки, параллельно с загрузкой остальных
+    tasks = [
+        get_individual_data(
+            db_client,
+            seller,
+            pipeline,
+            deadline,
+            datasets=stale_datasets[str(seller.get("id"))],
+            health=health,
+        )
+        for seller in sellers
+        if str(seller.get("id")) in stale_datasets
+    ]
+    with phase("extract"):
+        if sellers:
+            # Общие данные - по учетным данным первого селлера не на карантине
+            tasks.append(get_common_data(
+                db_client, sellers[0], pipeline, deadline, health=health
+            ))
+        else:
+            logger.error("Нет селлеров с действующими учетными данными для общих данных")
+        await asyncio.gather(*tasks)
+        await pipeline.stop()
+    if SNAPSHOT_PATH:
+        await export_snapshot(db_client)
+    metrics.log()
+    deadline.log()
     await db_client.close_pool()
     logger.info("Database disconnected")
 
 
+async def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(filename)s:%(lineno)d #%(levelname)-8s "
+               "[%(asctime)s] - %(name)s - %(message)s",
+    )
+    parser = argparse.ArgumentParser(description="Загрузка тарифов WB")
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="профилирование: задержка цикла событий, время по наборам данных, стеки",
+    )
+    parser.add_argument("--profile-dir", default=os.getenv("PROFILE_DIR", "profile"))
+    parser.add_argument(
+        "--cprofile", action="store_true", help="снимки cProfile фаз загрузки и записи"
+    )
+    parser.add_argument(
+        "--tracemalloc", action="store_true", help="снимки выделений памяти по фазам"
+    )
+    args = parser.parse_args()
+    logger.info("Start of the program")
+    profiler = None
+    if args.profile:
+        profiler = RunProfiler(args.profile_dir, args.cprofile, args.tracemalloc)
+        await profiler.start()
+    deadline = Deadline(RUN_TIMEOUT)
+
+    try:
+        await run(deadline)
+    finally:
+        # Подмена Handle._run снимается и при ошибке запуска
+        if profiler:
+            await profiler.stop()
+
+
 if __name__ == "__main__":
     sentry_sdk.init(
         "https://8f38ea66aa11448e8db646f2e8258781@gt.botkompot.ru/7"
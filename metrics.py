@@ -0,0 +1,44 @@
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics:
+    """
+    Метрики запуска: счетчики и датчики. Датчик задается функцией,
+    значение которой вычисляется в момент снимка
+    """
+
+    def __init__(self):
+        self._counters = defaultdict(int)
+        self._gauges = {}
+
+    def increment(self, name: str, value: int = 1) -> None:
+        self._counters[name] += value
+
+    def observe_max(self, name: str, value: int) -> None:
+        """
+        Счетчик с наибольшим наблюдавшимся значением, например пиковой
+        глубиной очереди: в отличие от датчика остается после остановки
+        """
+        self._counters[name] = max(self._counters[name], value)
+
+    def gauge(self, name: str, getter) -> None:
+        self._gauges[name] = getter
+
+    def remove_gauge(self, name: str) -> None:
+        self._gauges.pop(name, None)
+
+    def snapshot(self) -> dict:
+        values = dict(self._counters)
+        for name, getter in self._gauges.items():
+            values[name] = getter()
+        return values
+
+    def log(self) -> None:
+        for name, value in sorted(self.snapshot().items()):
+            logger.info(f"{name}: {value}")
+
+
+metrics = Metrics()
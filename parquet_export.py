@@ -0,0 +1,194 @@
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from db_client import DBClient
+
+logger = logging.getLogger(__name__)
+
+EXPORT_TABLES = (
+    "wb_warehouses_tariffs",
+    "wb_acceptance_coefficients",
+    "wb_commission_rates",
+)
+
+# Колонки с небольшим числом различных значений хранятся со словарным кодированием
+DICTIONARY_COLUMNS = {
+    "warehouse_name",
+    "category_name",
+    "item_name",
+    "box_delivery_and_storage_color_expr",
+    "box_delivery_and_storage_color_expr_next",
+    "pallet_delivery_color_expr",
+    "pallet_delivery_color_expr_next",
+    "pallet_storage_color_expr",
+    "pallet_storage_color_expr_next",
+}
+
+PG_TYPES = {
+    "smallint": pa.int16(),
+    "integer": pa.int32(),
+    "bigint": pa.int64(),
+    "double precision": pa.float64(),
+    "real": pa.float32(),
+    "date": pa.date32(),
+    "character varying": pa.string(),
+    "text": pa.string(),
+}
+
+# Даты перед watermark, которые выгружаются заново: строки за прошедшие
+# даты могут быть дописаны позже (пропущенный запуск, журнал записи)
+OVERLAP_DAYS = int(os.getenv("PARQUET_EXPORT_OVERLAP_DAYS", "3"))
+
+
+class ParquetExporter:
+    """
+    Инкрементальная выгрузка истории тарифов в Parquet, по файлу на дату:
+    <export_dir>/<table>/date=YYYY-MM-DD/part-0.parquet.
+    Выгружаются только завершенные даты (раньше сегодняшней), после каждой
+    даты в manifest.json сдвигается watermark, поэтому повторный запуск
+    дописывает новые даты и перезаписывает последние overlap_days дат до
+    watermark, чтобы подобрать строки, записанные с опозданием
+    """
+
+    def __init__(
+        self,
+        db_client: DBClient,
+        export_dir: str,
+        fetch_size: int = 10000,
+        overlap_days: int = OVERLAP_DAYS,
+    ):
+        self._db_client = db_client
+        self._export_dir = export_dir
+        self._fetch_size = fetch_size
+        self._overlap = datetime.timedelta(days=overlap_days)
+        self._manifest_path = os.path.join(export_dir, "manifest.json")
+
+    def _load_manifest(self) -> dict:
+        if not os.path.exists(self._manifest_path):
+            return {}
+        with open(self._manifest_path) as file:
+            return json.load(file)
+
+    def _save_manifest(self, manifest: dict) -> None:
+        tmp_path = f"{self._manifest_path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(manifest, file, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self._manifest_path)
+
+    async def _schema(self, table_name: str) -> pa.Schema:
+        rows = await self._db_client.pool.fetch(
+            "SELECT column_name, data_type FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = $1 "
+            "AND column_name <> 'id' ORDER BY ordinal_position",
+            table_name,
+        )
+        fields = []
+        for row in rows:
+            column_type = PG_TYPES[row["data_type"]]
+            if row["column_name"] in DICTIONARY_COLUMNS:
+                column_type = pa.dictionary(pa.int32(), pa.string())
+            fields.append(pa.field(row["column_name"], column_type))
+        return pa.schema(fields)
+
+    def _write_date(self, table_name: str, schema: pa.Schema, date, records) -> str:
+        columns = []
+        for field in schema:
+            values = [record[field.name] for record in records]
+            if pa.types.is_dictionary(field.type):
+                columns.append(pa.array(values, pa.string()).dictionary_encode())
+            else:
+                columns.append(pa.array(values, field.type))
+        table = pa.Table.from_arrays(columns, schema=schema)
+        relative_path = os.path.join(table_name, f"date={date}", "part-0.parquet")
+        path = os.path.join(self._export_dir, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pq.write_table(table, f"{path}.tmp", compression="zstd")
+        os.replace(f"{path}.tmp", path)
+        return relative_path
+
+    async def export_table(self, table_name: str) -> int:
+        manifest = self._load_manifest()
+        table_manifest = manifest.setdefault(table_name, {"watermark": None, "files": []})
+        watermark = (
+            datetime.date.fromisoformat(table_manifest["watermark"])
+            if table_manifest["watermark"]
+            else None
+        )
+        start = watermark - self._overlap if watermark else datetime.date.min
+        schema = await self._schema(table_name)
+        source = self._db_client.source_table(table_name)
+        query = (
+            f"SELECT {', '.join(schema.names)} FROM {source} "
+            f"WHERE date > $1 AND date < $2 ORDER BY date"
+        )
+
+        exported_dates = 0
+        current_date, records = None, []
+
+        def flush():
+            relative_path = self._write_date(table_name, schema, current_date, records)
+            if watermark is None or current_date > watermark:
+                table_manifest["watermark"] = current_date.isoformat()
+            if relative_path not in table_manifest["files"]:
+                table_manifest["files"].append(relative_path)
+            self._save_manifest(manifest)
+
+        async with self._db_client.pool.acquire() as connection:
+            async with connection.transaction(isolation="repeatable_read", readonly=True):
+                async for record in connection.cursor(
+                    query, start, datetime.date.today(), prefetch=self._fetch_size
+                ):
+                    if current_date is not None and record["date"] != current_date:
+                        flush()
+                        exported_dates += 1
+                        records = []
+                    current_date = record["date"]
+                    records.append(record)
+                if records:
+                    flush()
+                    exported_dates += 1
+        logger.info(
+            f"{table_name}: выгружено дат {exported_dates}, "
+            f"watermark {table_manifest['watermark']}"
+        )
+        return exported_dates
+
+
+async def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(filename)s:%(lineno)d #%(levelname)-8s "
+               "[%(asctime)s] - %(name)s - %(message)s",
+    )
+    parser = argparse.ArgumentParser(description="Инкрементальная выгрузка тарифов в Parquet")
+    parser.add_argument(
+        "--table", dest="tables", action="append", choices=EXPORT_TABLES,
+        help="таблица для обработки, по умолчанию все",
+    )
+    parser.add_argument("--export-dir", default=os.getenv("PARQUET_EXPORT_DIR", "export"))
+    parser.add_argument(
+        "--overlap-days", type=int, default=OVERLAP_DAYS,
+        help="сколько дат до watermark выгрузить заново",
+    )
+    args = parser.parse_args()
+
+    db_client = DBClient()
+    await db_client.create_pool()
+    logger.info("Database connected")
+    exporter = ParquetExporter(db_client, args.export_dir, overlap_days=args.overlap_days)
+    os.makedirs(args.export_dir, exist_ok=True)
+    for table_name in args.tables or EXPORT_TABLES:
+        await exporter.export_table(table_name)
+    await db_client.close_pool()
+    logger.info("Database disconnected")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,60 @@
+import logging
+
+from date_range import PayloadGroup
+from db_client import DBClient
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PayloadCache:
+    """
+    Хэши последних записанных ответов по (эндпоинт, параметры) в таблице
+    wb_payload_hashes. Ответ, совпавший с записанным, не разбирается и не
+    пишется в БД, у него только обновляется время подтверждения
+    """
+
+    def __init__(self, db_client: DBClient):
+        self._db_client = db_client
+
+    async def filter_changed(
+        self, endpoint: str, groups: list[PayloadGroup], params
+    ) -> list[PayloadGroup]:
+        """
+        Группы ответов только с теми датами, для которых ответ изменился.
+        params - функция дата -> нормализованные параметры запроса
+        """
+        keys = [params(date) for group in groups for date in group.dates]
+        rows = await self._db_client.pool.fetch(
+            "SELECT params, digest FROM wb_payload_hashes "
+            "WHERE endpoint = $1 AND params = ANY($2::varchar[])",
+            endpoint,
+            keys,
+        )
+        stored = {row["params"]: row["digest"] for row in rows}
+        changed, unchanged = [], []
+        for group in groups:
+            dates = [date for date in group.dates if stored.get(params(date)) != group.digest]
+            unchanged += [params(date) for date in group.dates if date not in dates]
+            if dates:
+                changed.append(PayloadGroup(group.digest, group.body, dates))
+        if unchanged:
+            await self._db_client.pool.execute(
+                "UPDATE wb_payload_hashes SET confirmed_at = now() "
+                "WHERE endpoint = $1 AND params = ANY($2::varchar[])",
+                endpoint,
+                unchanged,
+            )
+            logger.info(f"{endpoint}: ответ не изменился для {len(unchanged)} из {len(keys)}")
+        metrics.increment(f"payload_cache.{endpoint}.skipped", len(unchanged))
+        metrics.increment(f"payload_cache.{endpoint}.changed", len(keys) - len(unchanged))
+        return changed
+
+    @staticmethod
+    def records(endpoint: str, groups: list[PayloadGroup], params) -> list[tuple]:
+        """
+        Строки wb_payload_hashes для записи после успешной записи данных
+        """
+        return [
+            (endpoint, params(date), group.digest) for group in groups for date in group.dates
+        ]
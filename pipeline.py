@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+from dotenv import load_dotenv
+
+from metrics import metrics
+from profiling import section
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+FETCH_WORKERS = int(os.getenv("PIPELINE_FETCH_WORKERS", "10"))
+TRANSFORM_WORKERS = int(os.getenv("PIPELINE_TRANSFORM_WORKERS", "2"))
+WRITE_WORKERS = int(os.getenv("PIPELINE_WRITE_WORKERS", "4"))
+QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "20"))
+
+
+@dataclass
+class PipelineJob:
+    """
+    Загрузка одного набора данных: получение с WB, преобразование, запись в БД
+    """
+
+    name: str
+    fetch: Callable[[], Awaitable[Any]]
+    transform: Callable[[Any], Awaitable[Any]]
+    write: Callable[[Any], Awaitable[None]]
+    done: asyncio.Future = field(default=None, repr=False)
+
+
+class Pipeline:
+    """
+    Конвейер fetch -> transform -> write с ограниченными очередями между
+    стадиями и своим числом обработчиков на каждой стадии. Пока запись в БД
+    отстает, очереди заполняются и получение данных приостанавливается,
+    а медленный WB не держит соединения с БД. Пиковая глубина очередей
+    сохраняется в метриках pipeline.<стадия>.queue_depth_max
+    """
+
+    STAGES = ("fetch", "transform", "write")
+
+    def __init__(
+        self,
+        fetch_workers: int = FETCH_WORKERS,
+        transform_workers: int = TRANSFORM_WORKERS,
+        write_workers: int = WRITE_WORKERS,
+        queue_size: int = QUEUE_SIZE,
+    ):
+        self._workers_count = {
+            "fetch": fetch_workers,
+            "transform": transform_workers,
+            "write": write_workers,
+        }
+        self._queue_size = queue_size
+        self._queues = {}
+        self._workers = []
+
+    async def start(self) -> None:
+        for stage in self.STAGES:
+            queue = asyncio.Queue(maxsize=self._queue_size)
+            self._queues[stage] = queue
+            metrics.gauge(f"pipeline.{stage}.queue_depth", queue.qsize)
+        for stage in self.STAGES:
+            for _ in range(self._workers_count[stage]):
+                self._workers.append(asyncio.create_task(self.__worker(stage)))
+
+    async def stop(self) -> None:
+        for queue in self._queues.values():
+            await queue.join()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for stage in self.STAGES:
+            metrics.remove_gauge(f"pipeline.{stage}.queue_depth")
+
+    async def run(self, job: PipelineJob):
+        """
+        Постановка задачи в конвейер и ожидание записи ее данных.
+        Исключение любой стадии пробрасывается вызывающему
+        """
+        job.done = asyncio.get_running_loop().create_future()
+        await self.__put("fetch", job, None)
+        return await job.done
+
+    async def __put(self, stage: str, job: PipelineJob, data) -> None:
+        queue = self._queues[stage]
+        await queue.put((job, data))
+        metrics.observe_max(f"pipeline.{stage}.queue_depth_max", queue.qsize())
+
+    async def __worker(self, stage: str) -> None:
+        queue = self._queues[stage]
+        next_stage = {"fetch": "transform", "transform": "write"}.get(stage)
+        while True:
+            job, data = await queue.get()
+            started = time.perf_counter()
+            try:
+                with section(f"{job.name}.{stage}"):
+                    if stage == "fetch":
+                        result = await job.fetch()
+                    elif stage == "transform":
+                        result = await job.transform(data)
+                    else:
+                        result = await job.write(data)
+            except Exception as e:
+                metrics.increment(f"pipeline.{stage}.failed")
+                if not job.done.done():
+                    job.done.set_exception(e)
+            else:
+                metrics.increment(f"pipeline.{stage}.processed")
+                if next_stage:
+                    await self.__put(next_stage, job, result)
+                elif not job.done.done():
+                    job.done.set_result(result)
+            finally:
+                metrics.increment(
+                    f"pipeline.{stage}.busy_ms", int((time.perf_counter() - started) * 1000)
+                )
+                queue.task_done()
@@ -0,0 +1,232 @@
+import asyncio
+import contextlib
+import contextvars
+import cProfile
+import datetime
+import json
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Участок работы (набор данных и стадия), к которому относится текущий код
+current_section = contextvars.ContextVar("profile_section", default="other")
+
+_profiler = None
+
+
+@contextlib.contextmanager
+def section(name: str):
+    """
+    Пометка участка работы: процессорное время обратных вызовов цикла
+    событий и стеки сэмплов относятся к нему. Без профилирования только
+    устанавливает метку
+    """
+    token = current_section.set(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        current_section.reset(token)
+        if _profiler is not None:
+            _profiler.add_wall(name, time.perf_counter() - started)
+
+
+@contextlib.contextmanager
+def phase(name: str):
+    """
+    Фаза запуска (например, extract): отдельные снимки cProfile и tracemalloc
+    """
+    if _profiler is None:
+        yield
+        return
+    with section(name), _profiler.capture(name):
+        yield
+
+
+class RunProfiler:
+    """
+    Профилирование запуска:
+    - задержка цикла событий по сэмплам фоновой задачи;
+    - время и процессорное время по участкам (section): процессорное время
+      каждого обратного вызова цикла относится к метке его контекста;
+    - стеки главного потока с частотой sample_interval в формате folded
+      (flamegraph.pl, speedscope), первым кадром идет метка участка;
+    - по желанию cProfile и tracemalloc для каждой фазы.
+    Результаты пишутся в output_dir/run-<время>/
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        cprofile: bool = False,
+        trace_allocations: bool = False,
+        lag_interval: float = 0.05,
+        sample_interval: float = 0.005,
+    ):
+        self._output_dir = os.path.join(
+            output_dir, f"run-{datetime.datetime.now():%Y%m%d-%H%M%S}"
+        )
+        self._cprofile = cprofile
+        self._trace_allocations = trace_allocations
+        self._lag_interval = lag_interval
+        self._sample_interval = sample_interval
+        self._lags = []
+        self._wall = defaultdict(float)
+        self._calls = Counter()
+        self._cpu = defaultdict(float)
+        self._stacks = Counter()
+        self._allocations = {}
+        self._running_section = "idle"
+        self._original_handle_run = None
+        self._lag_task = None
+        self._sampler = None
+        self._sampling = threading.Event()
+        self._started = None
+
+    def add_wall(self, name: str, seconds: float) -> None:
+        self._wall[name] += seconds
+        self._calls[name] += 1
+
+    async def start(self) -> None:
+        global _profiler
+        _profiler = self
+        os.makedirs(self._output_dir, exist_ok=True)
+        self._started = time.perf_counter()
+        self._install_cpu_accounting()
+        self._lag_task = asyncio.create_task(self._monitor_lag())
+        self._sampling.set()
+        self._sampler = threading.Thread(
+            target=self._sample_stacks, args=(threading.get_ident(),), daemon=True
+        )
+        self._sampler.start()
+        if self._trace_allocations:
+            tracemalloc.start(25)
+
+    async def stop(self) -> None:
+        global _profiler
+        asyncio.events.Handle._run = self._original_handle_run
+        self._lag_task.cancel()
+        self._sampling.clear()
+        self._sampler.join()
+        if self._trace_allocations:
+            tracemalloc.stop()
+        _profiler = None
+        self._write_results(time.perf_counter() - self._started)
+
+    @contextlib.contextmanager
+    def capture(self, name: str):
+        profile = cProfile.Profile() if self._cprofile else None
+        before = tracemalloc.take_snapshot() if self._trace_allocations else None
+        if profile:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile:
+                profile.disable()
+                profile.dump_stats(os.path.join(self._output_dir, f"{name}.prof"))
+            if before is not None:
+                after = tracemalloc.take_snapshot()
+                after.dump(os.path.join(self._output_dir, f"{name}.tracemalloc"))
+                self._allocations[name] = [
+                    str(stat) for stat in after.compare_to(before, "lineno")[:15]
+                ]
+
+    def _install_cpu_accounting(self) -> None:
+        original = asyncio.events.Handle._run
+        self._original_handle_run = original
+        profiler = self
+
+        def _run(handle):
+            name = handle._context.get(current_section, "other")
+            profiler._running_section = name
+            started = time.thread_time()
+            try:
+                return original(handle)
+            finally:
+                profiler._cpu[name] += time.thread_time() - started
+                profiler._running_section = "idle"
+
+        asyncio.events.Handle._run = _run
+
+    async def _monitor_lag(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self._lag_interval
+            await asyncio.sleep(self._lag_interval)
+            self._lags.append(max(loop.time() - expected, 0.0))
+
+    def _sample_stacks(self, thread_id: int) -> None:
+        while self._sampling.is_set():
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                module = os.path.splitext(os.path.basename(code.co_filename))[0]
+                stack.append(f"{module}:{code.co_name}")
+                frame = frame.f_back
+            stack.append(self._running_section)
+            self._stacks[";".join(reversed(stack))] += 1
+            time.sleep(self._sample_interval)
+
+    def _summary(self, wall_seconds: float) -> dict:
+        lags = sorted(self._lags)
+
+        def percentile(share):
+            return round(lags[min(int(len(lags) * share), len(lags) - 1)] * 1000, 2)
+
+        sections = {
+            name: {
+                "wall_s": round(self._wall.get(name, 0.0), 3),
+                "cpu_s": round(self._cpu.get(name, 0.0), 3),
+                "calls": self._calls.get(name, 0),
+            }
+            for name in sorted(set(self._wall) | set(self._cpu))
+        }
+        return {
+            "wall_s": round(wall_seconds, 3),
+            "cpu_s": round(sum(self._cpu.values()), 3),
+            "loop_lag_ms": {
+                "samples": len(lags),
+                "mean": round(statistics.fmean(lags) * 1000, 2) if lags else 0,
+                "p50": percentile(0.5) if lags else 0,
+                "p95": percentile(0.95) if lags else 0,
+                "p99": percentile(0.99) if lags else 0,
+                "max": round(lags[-1] * 1000, 2) if lags else 0,
+            },
+            "sections": sections,
+            "metrics": metrics.snapshot(),
+            "allocations": self._allocations,
+        }
+
+    def _write_results(self, wall_seconds: float) -> None:
+        with open(os.path.join(self._output_dir, "stacks.folded"), "w") as file:
+            for stack, count in self._stacks.most_common():
+                file.write(f"{stack} {count}\n")
+        summary = self._summary(wall_seconds)
+        with open(os.path.join(self._output_dir, "summary.json"), "w") as file:
+            json.dump(summary, file, ensure_ascii=False, indent=2, default=str)
+
+        lag = summary["loop_lag_ms"]
+        logger.info(
+            f"Профиль: {summary['wall_s']} с, процессор {summary['cpu_s']} с, "
+            f"задержка цикла p95 {lag['p95']} мс, max {lag['max']} мс"
+        )
+        by_cpu = sorted(
+            summary["sections"].items(), key=lambda item: item[1]["cpu_s"], reverse=True
+        )
+        for name, values in by_cpu[:15]:
+            logger.info(
+                f"  {name}: время {values['wall_s']} с, процессор {values['cpu_s']} с, "
+                f"вызовов {values['calls']}"
+            )
+        logger.info(f"Результаты профилирования сохранены в {self._output_dir}")
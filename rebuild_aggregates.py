@@ -0,0 +1,81 @@
+import argparse
+import asyncio
+import logging
+
+from aggregates import AGGREGATES
+from db_client import DBClient
+
+logger = logging.getLogger(__name__)
+
+
+async def verify(db_client: DBClient, dataset: str) -> int:
+    """
+    Сравнение агрегатной таблицы с пересчетом по всей истории в
+    откатываемой транзакции. Возвращает число строк, которые есть только в
+    одном из вариантов
+    """
+    aggregate = AGGREGATES[dataset]
+    columns = ", ".join(aggregate.columns)
+    async with db_client.pool.acquire() as connection:
+        rows = await connection.fetch(f"SELECT {columns} FROM {aggregate.table}")
+        # Пересчет нужен только для сравнения, транзакция откатывается
+        transaction = connection.transaction()
+        await transaction.start()
+        try:
+            await db_client.rebuild_aggregates(dataset, connection=connection)
+            rebuilt = await connection.fetch(f"SELECT {columns} FROM {aggregate.table}")
+        finally:
+            await transaction.rollback()
+    return _differences(rows, rebuilt)
+
+
+def _differences(rows, rebuilt) -> int:
+    def normalized(records):
+        return {
+            tuple(round(value, 6) if isinstance(value, float) else value for value in record)
+            for record in records
+        }
+
+    return len(normalized(rows) ^ normalized(rebuilt))
+
+
+async def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(filename)s:%(lineno)d #%(levelname)-8s "
+               "[%(asctime)s] - %(name)s - %(message)s",
+    )
+    parser = argparse.ArgumentParser(
+        description="Полный пересчет или проверка агрегатных таблиц трендов тарифов"
+    )
+    parser.add_argument(
+        "--dataset",
+        action="append",
+        choices=list(AGGREGATES),
+        help="набор данных, можно указать несколько раз, по умолчанию - все",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="не менять таблицы, а сравнить их с пересчетом по всей истории",
+    )
+    args = parser.parse_args()
+
+    db_client = DBClient()
+    await db_client.create_pool()
+    logger.info("Database connected")
+    await db_client.create_tables()
+    for dataset in args.dataset or AGGREGATES:
+        if args.verify:
+            differences = await verify(db_client, dataset)
+            log = logger.warning if differences else logger.info
+            log(f"{AGGREGATES[dataset].table}: расходящихся строк {differences}")
+        else:
+            await db_client.rebuild_aggregates(dataset)
+            logger.info(f"{AGGREGATES[dataset].table}: пересчитана по всей истории")
+    await db_client.close_pool()
+    logger.info("Database disconnected")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,261 @@
+import argparse
+import asyncio
+import datetime
+import logging
+import os
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+from db_client import DBClient
+
+logger = logging.getLogger(__name__)
+
+
+def to_float(series: pd.Series) -> pd.Series:
+    """
+    Векторный аналог utils.str_to_float: запятая как разделитель,
+    пробелы игнорируются, нечисловые значения ("нет") становятся NaN
+    """
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype(float)
+    cleaned = series.astype(str).str.replace(",", ".", regex=False).str.replace(" ", "", regex=False)
+    return pd.to_numeric(cleaned, errors="coerce")
+
+
+def percent_to_share(series: pd.Series) -> pd.Series:
+    return (to_float(series) / 100).round(4)
+
+
+@dataclass
+class Lookup:
+    """
+    Замена названий на id из справочной таблицы БД
+    """
+
+    query: str
+    source_columns: tuple
+    target_column: str
+    error: str
+
+
+@dataclass
+class ImportSpec:
+    table: str
+    # Колонка файла -> колонка БД
+    columns: dict
+    conflict_columns: tuple
+    converters: dict = field(default_factory=dict)
+    required: tuple = ()
+    lookups: list = field(default_factory=list)
+    dated: bool = False
+
+
+IMPORT_SPECS = {
+    "fulfillments": ImportSpec(
+        table="wb_fulfillments",
+        columns={
+            "Фулфилмент": "fulfillment_name",
+            "Склад": "warehouse_name",
+            "Приемка": "acceptance_rate",
+            "Хранение": "storage_rate",
+            "Доставка короба": "box_delivery_rate",
+            "Доставка паллета": "pallet_delivery_rate",
+        },
+        converters={
+            "acceptance_rate": to_float,
+            "storage_rate": to_float,
+            "box_delivery_rate": to_float,
+            "pallet_delivery_rate": to_float,
+        },
+        required=("fulfillment_name",),
+        lookups=[
+            Lookup(
+                "SELECT id AS warehouse_id, name AS warehouse_name FROM wb_warehouses",
+                ("warehouse_name",),
+                "warehouse_id",
+                "Склад не найден в базе данных",
+            )
+        ],
+        conflict_columns=("fulfillment_name", "warehouse_id", "date"),
+        dated=True,
+    ),
+    "redemption_rates": ImportSpec(
+        table="wb_redemption_rates",
+        columns={
+            "Категория": "category_name",
+            "Предмет": "item_name",
+            "Процент выкупа": "redemption_rate",
+        },
+        converters={"redemption_rate": percent_to_share},
+        required=("redemption_rate",),
+        lookups=[
+            Lookup(
+                "SELECT id AS category_id, category_name, item_name FROM wb_categories",
+                ("category_name", "item_name"),
+                "category_id",
+                "Категория не найдена в базе данных",
+            )
+        ],
+        conflict_columns=("category_id", "date"),
+        dated=True,
+    ),
+    "categories": ImportSpec(
+        table="wb_categories",
+        columns={"Категория": "category_name", "Предмет": "item_name"},
+        required=("item_name",),
+        conflict_columns=("category_name", "item_name"),
+    ),
+}
+
+CONFLICT_POLICIES = ("update", "skip", "error")
+
+
+class ReferenceImporter:
+    """
+    Загрузка справочных таблиц из Excel/CSV: проверка и замена названий на id
+    выполняются над колонками целиком, данные загружаются через COPY во
+    временную таблицу и переносятся в целевую одним запросом.
+    Отклоненные строки с причиной сохраняются в отчет <файл>.rejected.csv
+    """
+
+    def __init__(self, db_client: DBClient, spec: ImportSpec, policy: str = "update"):
+        self._db_client = db_client
+        self._spec = spec
+        self._policy = policy
+
+    def _read(self, path: str) -> pd.DataFrame:
+        if path.endswith(".csv"):
+            return pd.read_csv(path)
+        return pd.read_excel(path)
+
+    async def prepare(self, source: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+        spec = self._spec
+        missing = [column for column in spec.columns if column not in source.columns]
+        if missing:
+            raise ValueError(f"В файле нет колонок: {', '.join(missing)}")
+
+        data = source[list(spec.columns)].rename(columns=spec.columns).astype(object)
+        data = data.where(data.notna() & (data != ""), None)
+        for column, converter in spec.converters.items():
+            data[column] = converter(data[column])
+
+        reasons = pd.Series(None, index=data.index, dtype=object)
+        for column in spec.required:
+            reasons = reasons.where(reasons.notna() | data[column].notna(), f"Пустое поле {column}")
+
+        for lookup in spec.lookups:
+            rows = await self._db_client.pool.fetch(lookup.query)
+            reference = pd.DataFrame(
+                [dict(row) for row in rows],
+                columns=[lookup.target_column, *lookup.source_columns],
+            ).astype(object)
+            merged = data.merge(reference, how="left", on=list(lookup.source_columns))
+            merged.index = data.index
+            data[lookup.target_column] = merged[lookup.target_column]
+            reasons = reasons.where(
+                reasons.notna() | data[lookup.target_column].notna(), lookup.error
+            )
+
+        if spec.dated:
+            data["date"] = datetime.date.today()
+        rejected = source.loc[reasons.notna()].assign(reason=reasons[reasons.notna()])
+        accepted = data.loc[reasons.isna()]
+        return accepted, rejected
+
+    def _target_columns(self) -> list[str]:
+        spec = self._spec
+        looked_up = {column for lookup in spec.lookups for column in lookup.source_columns}
+        columns = [column for column in spec.columns.values() if column not in looked_up]
+        columns += [lookup.target_column for lookup in spec.lookups]
+        if spec.dated:
+            columns.append("date")
+        return columns
+
+    async def load(self, accepted: pd.DataFrame) -> int:
+        spec = self._spec
+        columns = self._target_columns()
+        records = list(
+            zip(
+                *(
+                    accepted[column].astype(object).where(accepted[column].notna(), None).tolist()
+                    for column in columns
+                )
+            )
+        )
+        if not records:
+            return 0
+
+        column_list = ", ".join(columns)
+        conflict = ", ".join(spec.conflict_columns)
+        query = (
+            f"INSERT INTO {spec.table} ({column_list}) "
+            f"SELECT DISTINCT ON ({conflict}) {column_list} FROM import_staging"
+        )
+        update_columns = [column for column in columns if column not in spec.conflict_columns]
+        if self._policy == "skip":
+            # NOT EXISTS учитывает ключи с NULL, которые не ловит ON CONFLICT
+            condition = " AND ".join(
+                f"t.{column} IS NOT DISTINCT FROM import_staging.{column}"
+                for column in spec.conflict_columns
+            )
+            query += (
+                f" WHERE NOT EXISTS (SELECT 1 FROM {spec.table} t WHERE {condition})"
+                f" ON CONFLICT ({conflict}) DO NOTHING"
+            )
+        elif self._policy == "update" and update_columns:
+            assignments = ", ".join(f"{column} = EXCLUDED.{column}" for column in update_columns)
+            query += f" ON CONFLICT ({conflict}) DO UPDATE SET {assignments}"
+        elif self._policy == "update":
+            query += f" ON CONFLICT ({conflict}) DO NOTHING"
+
+        async with self._db_client.pool.acquire() as connection:
+            async with connection.transaction():
+                await connection.execute(
+                    f"CREATE TEMP TABLE import_staging "
+                    f"(LIKE {spec.table} INCLUDING DEFAULTS) ON COMMIT DROP"
+                )
+                await connection.copy_records_to_table(
+                    "import_staging", records=records, columns=columns
+                )
+                status = await connection.execute(query)
+        return int(status.split()[-1])
+
+    async def import_file(self, path: str) -> None:
+        source = self._read(path)
+        accepted, rejected = await self.prepare(source)
+        written = await self.load(accepted)
+        logger.info(
+            f"{path}: строк {len(source)}, принято {len(accepted)}, "
+            f"записано {written}, отклонено {len(rejected)}"
+        )
+        if not rejected.empty:
+            report_path = f"{os.path.splitext(path)[0]}.rejected.csv"
+            rejected.to_csv(report_path, index=False)
+            logger.warning(f"Отклоненные строки сохранены в {report_path}")
+
+
+async def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(filename)s:%(lineno)d #%(levelname)-8s "
+               "[%(asctime)s] - %(name)s - %(message)s",
+    )
+    parser = argparse.ArgumentParser(description="Загрузка справочных данных из таблиц")
+    parser.add_argument("dataset", choices=list(IMPORT_SPECS))
+    parser.add_argument("path", help="файл .xlsx или .csv")
+    parser.add_argument("--policy", choices=CONFLICT_POLICIES, default="update")
+    args = parser.parse_args()
+
+    db_client = DBClient()
+    await db_client.create_pool()
+    await db_client.create_tables()
+    logger.info("Database connected")
+    importer = ReferenceImporter(db_client, IMPORT_SPECS[args.dataset], args.policy)
+    await importer.import_file(args.path)
+    await db_client.close_pool()
+    logger.info("Database disconnected")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
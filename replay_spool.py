@@ -0,0 +1,51 @@
+import argparse
+import asyncio
+import logging
+import os
+
+from db_client import DBClient
+from spool import WriteSpool
+
+logger = logging.getLogger(__name__)
+
+
+async def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(filename)s:%(lineno)d #%(levelname)-8s "
+               "[%(asctime)s] - %(name)s - %(message)s",
+    )
+    parser = argparse.ArgumentParser(
+        description="Запись в БД пакетов из локального журнала, сохраненных при недоступности БД"
+    )
+    parser.add_argument(
+        "--dir", default=os.getenv("WRITE_SPOOL_DIR") or None,
+        required=not os.getenv("WRITE_SPOOL_DIR"),
+        help="каталог журнала, по умолчанию WRITE_SPOOL_DIR",
+    )
+    parser.add_argument(
+        "--list", action="store_true", help="только показать сегменты журнала"
+    )
+    args = parser.parse_args()
+
+    spool = WriteSpool(args.dir)
+    if args.list:
+        for path in spool.segments():
+            batch = spool.read(path)
+            names = ", ".join(sorted({name for name, _, _ in batch}))
+            logger.info(f"{os.path.basename(path)}: операций {len(batch)} ({names})")
+        for path in spool.quarantined():
+            logger.warning(f"На карантине: {path}")
+        return
+
+    db_client = DBClient()
+    await db_client.create_pool()
+    logger.info("Database connected")
+    replayed = await spool.replay(db_client)
+    logger.info(f"Записано сегментов журнала: {replayed}")
+    await db_client.close_pool()
+    logger.info("Database disconnected")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
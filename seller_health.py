@@ -0,0 +1,180 @@
+import argparse
+import asyncio
+import datetime
+import hashlib
+import logging
+import os
+
+from asyncpg import Record
+from dotenv import load_dotenv
+
+from db_client import DBClient
+from metrics import metrics
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Карантин после ошибки авторизации: каждая следующая ошибка подряд
+# удваивает срок, но не больше максимального
+QUARANTINE_BASE = datetime.timedelta(
+    minutes=float(os.getenv("SELLER_QUARANTINE_BASE_MINUTES", "60"))
+)
+QUARANTINE_MAX = datetime.timedelta(
+    hours=float(os.getenv("SELLER_QUARANTINE_MAX_HOURS", "168"))
+)
+
+
+def quarantine_period(failures: int) -> datetime.timedelta:
+    return min(QUARANTINE_BASE * 2 ** min(failures - 1, 30), QUARANTINE_MAX)
+
+
+def credentials_digest(seller: Record) -> str:
+    credentials = f"{seller.get('refresh_token')}:{seller.get('device_id')}"
+    return hashlib.sha256(credentials.encode()).hexdigest()
+
+
+class SellerHealth:
+    """
+    Состояние учетных данных селлеров в wb_seller_health: ошибки
+    авторизации подряд, последняя успешная загрузка и карантин с
+    экспоненциально растущим сроком. Селлеры на карантине не загружаются.
+    Карантин снимается успешной загрузкой или сменой учетных данных.
+    За запуск (экземпляр) у селлера учитывается не больше одной ошибки
+    """
+
+    def __init__(self, db_client: DBClient):
+        self._db_client = db_client
+        self._failed = set()
+
+    async def quarantined(self, sellers: list[Record]) -> dict[int, Record]:
+        """
+        Селлеры на карантине: id -> строка wb_seller_health
+        """
+        rows = await self._db_client.pool.fetch(
+            "SELECT * FROM wb_seller_health WHERE quarantined_until > now()"
+        )
+        health = {row["seller_id"]: row for row in rows}
+        return {
+            seller["id"]: health[seller["id"]]
+            for seller in sellers
+            if seller["id"] in health
+            and health[seller["id"]]["credentials_digest"] == credentials_digest(seller)
+        }
+
+    async def record_success(self, seller: Record) -> None:
+        if seller["id"] in self._failed:
+            return
+        await self._db_client.pool.execute(
+            """
+            INSERT INTO wb_seller_health (seller_id, last_success_at, credentials_digest)
+            VALUES ($1, now(), $2)
+            ON CONFLICT (seller_id) DO UPDATE SET consecutive_failures = 0,
+                last_success_at = now(), quarantined_until = NULL,
+                credentials_digest = EXCLUDED.credentials_digest
+            """,
+            seller["id"],
+            credentials_digest(seller),
+        )
+
+    async def record_failure(self, seller: Record, error: Exception) -> None:
+        """
+        Ошибка авторизации: счетчик ошибок подряд растет, пока не сменились
+        учетные данные
+        """
+        if seller["id"] in self._failed:
+            return
+        self._failed.add(seller["id"])
+        digest = credentials_digest(seller)
+        async with self._db_client.pool.acquire() as connection:
+            async with connection.transaction():
+                previous = await connection.fetchrow(
+                    "SELECT consecutive_failures, credentials_digest FROM wb_seller_health "
+                    "WHERE seller_id = $1 FOR UPDATE",
+                    seller["id"],
+                )
+                failures = 1
+                if previous and previous["credentials_digest"] == digest:
+                    failures = previous["consecutive_failures"] + 1
+                now = datetime.datetime.now(datetime.timezone.utc)
+                quarantined_until = now + quarantine_period(failures)
+                await connection.execute(
+                    """
+                    INSERT INTO wb_seller_health (seller_id, consecutive_failures,
+                        last_failure_at, last_error, quarantined_until, credentials_digest)
+                    VALUES ($1, $2, $3, $4, $5, $6)
+                    ON CONFLICT (seller_id) DO UPDATE SET
+                        consecutive_failures = EXCLUDED.consecutive_failures,
+                        last_failure_at = EXCLUDED.last_failure_at,
+                        last_error = EXCLUDED.last_error,
+                        quarantined_until = EXCLUDED.quarantined_until,
+                        credentials_digest = EXCLUDED.credentials_digest
+                    """,
+                    seller["id"],
+                    failures,
+                    now,
+                    str(error)[:255],
+                    quarantined_until,
+                    digest,
+                )
+        metrics.increment("sellers.auth_failures")
+        logger.warning(
+            f"Селлер {seller.get('name')} на карантине до {quarantined_until:%Y-%m-%d %H:%M} UTC, "
+            f"ошибок авторизации подряд: {failures}"
+        )
+
+    @staticmethod
+    def report(sellers: list[Record], quarantined: dict[int, Record]) -> None:
+        """
+        Отчет о пропущенных селлерах
+        """
+        metrics.increment("sellers.quarantined", len(quarantined))
+        if not quarantined:
+            return
+        logger.warning(f"Пропущено селлеров на карантине: {len(quarantined)} из {len(sellers)}")
+        for seller in sellers:
+            health = quarantined.get(seller["id"])
+            if health is None:
+                continue
+            last_success = health["last_success_at"]
+            logger.warning(
+                f"  {seller.get('name')} (id {seller['id']}): до "
+                f"{health['quarantined_until']:%Y-%m-%d %H:%M} UTC, "
+                f"ошибок подряд {health['consecutive_failures']}, последняя успешная загрузка "
+                f"{f'{last_success:%Y-%m-%d %H:%M}' if last_success else 'нет'}, "
+                f"ошибка: {health['last_error']}"
+            )
+
+
+async def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(filename)s:%(lineno)d #%(levelname)-8s "
+               "[%(asctime)s] - %(name)s - %(message)s",
+    )
+    parser = argparse.ArgumentParser(description="Состояние учетных данных селлеров")
+    parser.add_argument(
+        "--reset", dest="reset", action="append", type=int, metavar="SELLER_ID",
+        help="снять карантин с селлера",
+    )
+    args = parser.parse_args()
+
+    db_client = DBClient()
+    await db_client.create_pool()
+    await db_client.create_tables()
+    logger.info("Database connected")
+    if args.reset:
+        await db_client.pool.execute(
+            "UPDATE wb_seller_health SET consecutive_failures = 0, quarantined_until = NULL "
+            "WHERE seller_id = ANY($1::int[])",
+            args.reset,
+        )
+        logger.info(f"Карантин снят: {', '.join(map(str, args.reset))}")
+    sellers = await db_client.pool.fetch("SELECT * FROM wb_sellers_tariffs ORDER BY id")
+    SellerHealth.report(sellers, await SellerHealth(db_client).quarantined(sellers))
+    await db_client.close_pool()
+    logger.info("Database disconnected")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
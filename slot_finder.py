@@ -0,0 +1,238 @@
+import datetime
+import logging
+import os
+import time
+from dataclasses import dataclass
+
+import numpy as np
+from dotenv import load_dotenv
+
+from cost_calculator import PALLET_ACCEPTANCE_TYPE
+from db_client import DBClient
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# На сколько дней вперед от сегодня строится индекс слотов
+SLOT_WINDOW_DAYS = int(os.getenv("SLOT_FINDER_WINDOW_DAYS", "14"))
+# На сколько дней назад ищется последний известный тариф склада
+TARIFF_LOOKBACK_DAYS = 30
+
+# Колонки тарифов складов: логистика и хранение коробов, затем монопаллет
+TARIFF_COLUMNS = (
+    "box_delivery_base",
+    "box_delivery_liter",
+    "box_storage_base",
+    "box_storage_liter",
+    "pallet_delivery_value_base",
+    "pallet_delivery_value_liter",
+    "pallet_storage_value_expr",
+)
+
+# Наборы данных канала изменений, после которых индекс перестраивается
+REFRESH_DATASETS = ("acceptance_coefficients", "warehouse_tariffs")
+
+
+@dataclass
+class TypeSlots:
+    """
+    Слоты одного типа приемки, отсортированные по дате: строки одной даты
+    идут подряд, диапазон дат выбирается бинарным поиском. Тарифы склада -
+    последние известные на дату слота
+    """
+
+    dates: np.ndarray
+    warehouse_indices: np.ndarray
+    coefficients: np.ndarray
+    delivery_base: np.ndarray
+    delivery_liter: np.ndarray
+    storage_base: np.ndarray
+    storage_liter: np.ndarray
+
+
+@dataclass
+class SlotSnapshot:
+    warehouse_names: np.ndarray
+    by_type: dict[int, TypeSlots]
+    built_at: datetime.datetime
+
+
+class SlotFinder:
+    """
+    Поиск склада и даты поставки: по коэффициентам приемки и тарифам складов
+    на окно дат строится индекс по типу приемки и дате, стоимость считается
+    векторно для всех подходящих слотов, возвращаются top лучших.
+    Тарифы монопаллет (тип 5) - паллетные, остальных типов - коробочные.
+    Индекс неизменяемый и заменяется целиком при refresh, поэтому запросы
+    не блокируются перестроением
+    """
+
+    def __init__(self, db_client: DBClient, window_days: int = SLOT_WINDOW_DAYS):
+        self._db_client = db_client
+        self._window_days = window_days
+        self._snapshot = None
+
+    async def refresh(self) -> None:
+        started = time.perf_counter()
+        today = datetime.date.today()
+        window_end = today + datetime.timedelta(days=self._window_days)
+        acceptance = await self._db_client.pool.fetch(
+            "SELECT date, warehouse_name, acceptance_type, coefficient "
+            "FROM wb_acceptance_coefficients "
+            "WHERE date BETWEEN $1 AND $2 AND coefficient >= 0",
+            today,
+            window_end,
+        )
+        tariffs_table = self._db_client.source_table("wb_warehouses_tariffs")
+        tariffs = await self._db_client.pool.fetch(
+            f"SELECT date, warehouse_name, {', '.join(TARIFF_COLUMNS)} "
+            f"FROM {tariffs_table} WHERE date BETWEEN $1 AND $2",
+            today - datetime.timedelta(days=TARIFF_LOOKBACK_DAYS),
+            window_end,
+        )
+        self._snapshot = build_snapshot(acceptance, tariffs)
+        slots = sum(len(slots.dates) for slots in self._snapshot.by_type.values())
+        logger.info(
+            f"Индекс слотов: {slots} слотов, {len(self._snapshot.warehouse_names)} складов, "
+            f"{time.perf_counter() - started:.3f} с"
+        )
+
+    async def apply_change(self, change: dict) -> None:
+        """
+        Перестроение индекса после загрузки коэффициентов приемки или
+        тарифов складов (обработчик ChangeFeedSubscriber)
+        """
+        if change["dataset"] is None or change["dataset"] in REFRESH_DATASETS:
+            await self.refresh()
+
+    def find(
+        self,
+        acceptance_type: int,
+        volume: float,
+        date_from: datetime.date = None,
+        days: int = 7,
+        max_coefficient: int = None,
+        storage_days: int = 0,
+        top: int = 10,
+    ) -> list[dict]:
+        """
+        Лучшие по стоимости слоты типа приемки в [date_from, date_from + days).
+        Стоимость: логистика (база за первый литр + ставка за каждый
+        следующий литр) + хранение в день * storage_days. Слоты с
+        коэффициентом приемки больше max_coefficient и без тарифа склада
+        отбрасываются
+        """
+        snapshot = self._snapshot
+        if snapshot is None or acceptance_type not in snapshot.by_type:
+            return []
+        slots = snapshot.by_type[acceptance_type]
+        date_from = np.datetime64(date_from or datetime.date.today(), "D")
+        start = np.searchsorted(slots.dates, date_from, side="left")
+        end = np.searchsorted(slots.dates, date_from + days, side="left")
+        if start == end:
+            return []
+        window = slice(start, end)
+        extra_liters = max(volume - 1.0, 0.0)
+        delivery = slots.delivery_base[window] + extra_liters * slots.delivery_liter[window]
+        storage = slots.storage_base[window] + extra_liters * slots.storage_liter[window]
+        total = delivery + storage * storage_days if storage_days else delivery
+
+        suitable = ~np.isnan(total)
+        if max_coefficient is not None:
+            suitable &= slots.coefficients[window] <= max_coefficient
+        candidates = np.flatnonzero(suitable)
+        if len(candidates) > top:
+            candidates = candidates[np.argpartition(total[candidates], top - 1)[:top]]
+        # При равной стоимости раньше идет более ранняя дата
+        candidates = candidates[np.lexsort((candidates, total[candidates]))]
+
+        return [
+            {
+                "warehouse_name": str(
+                    snapshot.warehouse_names[slots.warehouse_indices[start + position]]
+                ),
+                "date": slots.dates[start + position].astype(datetime.date),
+                "acceptance_type": acceptance_type,
+                "coefficient": int(slots.coefficients[start + position]),
+                "delivery": _value(delivery[position]),
+                "storage_per_day": _value(storage[position]),
+                "total": _value(total[position]),
+            }
+            for position in candidates
+        ]
+
+
+def build_snapshot(acceptance, tariffs) -> SlotSnapshot:
+    """
+    Индекс слотов из строк коэффициентов приемки (date, warehouse_name,
+    acceptance_type, coefficient) и тарифов складов (date, warehouse_name,
+    TARIFF_COLUMNS)
+    """
+    warehouse_names = np.unique(
+        np.array(
+            [row["warehouse_name"] for row in acceptance]
+            + [row["warehouse_name"] for row in tariffs],
+            dtype=str,
+        )
+    )
+
+    # Последний тариф не позже даты слота: ключ (склад, дата) упорядочен
+    # так же, как пара, поэтому as-of поиск - один searchsorted
+    tariff_warehouses = np.searchsorted(
+        warehouse_names, np.array([row["warehouse_name"] for row in tariffs], dtype=str)
+    )
+    tariff_days = np.array([row["date"] for row in tariffs], dtype="datetime64[D]").astype(
+        np.int64
+    )
+    tariff_keys = _slot_keys(tariff_warehouses, tariff_days)
+    order = np.argsort(tariff_keys, kind="stable")
+    tariff_keys, tariff_warehouses = tariff_keys[order], tariff_warehouses[order]
+    values = np.array(
+        [[row[column] for column in TARIFF_COLUMNS] for row in tariffs], dtype=float
+    ).reshape(-1, len(TARIFF_COLUMNS))[order]
+
+    by_type = {}
+    acceptance_types = np.array([row["acceptance_type"] for row in acceptance], dtype=np.int64)
+    for acceptance_type in np.unique(acceptance_types):
+        rows = [row for row in acceptance if row["acceptance_type"] == acceptance_type]
+        dates = np.array([row["date"] for row in rows], dtype="datetime64[D]")
+        warehouses = np.searchsorted(
+            warehouse_names, np.array([row["warehouse_name"] for row in rows], dtype=str)
+        )
+        coefficients = np.array([row["coefficient"] for row in rows], dtype=np.int64)
+        order = np.lexsort((warehouses, dates))
+        dates, warehouses, coefficients = dates[order], warehouses[order], coefficients[order]
+
+        positions = (
+            np.searchsorted(
+                tariff_keys, _slot_keys(warehouses, dates.astype(np.int64)), side="right"
+            )
+            - 1
+        )
+        found = positions >= 0
+        found[found] = tariff_warehouses[positions[found]] == warehouses[found]
+        columns = (4, 5, 6, 6) if acceptance_type == PALLET_ACCEPTANCE_TYPE else (0, 1, 2, 3)
+        tariff_values = np.full((len(rows), 4), np.nan)
+        tariff_values[found] = values[positions[found]][:, columns]
+        if acceptance_type == PALLET_ACCEPTANCE_TYPE:
+            # Хранение монопаллеты считается за паллету и не зависит от объема
+            tariff_values[:, 3] = np.where(found, 0.0, np.nan)
+        by_type[int(acceptance_type)] = TypeSlots(
+            dates=dates,
+            warehouse_indices=warehouses,
+            coefficients=coefficients,
+            delivery_base=tariff_values[:, 0],
+            delivery_liter=tariff_values[:, 1],
+            storage_base=tariff_values[:, 2],
+            storage_liter=tariff_values[:, 3],
+        )
+    return SlotSnapshot(warehouse_names, by_type, datetime.datetime.now())
+
+
+def _slot_keys(warehouse_indices: np.ndarray, days: np.ndarray) -> np.ndarray:
+    return warehouse_indices.astype(np.int64) * 1_000_000 + days
+
+
+def _value(value: float):
+    return None if np.isnan(value) else float(value)
@@ -0,0 +1,181 @@
+import asyncio
+import datetime
+import glob
+import gzip
+import logging
+import os
+import pickle
+import shutil
+
+import asyncpg
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".pkl.gz"
+# Подкаталог журнала для сегментов, которые не записываются из-за ошибки в данных
+QUARANTINE_DIR = "quarantine"
+
+# Ошибки недоступности БД: пакет записи при них сохраняется в локальный журнал
+CONNECTION_ERRORS = (
+    OSError,
+    TimeoutError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.InterfaceError,
+    asyncpg.CannotConnectNowError,
+    asyncpg.TooManyConnectionsError,
+    asyncpg.AdminShutdownError,
+)
+
+# Операции, которые при повторе пишутся через COPY во временную таблицу
+COPY_OPERATIONS = ("insert_data", "insert_update_data")
+
+CONSTRAINT_COLUMNS_QUERY = """
+    SELECT array_agg(attribute.attname ORDER BY key.ordinality)
+    FROM pg_constraint con
+    CROSS JOIN unnest(con.conkey) WITH ORDINALITY AS key (attnum, ordinality)
+    JOIN pg_attribute attribute
+        ON attribute.attrelid = con.conrelid AND attribute.attnum = key.attnum
+    WHERE con.conrelid = $1::regclass AND con.conname = $2
+"""
+
+
+class WriteSpool:
+    """
+    Локальный журнал пакетов записи, которые не удалось записать из-за
+    недоступности БД. Пакет - список операций (имя метода DBClient,
+    args, kwargs) - сохраняется отдельным неизменяемым сегментом: запись во
+    временный файл, fsync и переименование. Сегменты повторяются в порядке
+    создания, каждый в своей транзакции, и удаляются после успешной записи.
+    Сегмент, который не читается или не записывается из-за ошибки в данных
+    (не недоступности БД), переносится в подкаталог quarantine, чтобы не
+    задерживать остальные. Одновременные повторы из одного процесса
+    выполняются по очереди
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._replay_lock = asyncio.Lock()
+
+    def append(self, batch: list[tuple]) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"segment-{datetime.datetime.now():%Y%m%d-%H%M%S-%f}-{os.getpid()}"
+        path = os.path.join(self.directory, name + SEGMENT_SUFFIX)
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "wb") as file:
+            with gzip.GzipFile(fileobj=file, mode="wb") as compressed:
+                pickle.dump(batch, compressed, protocol=pickle.HIGHEST_PROTOCOL)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, path)
+        metrics.increment("spool.segments_written")
+        return path
+
+    def segments(self) -> list[str]:
+        return sorted(glob.glob(os.path.join(self.directory, "*" + SEGMENT_SUFFIX)))
+
+    def quarantined(self) -> list[str]:
+        return sorted(
+            glob.glob(os.path.join(self.directory, QUARANTINE_DIR, "*" + SEGMENT_SUFFIX))
+        )
+
+    @staticmethod
+    def read(path: str) -> list[tuple]:
+        with gzip.open(path, "rb") as file:
+            return pickle.load(file)
+
+    async def replay(self, db_client) -> int:
+        """
+        Запись сохраненных пакетов в БД. Возвращает число записанных
+        сегментов; при недоступности БД сегмент и следующие за ним остаются
+        на диске
+        """
+        async with self._replay_lock:
+            replayed = 0
+            for path in self.segments():
+                try:
+                    batch = self.read(path)
+                except Exception as e:
+                    self._quarantine(path, e)
+                    continue
+                try:
+                    async with db_client.pool.acquire() as connection:
+                        async with connection.transaction():
+                            for name, args, kwargs in batch:
+                                if name in COPY_OPERATIONS:
+                                    await self._copy(connection, name, *args, **kwargs)
+                                else:
+                                    operation = getattr(db_client, name)
+                                    await operation(*args, connection=connection, **kwargs)
+                except CONNECTION_ERRORS:
+                    raise
+                except Exception as e:
+                    self._quarantine(path, e)
+                    continue
+                os.remove(path)
+                replayed += 1
+                metrics.increment("spool.segments_replayed")
+                logger.info(f"Пакет {os.path.basename(path)} записан: операций {len(batch)}")
+            return replayed
+
+    def _quarantine(self, path: str, error: Exception) -> None:
+        quarantine_dir = os.path.join(self.directory, QUARANTINE_DIR)
+        os.makedirs(quarantine_dir, exist_ok=True)
+        target = os.path.join(quarantine_dir, os.path.basename(path))
+        shutil.move(path, target)
+        metrics.increment("spool.segments_quarantined")
+        logger.error(
+            f"Пакет {os.path.basename(path)} не записан ({error!r}) и перенесен в {target}, "
+            f"требуется разбор вручную",
+            exc_info=error,
+        )
+
+    @staticmethod
+    async def _copy(
+        connection,
+        name,
+        table_name,
+        data,
+        conflict_target=None,
+        update_fields=None,
+    ) -> None:
+        """
+        Запись строк через COPY во временную таблицу и один INSERT ... SELECT
+        с той же обработкой конфликтов, что у insert_data/insert_update_data
+        """
+        if isinstance(data, dict):
+            data = [data]
+        if not data:
+            return
+        conflict = "ON CONFLICT DO NOTHING"
+        if name == "insert_update_data" and conflict_target and update_fields:
+            key_columns = await connection.fetchval(
+                CONSTRAINT_COLUMNS_QUERY, table_name, conflict_target
+            )
+            # Одна команда INSERT не может дважды обновить одну строку:
+            # из повторов ключа остается последний, как при построчной записи
+            data = list({tuple(item[key] for key in key_columns): item for item in data}.values())
+            update_expressions = ", ".join(
+                f"{field} = EXCLUDED.{field}" for field in update_fields
+            )
+            conflict = (
+                f"ON CONFLICT ON CONSTRAINT {conflict_target} DO UPDATE SET {update_expressions}"
+            )
+        keys = list(data[0].keys())
+        columns = ", ".join(keys)
+        # Только записываемые колонки, без умолчаний: LIKE скопировал бы
+        # nextval() для id, и каждая строка расходовала бы номер таблицы
+        await connection.execute(
+            f"CREATE TEMP TABLE spool_staging ON COMMIT DROP AS "
+            f"SELECT {columns} FROM {table_name} WITH NO DATA"
+        )
+        await connection.copy_records_to_table(
+            "spool_staging",
+            records=[tuple(item[key] for key in keys) for item in data],
+            columns=keys,
+        )
+        await connection.execute(
+            f"INSERT INTO {table_name} ({columns}) SELECT {columns} FROM spool_staging {conflict}"
+        )
+        await connection.execute("DROP TABLE spool_staging")
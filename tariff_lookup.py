@@ -0,0 +1,349 @@
+import asyncio
+import datetime
+import functools
+import json
+import logging
+import os
+from bisect import bisect_left, bisect_right
+
+from aiohttp import web
+
+from change_feed import ChangeFeedSubscriber
+from db_client import DBClient
+from slot_finder import SlotFinder
+
+logger = logging.getLogger(__name__)
+
+
+class TariffIndex:
+    """
+    Снимок одной таблицы в памяти: для каждого ключа отсортированные
+    по дате массивы дат и строк. Поиск по дате - бинарный.
+    asof=True - на дату возвращается последняя строка не позже этой даты
+    (для таблиц, где строка пишется только при изменении значения)
+    """
+
+    def __init__(self, table_name: str, key_fields: tuple, asof: bool = False):
+        self.table_name = table_name
+        self.key_fields = key_fields
+        self.asof = asof
+        self.max_date = None
+        self._dates = {}
+        self._rows = {}
+
+    def __len__(self):
+        return sum(len(dates) for dates in self._dates.values())
+
+    def load(self, records, since: datetime.date = None) -> None:
+        """
+        Загрузка строк, отсортированных по дате. Если указан since,
+        ранее загруженные строки начиная с этой даты заменяются новыми
+        """
+        if since is not None:
+            for key, dates in self._dates.items():
+                position = bisect_left(dates, since)
+                del dates[position:]
+                del self._rows[key][position:]
+        for record in records:
+            key = tuple(record[field] for field in self.key_fields)
+            date = record["date"]
+            self._dates.setdefault(key, []).append(date)
+            self._rows.setdefault(key, []).append(dict(record))
+            if self.max_date is None or date > self.max_date:
+                self.max_date = date
+
+    def upsert(self, records) -> None:
+        """
+        Вставка или замена отдельных строк по ключу и дате
+        """
+        for record in records:
+            key = tuple(record[field] for field in self.key_fields)
+            date = record["date"]
+            dates = self._dates.setdefault(key, [])
+            rows = self._rows.setdefault(key, [])
+            position = bisect_left(dates, date)
+            if position < len(dates) and dates[position] == date:
+                rows[position] = dict(record)
+            else:
+                dates.insert(position, date)
+                rows.insert(position, dict(record))
+            if self.max_date is None or date > self.max_date:
+                self.max_date = date
+
+    def get(self, key: tuple, date: datetime.date):
+        dates = self._dates.get(key)
+        if not dates:
+            return None
+        position = bisect_right(dates, date) - 1
+        if position < 0 or (not self.asof and dates[position] != date):
+            return None
+        return self._rows[key][position]
+
+    def get_range(self, key: tuple, date_from: datetime.date, date_to: datetime.date) -> list[dict]:
+        dates = self._dates.get(key)
+        if not dates:
+            return []
+        start = bisect_left(dates, date_from)
+        end = bisect_right(dates, date_to)
+        return self._rows[key][start:end]
+
+    def latest(self, key: tuple):
+        rows = self._rows.get(key)
+        return rows[-1] if rows else None
+
+
+class TariffLookupService:
+    """
+    Индексированный снимок тарифов, коэффициентов приемки, тарифов возврата
+    и комиссий для быстрых точечных и диапазонных запросов без обращения к БД
+    """
+
+    KEY_TYPES = {"acceptance_type": int}
+
+    def __init__(self, db_client: DBClient, history_days: int = None):
+        self._db_client = db_client
+        self._history_days = history_days
+        self.indexes = {
+            "warehouse_tariffs": TariffIndex(
+                db_client.source_table("wb_warehouses_tariffs"), ("warehouse_name",)
+            ),
+            "acceptance_coefficients": TariffIndex(
+                "wb_acceptance_coefficients", ("warehouse_name", "acceptance_type")
+            ),
+            "return_tariffs": TariffIndex(
+                db_client.source_table("wb_return_tariffs"), ("warehouse_name",)
+            ),
+            "commission_rates": TariffIndex(
+                db_client.source_table("wb_commission_rates"),
+                ("category_name", "item_name"),
+                asof=True,
+            ),
+        }
+
+    async def refresh(self) -> None:
+        """
+        Догрузка новых дат. Строки начиная с min(последняя загруженная дата,
+        сегодня) перечитываются, так как тарифы на будущие даты обновляются
+        """
+        today = datetime.date.today()
+        for name, index in self.indexes.items():
+            if index.max_date is None:
+                since = (
+                    today - datetime.timedelta(days=self._history_days)
+                    if self._history_days
+                    else None
+                )
+            else:
+                since = min(index.max_date, today)
+            query = f"SELECT * FROM {index.table_name}"
+            args = []
+            if since is not None:
+                query += " WHERE date >= $1"
+                args.append(since)
+            query += " ORDER BY date"
+            records = await self._db_client.pool.fetch(query, *args)
+            index.load(records, since=since if index.max_date else None)
+            logger.info(f"{name}: загружено {len(records)} строк, всего {len(index)}")
+
+    async def apply_change(self, change: dict) -> None:
+        """
+        Обновление снимка по уведомлению из канала изменений: перечитываются
+        только строки измененных ключей на измененные даты
+        """
+        if change["dataset"] is None:
+            await self.refresh()
+            return
+        index = self.indexes.get(change["dataset"])
+        if index is None:
+            return
+        records = await self._db_client.pool.fetch(
+            f"SELECT * FROM {index.table_name} WHERE date = ANY($1::date[])",
+            change["dates"],
+        )
+        keys = set(change["keys"])
+        if keys:
+            records = [
+                record for record in records
+                if tuple(record[field] for field in index.key_fields) in keys
+            ]
+        index.upsert(records)
+        logger.info(f"{change['dataset']}: по уведомлению обновлено {len(records)} строк")
+
+    def parse_key(self, dataset: str, params: dict) -> tuple:
+        return tuple(
+            self.KEY_TYPES.get(field, str)(params[field])
+            for field in self.indexes[dataset].key_fields
+        )
+
+    def warehouse_tariff(self, warehouse_name: str, date: datetime.date):
+        return self.indexes["warehouse_tariffs"].get((warehouse_name,), date)
+
+    def warehouse_tariffs_range(
+        self, warehouse_name: str, date_from: datetime.date, date_to: datetime.date
+    ) -> list[dict]:
+        return self.indexes["warehouse_tariffs"].get_range((warehouse_name,), date_from, date_to)
+
+    def acceptance_coefficient(
+        self, warehouse_name: str, date: datetime.date, acceptance_type: int
+    ):
+        return self.indexes["acceptance_coefficients"].get(
+            (warehouse_name, acceptance_type), date
+        )
+
+    def return_tariff(self, warehouse_name: str, date: datetime.date):
+        return self.indexes["return_tariffs"].get((warehouse_name,), date)
+
+    def commission(self, category_name: str, item_name: str, date: datetime.date = None):
+        index = self.indexes["commission_rates"]
+        if date is None:
+            return index.latest((category_name, item_name))
+        return index.get((category_name, item_name), date)
+
+    def lookup_many(self, dataset: str, requests: list[tuple]) -> list:
+        """
+        Пакетный поиск: requests - список пар (ключ, дата)
+        """
+        index = self.indexes[dataset]
+        return [index.get(key, date) for key, date in requests]
+
+
+json_dumps = functools.partial(json.dumps, default=str, ensure_ascii=False)
+
+
+def create_app(
+    service: TariffLookupService,
+    refresh_interval: int = 300,
+    slot_finder: SlotFinder = None,
+) -> web.Application:
+    """
+    Локальный HTTP API поверх снимка:
+    GET /lookup/{dataset}?<ключ>&date=YYYY-MM-DD
+    GET /lookup/{dataset}?<ключ>&date_from=...&date_to=...
+    POST /lookup/{dataset}/batch [{<ключ>, "date": ...}, ...]
+    GET /slots?acceptance_type=2&volume=...[&date_from=...&days=7
+        &max_coefficient=...&storage_days=0&top=10]
+    """
+
+    async def lookup(request: web.Request) -> web.Response:
+        dataset = request.match_info["dataset"]
+        if dataset not in service.indexes:
+            raise web.HTTPNotFound(text=f"Unknown dataset: {dataset}")
+        params = request.query
+        try:
+            key = service.parse_key(dataset, params)
+            if "date_from" in params:
+                result = service.indexes[dataset].get_range(
+                    key,
+                    datetime.date.fromisoformat(params["date_from"]),
+                    datetime.date.fromisoformat(params["date_to"]),
+                )
+            else:
+                result = service.indexes[dataset].get(
+                    key, datetime.date.fromisoformat(params["date"])
+                )
+        except (KeyError, ValueError) as e:
+            raise web.HTTPBadRequest(text=f"Invalid parameters: {e}")
+        return web.json_response(result, dumps=json_dumps)
+
+    async def batch(request: web.Request) -> web.Response:
+        dataset = request.match_info["dataset"]
+        if dataset not in service.indexes:
+            raise web.HTTPNotFound(text=f"Unknown dataset: {dataset}")
+        try:
+            items = await request.json()
+            requests = [
+                (service.parse_key(dataset, item), datetime.date.fromisoformat(item["date"]))
+                for item in items
+            ]
+        except (KeyError, ValueError, TypeError) as e:
+            raise web.HTTPBadRequest(text=f"Invalid parameters: {e}")
+        return web.json_response(service.lookup_many(dataset, requests), dumps=json_dumps)
+
+    async def slots(request: web.Request) -> web.Response:
+        params = request.query
+        try:
+            result = slot_finder.find(
+                int(params["acceptance_type"]),
+                float(params["volume"]),
+                date_from=(
+                    datetime.date.fromisoformat(params["date_from"])
+                    if "date_from" in params
+                    else None
+                ),
+                days=int(params.get("days", 7)),
+                max_coefficient=(
+                    int(params["max_coefficient"]) if "max_coefficient" in params else None
+                ),
+                storage_days=int(params.get("storage_days", 0)),
+                top=int(params.get("top", 10)),
+            )
+        except (KeyError, ValueError) as e:
+            raise web.HTTPBadRequest(text=f"Invalid parameters: {e}")
+        return web.json_response(result, dumps=json_dumps)
+
+    async def refresh_periodically(app: web.Application):
+        async def refresh_loop():
+            while True:
+                await asyncio.sleep(refresh_interval)
+                try:
+                    await service.refresh()
+                    if slot_finder is not None:
+                        await slot_finder.refresh()
+                except Exception as e:
+                    logger.error(f"Не удалось обновить снимок тарифов: {e}")
+
+        task = asyncio.create_task(refresh_loop())
+        yield
+        task.cancel()
+
+    app = web.Application()
+    app.router.add_get("/lookup/{dataset}", lookup)
+    app.router.add_post("/lookup/{dataset}/batch", batch)
+    if slot_finder is not None:
+        app.router.add_get("/slots", slots)
+    app.cleanup_ctx.append(refresh_periodically)
+    return app
+
+
+async def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(filename)s:%(lineno)d #%(levelname)-8s "
+               "[%(asctime)s] - %(name)s - %(message)s",
+    )
+    db_client = DBClient()
+    await db_client.create_pool()
+    logger.info("Database connected")
+
+    history_days = os.getenv("LOOKUP_HISTORY_DAYS")
+    service = TariffLookupService(db_client, int(history_days) if history_days else None)
+    await service.refresh()
+    slot_finder = SlotFinder(db_client)
+    await slot_finder.refresh()
+    # Изменения приходят через NOTIFY, периодическое обновление - страховка
+    subscriber = ChangeFeedSubscriber(db_client)
+    subscriber.subscribe(service.apply_change)
+    subscriber.subscribe(slot_finder.apply_change)
+    await subscriber.start()
+
+    app = create_app(
+        service, int(os.getenv("LOOKUP_REFRESH_SECONDS", "300")), slot_finder=slot_finder
+    )
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(
+        runner, os.getenv("LOOKUP_HOST", "127.0.0.1"), int(os.getenv("LOOKUP_PORT", "8080"))
+    )
+    await site.start()
+    logger.info("Tariff lookup API started")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await subscriber.close()
+        await runner.cleanup()
+        await db_client.close_pool()
+        logger.info("Database disconnected")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
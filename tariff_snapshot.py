@@ -0,0 +1,371 @@
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import mmap
+import os
+import struct
+
+import numpy as np
+from dotenv import load_dotenv
+
+from cost_calculator import category_key
+from db_client import DBClient
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PATH = os.getenv("TARIFF_SNAPSHOT_PATH", "")
+# Сколько дней истории до сегодня попадает в матрицы снимка
+SNAPSHOT_HISTORY_DAYS = int(os.getenv("TARIFF_SNAPSHOT_HISTORY_DAYS", "30"))
+
+MAGIC = b"WBTSNAP1"
+# Сигнатура и длина JSON-заголовка
+PREAMBLE = struct.Struct("<8sQ")
+ALIGNMENT = 64
+EPOCH = datetime.date(1970, 1, 1)
+
+WAREHOUSE_TARIFF_COLUMNS = (
+    "box_delivery_and_storage_expr",
+    "box_delivery_base",
+    "box_delivery_liter",
+    "box_storage_base",
+    "box_storage_liter",
+    "pallet_delivery_expr",
+    "pallet_delivery_value_base",
+    "pallet_delivery_value_liter",
+    "pallet_storage_value_expr",
+)
+RETURN_TARIFF_COLUMNS = (
+    "delivery_dump_sup_office_base",
+    "delivery_dump_sup_office_liter",
+    "delivery_dump_sup_courier_base",
+    "delivery_dump_sup_courier_liter",
+    "delivery_dump_kgt_office_base",
+    "delivery_dump_kgt_office_liter",
+)
+COMMISSION_COLUMNS = ("fbo_rate", "fbs_rate", "china_rate")
+
+
+class TariffSnapshotExporter:
+    """
+    Выгрузка тарифов в бинарный снимок для чтения через mmap:
+    - матрицы дата x склад по колонкам тарифов складов и тарифов возврата;
+    - коэффициенты приемки: тип x дата x склад;
+    - последние комиссии по предметам.
+    Числа хранятся массивами фиксированной ширины (float64, пропуск - NaN),
+    строки - словарями в JSON-заголовке. Файл пишется рядом с целевым и
+    подменяет его переименованием, поэтому читатели видят либо старую, либо
+    новую версию целиком
+    """
+
+    def __init__(self, db_client: DBClient, history_days: int = SNAPSHOT_HISTORY_DAYS):
+        self._db_client = db_client
+        self._history_days = history_days
+
+    async def export(self, path: str) -> int:
+        date_from = datetime.date.today() - datetime.timedelta(days=self._history_days)
+        tariffs_source = self._db_client.source_table("wb_warehouses_tariffs")
+        returns_source = self._db_client.source_table("wb_return_tariffs")
+        commissions_source = self._db_client.source_table("wb_commission_rates")
+        async with self._db_client.pool.acquire() as connection:
+            async with connection.transaction(isolation="repeatable_read", readonly=True):
+                tariffs = await connection.fetch(
+                    f"SELECT date, warehouse_name, {', '.join(WAREHOUSE_TARIFF_COLUMNS)} "
+                    f"FROM {tariffs_source} WHERE date >= $1 AND warehouse_name IS NOT NULL",
+                    date_from,
+                )
+                returns = await connection.fetch(
+                    f"SELECT date, warehouse_name, {', '.join(RETURN_TARIFF_COLUMNS)} "
+                    f"FROM {returns_source} WHERE date >= $1 AND warehouse_name IS NOT NULL",
+                    date_from,
+                )
+                acceptance = await connection.fetch(
+                    "SELECT date, warehouse_name, acceptance_type, coefficient "
+                    "FROM wb_acceptance_coefficients "
+                    "WHERE date >= $1 AND warehouse_name IS NOT NULL",
+                    date_from,
+                )
+                commissions = await connection.fetch(
+                    "SELECT DISTINCT ON (category_name, item_name) category_name, item_name, "
+                    f"{', '.join(COMMISSION_COLUMNS)} FROM {commissions_source} "
+                    "ORDER BY category_name, item_name, date DESC"
+                )
+
+        rows = tariffs + returns + acceptance
+        warehouses = sorted({row["warehouse_name"] for row in rows})
+        dates = sorted({row["date"] for row in rows})
+        acceptance_types = sorted({row["acceptance_type"] for row in acceptance})
+        warehouse_positions = {name: i for i, name in enumerate(warehouses)}
+        date_positions = {date: i for i, date in enumerate(dates)}
+
+        def positions(records):
+            return (
+                np.array([date_positions[row["date"]] for row in records], dtype=np.int64),
+                np.array(
+                    [warehouse_positions[row["warehouse_name"]] for row in records],
+                    dtype=np.int64,
+                ),
+            )
+
+        arrays = {
+            "dates": np.array(
+                [(date - EPOCH).days for date in dates], dtype=np.int32
+            ),
+        }
+        for prefix, records, columns in (
+            ("warehouse_tariffs", tariffs, WAREHOUSE_TARIFF_COLUMNS),
+            ("return_tariffs", returns, RETURN_TARIFF_COLUMNS),
+        ):
+            date_index, warehouse_index = positions(records)
+            values = np.array(
+                [[row[column] for column in columns] for row in records], dtype=np.float64
+            ).reshape(-1, len(columns))
+            for position, column in enumerate(columns):
+                matrix = np.full((len(dates), len(warehouses)), np.nan)
+                matrix[date_index, warehouse_index] = values[:, position]
+                arrays[f"{prefix}.{column}"] = matrix
+
+        date_index, warehouse_index = positions(acceptance)
+        type_index = np.searchsorted(
+            np.array(acceptance_types, dtype=np.int64),
+            np.array([row["acceptance_type"] for row in acceptance], dtype=np.int64),
+        )
+        coefficients = np.full((len(acceptance_types), len(dates), len(warehouses)), np.nan)
+        coefficients[type_index, date_index, warehouse_index] = np.array(
+            [row["coefficient"] for row in acceptance], dtype=np.float64
+        )
+        arrays["acceptance_coefficients.coefficient"] = coefficients
+
+        commissions = sorted(
+            commissions, key=lambda row: category_key(row["category_name"], row["item_name"])
+        )
+        commission_values = np.array(
+            [[row[column] for column in COMMISSION_COLUMNS] for row in commissions],
+            dtype=np.float64,
+        ).reshape(-1, len(COMMISSION_COLUMNS))
+        for position, column in enumerate(COMMISSION_COLUMNS):
+            arrays[f"commission_rates.{column}"] = np.ascontiguousarray(
+                commission_values[:, position]
+            )
+
+        version = _current_version(path) + 1
+        dictionaries = {
+            "warehouses": warehouses,
+            "acceptance_types": acceptance_types,
+            "categories": [
+                [row["category_name"], row["item_name"]] for row in commissions
+            ],
+        }
+        write_snapshot(path, version, dictionaries, arrays)
+        logger.info(
+            f"Снимок тарифов v{version} записан в {path}: складов {len(warehouses)}, "
+            f"дат {len(dates)}, предметов {len(commissions)}, "
+            f"{os.path.getsize(path) / 1024 / 1024:.1f} МБ"
+        )
+        return version
+
+
+def write_snapshot(path: str, version: int, dictionaries: dict, arrays: dict) -> None:
+    """
+    Формат: сигнатура и длина заголовка, JSON-заголовок (версия, словари,
+    расположение массивов), затем массивы в порядке C, выровненные по 64 байта
+    """
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = _aligned(offset)
+        layout[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset,
+        }
+        offset += array.nbytes
+
+    header = {
+        "version": version,
+        "created_at": datetime.datetime.now().isoformat(),
+        "dictionaries": dictionaries,
+        "arrays": layout,
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False, default=str).encode()
+    data_start = _aligned(PREAMBLE.size + len(header_bytes))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(PREAMBLE.pack(MAGIC, len(header_bytes)))
+        file.write(header_bytes)
+        for name, array in arrays.items():
+            file.seek(data_start + layout[name]["offset"])
+            file.write(np.ascontiguousarray(array).tobytes())
+        file.truncate(data_start + offset)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+
+
+class TariffSnapshot:
+    """
+    Снимок тарифов, открытый через mmap. Массивы - представления numpy над
+    отображенной памятью без копирования и только для чтения, поэтому
+    процессы, открывшие один файл, делят одну копию в page cache.
+    reload() переоткрывает файл, если экспортер подменил его новой версией;
+    представления старой версии остаются рабочими, пока на них есть ссылки
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._open()
+
+    def _open(self) -> None:
+        with open(self.path, "rb") as file:
+            self._inode = os.fstat(file.fileno()).st_ino
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = PREAMBLE.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} не является снимком тарифов")
+        header = json.loads(self._mmap[PREAMBLE.size:PREAMBLE.size + header_length])
+        data_start = _aligned(PREAMBLE.size + header_length)
+
+        self.version = header["version"]
+        self.created_at = datetime.datetime.fromisoformat(header["created_at"])
+        dictionaries = header["dictionaries"]
+        self.warehouses = dictionaries["warehouses"]
+        self.acceptance_types = dictionaries["acceptance_types"]
+        self.categories = [tuple(category) for category in dictionaries["categories"]]
+        self._warehouse_positions = {name: i for i, name in enumerate(self.warehouses)}
+        self._type_positions = {
+            acceptance_type: i for i, acceptance_type in enumerate(self.acceptance_types)
+        }
+        self._category_positions = {category: i for i, category in enumerate(self.categories)}
+
+        self.arrays = {}
+        for name, layout in header["arrays"].items():
+            dtype = np.dtype(layout["dtype"])
+            shape = tuple(layout["shape"])
+            self.arrays[name] = np.frombuffer(
+                self._mmap,
+                dtype=dtype,
+                count=int(np.prod(shape)),
+                offset=data_start + layout["offset"],
+            ).reshape(shape)
+        self.dates = self.arrays["dates"]
+
+    def reload(self) -> bool:
+        """
+        Переоткрытие файла, если он был заменен. Возвращает True при смене версии
+        """
+        if os.stat(self.path).st_ino == self._inode:
+            return False
+        self._open()
+        logger.info(f"Снимок тарифов обновлен до v{self.version}")
+        return True
+
+    def warehouse_index(self, warehouse_name: str) -> int:
+        return self._warehouse_positions.get(warehouse_name, -1)
+
+    def date_index(self, date: datetime.date) -> int:
+        days = (date - EPOCH).days
+        position = int(np.searchsorted(self.dates, days))
+        if position < len(self.dates) and self.dates[position] == days:
+            return position
+        return -1
+
+    def matrix(self, dataset: str, column: str) -> np.ndarray:
+        """
+        Матрица дата x склад (для коэффициентов приемки - тип x дата x склад)
+        """
+        return self.arrays[f"{dataset}.{column}"]
+
+    def warehouse_tariff(self, warehouse_name: str, date: datetime.date):
+        return self._row("warehouse_tariffs", WAREHOUSE_TARIFF_COLUMNS, warehouse_name, date)
+
+    def return_tariff(self, warehouse_name: str, date: datetime.date):
+        return self._row("return_tariffs", RETURN_TARIFF_COLUMNS, warehouse_name, date)
+
+    def acceptance_coefficient(
+        self, warehouse_name: str, date: datetime.date, acceptance_type: int
+    ):
+        type_position = self._type_positions.get(acceptance_type)
+        warehouse_position = self.warehouse_index(warehouse_name)
+        date_position = self.date_index(date)
+        if type_position is None or warehouse_position < 0 or date_position < 0:
+            return None
+        value = self.arrays["acceptance_coefficients.coefficient"][
+            type_position, date_position, warehouse_position
+        ]
+        return None if np.isnan(value) else int(value)
+
+    def commission(self, category_name: str, item_name: str):
+        position = self._category_positions.get((category_name, item_name))
+        if position is None:
+            return None
+        return {
+            column: _value(self.arrays[f"commission_rates.{column}"][position])
+            for column in COMMISSION_COLUMNS
+        }
+
+    def _row(self, dataset: str, columns: tuple, warehouse_name: str, date: datetime.date):
+        warehouse_position = self.warehouse_index(warehouse_name)
+        date_position = self.date_index(date)
+        if warehouse_position < 0 or date_position < 0:
+            return None
+        row = {
+            column: _value(self.arrays[f"{dataset}.{column}"][date_position, warehouse_position])
+            for column in columns
+        }
+        if all(value is None for value in row.values()):
+            return None
+        return row
+
+
+def _aligned(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _value(value):
+    return None if np.isnan(value) else float(value)
+
+
+def _current_version(path: str) -> int:
+    """
+    Версия снимка из заголовка: файл читается без отображения в память,
+    чтобы не оставлять открытым mmap на каждую выгрузку
+    """
+    try:
+        with open(path, "rb") as file:
+            magic, header_length = PREAMBLE.unpack(file.read(PREAMBLE.size))
+            if magic != MAGIC:
+                return 0
+            return json.loads(file.read(header_length))["version"]
+    except (OSError, ValueError, KeyError, struct.error):
+        return 0
+
+
+async def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(filename)s:%(lineno)d #%(levelname)-8s "
+               "[%(asctime)s] - %(name)s - %(message)s",
+    )
+    parser = argparse.ArgumentParser(
+        description="Выгрузка тарифов в бинарный снимок для чтения через mmap"
+    )
+    parser.add_argument("--output", default=SNAPSHOT_PATH or "snapshot/tariffs.snap")
+    parser.add_argument("--history-days", type=int, default=SNAPSHOT_HISTORY_DAYS)
+    args = parser.parse_args()
+
+    db_client = DBClient()
+    await db_client.create_pool()
+    logger.info("Database connected")
+    await TariffSnapshotExporter(db_client, args.history_days).export(args.output)
+    await db_client.close_pool()
+    logger.info("Database disconnected")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,10 +1,49 @@
+import asyncio
+import base64
 import datetime
 import json
+import os
+import random
+import time
 from http import HTTPStatus
 
+from aiohttp import ClientError
 from aiohttp_retry import ExponentialRetry, RetryClient
+from dotenv import load_dotenv
 
-from exceptions import AuthException, FailedGetDataException
+from circuit_breaker import get_breaker
+from datasets import DATASETS, DatasetSpec
+from deadline import Deadline
+from exceptions import AuthException, DeadlineExceededException, FailedGetDataException
+
+load_dotenv()
+
+# Общий для всех селлеров бюджет одновременных запросов авторизации
+AUTH_CONCURRENCY = int(os.getenv("WB_AUTH_CONCURRENCY", "5"))
+# Время жизни токена, если его не удалось прочитать из самого токена
+TOKEN_TTL = int(os.getenv("WB_TOKEN_TTL_SECONDS", "3600"))
+TOKEN_REFRESH_MARGIN = int(os.getenv("WB_TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+TOKEN_REFRESH_JITTER = int(os.getenv("WB_TOKEN_REFRESH_JITTER_SECONDS", "60"))
+# Повтор неудачной авторизации: пауза - случайная в пределах удваивающейся
+# границы, но не больше максимальной; после N неудач подряд обновление
+# прекращается, а ошибка возвращается запросам
+TOKEN_REFRESH_BACKOFF_BASE = float(os.getenv("WB_TOKEN_REFRESH_BACKOFF_BASE_SECONDS", "1"))
+TOKEN_REFRESH_BACKOFF_MAX = float(os.getenv("WB_TOKEN_REFRESH_BACKOFF_MAX_SECONDS", "60"))
+TOKEN_REFRESH_MAX_FAILURES = int(os.getenv("WB_TOKEN_REFRESH_MAX_FAILURES", "5"))
+
+_auth_semaphore = asyncio.Semaphore(AUTH_CONCURRENCY)
+
+
+def token_expires_at(token: str) -> float:
+    """
+    Время истечения токена из поля exp JWT, иначе текущее время + TOKEN_TTL
+    """
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return time.time() + TOKEN_TTL
 
 
 class WbParser:
@@ -13,13 +52,20 @@ class WbParser:
             refresh_token: str,
             supplier_id: str,
             device_id: str,
+            deadline: Deadline = None,
     ):
         retry_options = ExponentialRetry(attempts=5, statuses={429, })
         self._client = RetryClient(raise_for_status=False, retry_options=retry_options)
         self._refresh_token = refresh_token
         self._supplier_id = supplier_id
         self._device_id = device_id
-        self._validation_key_cache = {}
+        self._auth_cookies = None
+        self._expires_at = 0.0
+        self._token_generation = 0
+        self._auth_error = None
+        self._auth_lock = asyncio.Lock()
+        self._refresh_task = None
+        self._deadline = deadline or Deadline()
 
     HEADERS = {
         "Accept": "*/*",
@@ -30,109 +76,191 @@ class WbParser:
     AUTH_URL = "https://seller-auth.wildberries.ru/auth/v2/auth/slide-v3"
 
     @staticmethod
-    async def __handle_response(response) -> dict:
+    async def __handle_response(response, raw: bool = False) -> dict | bytes:
         if response.status == 401:
             raise AuthException("Invalid token")
         if response.status != HTTPStatus.OK:
             error_message = await response.json()
             raise FailedGetDataException(f"Failed to get data, status: {response.status}\nMessage: {error_message}")
+        if raw:
+            return await response.read()
         return await response.json()
 
-    async def __request(self, method: str, url: str, payload: dict = None, cookies: dict = None) -> dict:
+    def start(self) -> None:
         """
-        Метод для получения validation_key и токена для последующих запросов
+        Запуск фонового обновления токена: первая авторизация начинается сразу,
+        следующие - заранее, до истечения токена
         """
-        date = datetime.date.today()
-        if date in self._validation_key_cache:
-            updated_cookies = self._validation_key_cache[date]
-        else:
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self.__refresh_loop())
+
+    async def __authenticate(self, stale_generation: int = None) -> None:
+        """
+        Получение validation_key и токена для последующих запросов.
+        stale_generation - поколение токена, отвергнутого сервером: если токен
+        уже обновили параллельно, повторная авторизация не нужна
+        """
+        async with self._auth_lock:
+            if stale_generation is not None and stale_generation != self._token_generation:
+                return
             initial_cookies = {
                 "wbx-refresh": self._refresh_token,
                 "wbx-seller-device-id": self._device_id,
             }
-            response = await self._client.request("POST", self.AUTH_URL, headers=self.HEADERS, cookies=initial_cookies)
-            response_data = await self.__handle_response(response)
+            async with _auth_semaphore:
+                response = await self.__client_request(
+                    "POST", self.AUTH_URL, headers=self.HEADERS, cookies=initial_cookies
+                )
+                response_data = await self.__handle_response(response)
             validation_key = response.cookies.get("wbx-validation-key").value
             token = response_data["payload"]["access_token"]
-            updated_cookies = {
+            self._auth_cookies = {
                 "wbx-validation-key": validation_key,
                 "WBTokenV3": token,
                 "x-supplier-id-external": self._supplier_id,
                 "x-supplier-id": self._supplier_id
-
             }
-            self._validation_key_cache[date] = updated_cookies
-        updated_cookies.update(cookies) if cookies else None
-        response = await self._client.request(method, url, headers=self.HEADERS, cookies=updated_cookies,
-                                              data=json.dumps(payload) if payload else None)
-        return await self.__handle_response(response)
+            self._expires_at = token_expires_at(token)
+            self._token_generation += 1
+
+    async def __refresh_loop(self) -> None:
+        failures = 0
+        while True:
+            try:
+                await self.__authenticate(stale_generation=self._token_generation)
+            except AuthException as e:
+                # Учетные данные недействительны, повторять бессмысленно
+                self._auth_error = e
+                return
+            except DeadlineExceededException:
+                return
+            except Exception as e:
+                failures += 1
+                if failures >= TOKEN_REFRESH_MAX_FAILURES:
+                    error = FailedGetDataException(
+                        f"Не удалось авторизоваться, неудачных попыток подряд: {failures}: {e!r}"
+                    )
+                    error.__cause__ = e
+                    self._auth_error = error
+                    return
+                backoff = TOKEN_REFRESH_BACKOFF_BASE * 2 ** (failures - 1)
+                await asyncio.sleep(random.uniform(0, min(backoff, TOKEN_REFRESH_BACKOFF_MAX)))
+                continue
+            failures = 0
+            delay = self._expires_at - time.time() - TOKEN_REFRESH_MARGIN
+            await asyncio.sleep(max(delay - random.uniform(0, TOKEN_REFRESH_JITTER), 0))
+
+    async def __get_auth_cookies(self) -> tuple[dict, int]:
+        if self._auth_error:
+            raise self._auth_error
+        if self._auth_cookies is None or self._expires_at <= time.time():
+            await self.__authenticate(stale_generation=self._token_generation)
+        return self._auth_cookies, self._token_generation
+
+    async def __client_request(self, method: str, url: str, **kwargs):
+        """
+        Запрос с повторами в пределах остатка общего лимита времени: таймауты
+        попытки сокращаются до остатка, по его истечении повторы прекращаются
+        """
+        self._deadline.check()
+        try:
+            return await asyncio.wait_for(
+                self._client.request(method, url, timeout=self._deadline.client_timeout(), **kwargs),
+                self._deadline.remaining(),
+            )
+        except asyncio.TimeoutError:
+            self._deadline.check()
+            raise
+
+    async def __send(
+            self, method: str, url: str, payload: dict = None, cookies: dict = None, raw: bool = False
+    ) -> dict | bytes:
+        auth_cookies, generation = await self.__get_auth_cookies()
+        request_cookies = {**auth_cookies, **cookies} if cookies else auth_cookies
+        breaker = get_breaker(url)
+        breaker.before_request()
+        try:
+            response = await self.__client_request(method, url, headers=self.HEADERS, cookies=request_cookies,
+                                                   data=json.dumps(payload) if payload else None)
+        except (ClientError, asyncio.TimeoutError):
+            breaker.record_failure()
+            raise
+        except (asyncio.CancelledError, DeadlineExceededException):
+            breaker.release()
+            raise
+        if response.status >= HTTPStatus.INTERNAL_SERVER_ERROR:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        try:
+            return await self.__handle_response(response, raw)
+        except AuthException as e:
+            e.token_generation = generation
+            raise
+
+    async def __request(
+            self, method: str, url: str, payload: dict = None, cookies: dict = None, raw: bool = False
+    ) -> dict | bytes:
+        """
+        Запрос с токеном из кэша. При 401 токен принудительно обновляется
+        и запрос повторяется один раз. raw=True - тело ответа без разбора JSON
+        """
+        try:
+            return await self.__send(method, url, payload, cookies, raw)
+        except AuthException as e:
+            if not hasattr(e, "token_generation"):
+                raise
+            await self.__authenticate(stale_generation=e.token_generation)
+            return await self.__send(method, url, payload, cookies, raw)
+
+    async def fetch_dataset(
+            self, spec: DatasetSpec, date: datetime.date = None, raw: bool = False
+    ) -> dict | bytes:
+        """
+        Запрос набора данных по его описанию из реестра datasets
+        """
+        url, payload = spec.request(date)
+        return await self.__request(spec.method, url, payload=payload, cookies=spec.cookies, raw=raw)
 
     async def parse_weekly_rating(self) -> dict:
         """
         Парсинг коэфициента логистики и индекса локализации
         """
-        url = (
-            "https://seller.wildberries.ru/ns/categories-info/suppliers"
-            "-portal-analytics/api/v1/weekly-rating"
-        )
-
-        response_data = await self.__request("GET", url)
-        return response_data
+        return await self.fetch_dataset(DATASETS["weekly_rating"])
 
-    async def parse_warehouses_tariffs(self, date=datetime.date.today()) -> dict:
+    async def parse_warehouses_tariffs(self, date=datetime.date.today(), raw: bool = False) -> dict | bytes:
         """
         Парсинг тарифов по ящикам и паллетам на складах
         """
-        url = f"https://seller-weekly-report.wildberries.ru/ns/categories-info/suppliers-portal-analytics/api/v1/tariffs-period?date={date}&short=false"
-        payload = {"box": "asc"}
-        response_data = await self.__request("POST", url, payload=payload)
-        return response_data
+        return await self.fetch_dataset(DATASETS["warehouse_tariffs"], date, raw=raw)
 
-    async def parse_commission_rates(self) -> dict:
+    async def parse_commission_rates(self, raw: bool = False) -> dict | bytes:
         """
         Парсинг коммисий по категориям
         """
-        url = "https://seller.wildberries.ru/ns/categories-info/suppliers-portal-analytics/api/v1/categories"
-        payload = {"sort": "name", "order": "asc"}
-        cookies = {"external-locale": "ru", "locale": "ru",}
-        response_data = await self.__request("POST", url, payload=payload, cookies=cookies)
-        return response_data
+        return await self.fetch_dataset(DATASETS["commission_rates"], raw=raw)
 
-    async def parse_acceptance_coefficients(self, date=datetime.date.today()) -> dict:
+    async def parse_acceptance_coefficients(self, date=datetime.date.today(), raw: bool = False) -> dict | bytes:
         """
         Парсинг коммисий приемки, данные выгружаются на неделю вперед
         По умолчанию идет отсчет от "сегодня" и на 7 дней вперед
         """
-        url = "https://seller-supply.wildberries.ru/ns/sm-supply/supply-manager/api/v1/supply/acceptanceCoefficientsReport"
-        payload = {
-                 "params": {
-                     "dateTo": f"{date+datetime.timedelta(7)}T23:59:00.000Z",
-                     "dateFrom": f"{date}T00:00:00.000Z",
-                 },
-                 "jsonrpc": "2.0",
-                 "id": "json-rpc_10",
-        }
-        response_data = await self.__request("POST", url, payload=payload)
-        return response_data
+        return await self.fetch_dataset(DATASETS["acceptance_coefficients"], date, raw=raw)
 
-    async def return_tariffs(self, date=datetime.date.today()) -> dict:
+    async def return_tariffs(self, date=datetime.date.today(), raw: bool = False) -> dict | bytes:
         """
         Парсинг ставок за логистику по возвратам
         По умолчанию данные выгружаются за "сегодня", доступны на неделю вперед
         """
-        url = f"https://seller-weekly-report.wildberries.ru/ns/categories-info/suppliers-portal-analytics/api/v1/return-tariffs?date={date}"
-        response_data = await self.__request("GET", url)
-        return response_data
-
+        return await self.fetch_dataset(DATASETS["return_tariffs"], date, raw=raw)
 
-    async def parse_categories_data(self) -> dict:
+    async def parse_categories_data(self, raw: bool = False) -> dict | bytes:
         """
         Парсинг всех категорий и подкатегорий
         """
-        url = "https://seller.wildberries.ru/ns/categories-info/suppliers-portal-analytics/api/v1/subjects"
-        cookies = {"external-locale": "ru", "locale": "ru",}
-        response_data = await self.__request("GET", url, cookies=cookies)
-        return response_data
+        return await self.fetch_dataset(DATASETS["categories"], raw=raw)
 
     async def close(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
         await self._client.close()
\ No newline at end of file